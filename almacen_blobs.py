@@ -0,0 +1,154 @@
+import hashlib
+import os
+import re
+import threading
+import time
+
+from archivos_privados import directorio_privado, escribir_privado
+
+# Configuración por defecto del almacén de informes generados. Los informes tienen datos de
+# pacientes: el directorio es de la aplicación, con permisos 0700 (no uno compartido en /tmp)
+BLOBS_DIR = os.environ.get("BLOBS_DIR") or "informes_generados"
+BLOBS_TTL_SEGUNDOS = float(os.environ.get("BLOBS_TTL_SEGUNDOS", str(2 * 3600)))
+BLOBS_MAX_BYTES = int(os.environ.get("BLOBS_MAX_BYTES", str(512 * 1024 * 1024)))
+# Segundos mínimos entre dos limpiezas del directorio
+BLOBS_INTERVALO_LIMPIEZA = 60.0
+
+_CLAVE_VALIDA = re.compile(r"[0-9a-f]{64}")
+
+def _validar(clave):
+    # Las claves y huellas se usan como nombres de archivo: solo hexadecimal SHA-256
+    if not _CLAVE_VALIDA.fullmatch(clave or ""):
+        raise ValueError(f"Clave de archivo inválida: {clave!r}")
+    return clave
+
+class AlmacenBlobs:
+    """Almacén en disco de archivos direccionados por contenido (SHA-256 de los bytes).
+
+    Un mismo informe se guarda una sola vez aunque lo generen varias sesiones. Los
+    archivos que no se leen ni se vuelven a guardar durante `ttl_segundos` se
+    eliminan, y si el directorio supera `max_bytes` se eliminan primero los usados
+    hace más tiempo. Varios procesos del mismo usuario pueden compartir el directorio:
+    cada archivo se escribe en un temporal y se renombra. El directorio se crea con
+    permisos 0700 y los archivos con 0600.
+
+    Además guarda un índice huella de entrada -> clave (asociar/buscar), para devolver
+    el archivo ya generado a partir de los datos que lo producen, sin volver a generarlo."""
+
+    def __init__(self, directorio=BLOBS_DIR, ttl_segundos=BLOBS_TTL_SEGUNDOS, max_bytes=BLOBS_MAX_BYTES):
+        # Ruta absoluta: la misma se pasa a los procesos que generan los informes
+        self.directorio = os.path.abspath(directorio)
+        self.ttl_segundos = ttl_segundos
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._ultima_limpieza = 0.0
+        self._directorio_indice = os.path.join(self.directorio, "indice")
+        directorio_privado(self.directorio)
+        directorio_privado(self._directorio_indice)
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, _validar(clave))
+
+    def _ruta_indice(self, huella):
+        return os.path.join(self._directorio_indice, _validar(huella))
+
+    def guardar(self, datos):
+        """Guarda los bytes y devuelve su clave."""
+        clave = hashlib.sha256(datos).hexdigest()
+        ruta = self._ruta(clave)
+        if os.path.exists(ruta):
+            # Ya estaba: se renueva su vencimiento
+            os.utime(ruta)
+        else:
+            escribir_privado(ruta, datos)
+        self.limpiar_si_corresponde()
+        return clave
+
+    def leer(self, clave):
+        """Devuelve los bytes del archivo (una copia completa en memoria), o None si ya no existe."""
+        ruta = self._ruta(clave)
+        try:
+            with open(ruta, "rb") as archivo:
+                os.utime(archivo.fileno())
+                return archivo.read()
+        except FileNotFoundError:
+            return None
+
+    def asociar(self, huella, clave):
+        """Registra que los datos con esta huella producen el archivo `clave`."""
+        escribir_privado(self._ruta_indice(huella), _validar(clave).encode("ascii"))
+
+    def buscar(self, huella):
+        """Devuelve {"clave", "bytes"} del archivo asociado a la huella, o None si no hay
+        o el archivo ya se eliminó."""
+        ruta_indice = self._ruta_indice(huella)
+        try:
+            with open(ruta_indice, encoding="ascii") as archivo:
+                clave = archivo.read().strip()
+            ruta = self._ruta(clave)
+            os.utime(ruta)
+            os.utime(ruta_indice)
+            return {"clave": clave, "bytes": os.path.getsize(ruta)}
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def eliminar(self, clave):
+        try:
+            os.remove(self._ruta(clave))
+        except FileNotFoundError:
+            pass
+
+    def _archivos(self):
+        archivos = []
+        with os.scandir(self.directorio) as entradas:
+            for entrada in entradas:
+                if _CLAVE_VALIDA.fullmatch(entrada.name):
+                    try:
+                        estado = entrada.stat()
+                    except FileNotFoundError:
+                        continue
+                    archivos.append((estado.st_mtime, estado.st_size, entrada.path))
+        return archivos
+
+    def limpiar_si_corresponde(self):
+        with self._lock:
+            ahora = time.monotonic()
+            if ahora - self._ultima_limpieza < BLOBS_INTERVALO_LIMPIEZA:
+                return
+            self._ultima_limpieza = ahora
+        self.limpiar()
+
+    def limpiar(self):
+        """Elimina los archivos vencidos y, si hace falta, los menos usados hasta quedar bajo max_bytes."""
+        limite = time.time() - self.ttl_segundos
+        vigentes = []
+        for modificado, tamano, ruta in self._archivos():
+            if modificado < limite:
+                self._quitar(ruta)
+            else:
+                vigentes.append((modificado, tamano, ruta))
+        total = sum(tamano for _, tamano, _ in vigentes)
+        for _, tamano, ruta in sorted(vigentes):
+            if total <= self.max_bytes:
+                break
+            self._quitar(ruta)
+            total -= tamano
+        # Entradas del índice vencidas (las que apuntan a archivos eliminados se ignoran al buscar)
+        with os.scandir(self._directorio_indice) as entradas:
+            for entrada in entradas:
+                try:
+                    if entrada.stat().st_mtime < limite:
+                        self._quitar(entrada.path)
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def _quitar(ruta):
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+
+    def estadisticas(self):
+        archivos = self._archivos()
+        return {"archivos": len(archivos), "bytes": sum(tamano for _, tamano, _ in archivos), "max_bytes": self.max_bytes}
@@ -0,0 +1,137 @@
+import datetime
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from archivos_privados import archivo_privado
+
+# Ruta de la base de datos de evaluaciones (datos de pacientes: archivo 0600 en un directorio 0700)
+EVALUACIONES_DB = os.environ.get("EVALUACIONES_DB", os.path.join("datos", "evaluaciones.db"))
+# Ubicación anterior por defecto, en el directorio de la aplicación
+_EVALUACIONES_DB_ANTERIOR = "evaluaciones.db"
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS evaluaciones (
+    run TEXT NOT NULL,
+    fecha_evaluacion TEXT NOT NULL,
+    psicologa TEXT NOT NULL DEFAULT '',
+    nombre_completo TEXT NOT NULL DEFAULT '',
+    datos TEXT NOT NULL,
+    actualizado REAL NOT NULL,
+    PRIMARY KEY (run, fecha_evaluacion)
+);
+CREATE INDEX IF NOT EXISTS idx_evaluaciones_fecha ON evaluaciones (fecha_evaluacion);
+CREATE INDEX IF NOT EXISTS idx_evaluaciones_psicologa ON evaluaciones (psicologa, fecha_evaluacion);
+"""
+
+# Sentencias fijas: sqlite3 las compila una vez por conexión y reutiliza el plan
+_SQL_GUARDAR = """
+INSERT INTO evaluaciones (run, fecha_evaluacion, psicologa, nombre_completo, datos, actualizado)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (run, fecha_evaluacion) DO UPDATE SET
+    psicologa = excluded.psicologa,
+    nombre_completo = excluded.nombre_completo,
+    datos = excluded.datos,
+    actualizado = excluded.actualizado
+"""
+_SQL_CARGAR = "SELECT datos FROM evaluaciones WHERE run = ? AND fecha_evaluacion = ?"
+_SQL_RESUMEN = "SELECT run, fecha_evaluacion, nombre_completo, psicologa, actualizado FROM evaluaciones"
+_SQL_POR_RUN = _SQL_RESUMEN + " WHERE run = ? ORDER BY fecha_evaluacion DESC"
+_SQL_POR_PSICOLOGA = _SQL_RESUMEN + " WHERE psicologa = ? ORDER BY fecha_evaluacion DESC LIMIT ?"
+_SQL_POR_FECHA = _SQL_RESUMEN + " WHERE fecha_evaluacion BETWEEN ? AND ? ORDER BY fecha_evaluacion DESC LIMIT ?"
+
+# Función para normalizar un R.U.N. (sin puntos, guion ni espacios y con K mayúscula)
+def normalizar_run(run):
+    return re.sub(r"[^0-9kK]", "", str(run or "")).upper()
+
+# Función para convertir la fecha de evaluación del formulario (dd-mm-aaaa) a ISO
+def fecha_iso(fecha_evaluacion):
+    """Las fechas se guardan en ISO para que el índice permita ordenar y buscar por rango."""
+    if isinstance(fecha_evaluacion, datetime.date):
+        return fecha_evaluacion.isoformat()
+    return datetime.datetime.strptime(fecha_evaluacion, '%d-%m-%Y').date().isoformat()
+
+def _fila_a_resumen(fila):
+    run, fecha, nombre, psicologa, actualizado = fila
+    return {
+        "run": run,
+        "fecha_evaluacion": datetime.date.fromisoformat(fecha).strftime('%d-%m-%Y'),
+        "nombre_completo": nombre,
+        "psicologa": psicologa,
+        "actualizado": actualizado
+    }
+
+# Función para mover la base de la ubicación anterior por defecto a la actual
+def _migrar_ubicacion_anterior(ruta):
+    if os.path.exists(ruta) or not os.path.exists(_EVALUACIONES_DB_ANTERIOR):
+        return
+    archivo_privado(ruta)
+    # Con WAL, lo último escrito puede estar todavía en el archivo -wal: se pasa a la base
+    with sqlite3.connect(_EVALUACIONES_DB_ANTERIOR) as conexion:
+        conexion.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conexion.close()
+    os.replace(_EVALUACIONES_DB_ANTERIOR, ruta)
+    os.chmod(ruta, 0o600)
+    for sufijo in ("-wal", "-shm"):
+        if os.path.exists(_EVALUACIONES_DB_ANTERIOR + sufijo):
+            os.remove(_EVALUACIONES_DB_ANTERIOR + sufijo)
+
+class AlmacenEvaluaciones:
+    """Almacén SQLite de evaluaciones, identificadas por R.U.N. y fecha de evaluación.
+
+    Cada hilo usa su propia conexión. El modo WAL permite leer mientras otra sesión
+    escribe, de modo que varios profesionales no se bloquean entre sí al guardar."""
+
+    def __init__(self, ruta=EVALUACIONES_DB):
+        self.ruta = ruta
+        self._local = threading.local()
+        if ruta == EVALUACIONES_DB and "EVALUACIONES_DB" not in os.environ:
+            _migrar_ubicacion_anterior(ruta)
+        archivo_privado(ruta)
+        self._conexion().executescript(_ESQUEMA)
+
+    def _conexion(self):
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=5, cached_statements=32)
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            self._local.conexion = conexion
+        return conexion
+
+    def guardar(self, form_data):
+        """Guarda (o actualiza) la evaluación. Devuelve False si aún no tiene R.U.N. o fecha."""
+        run = normalizar_run(form_data.get('run'))
+        if not run or not form_data.get('fecha_evaluacion'):
+            return False
+        conexion = self._conexion()
+        with conexion:
+            conexion.execute(_SQL_GUARDAR, (
+                run,
+                fecha_iso(form_data['fecha_evaluacion']),
+                form_data.get('psicologa', ''),
+                form_data.get('nombre_completo', ''),
+                json.dumps(form_data, ensure_ascii=False, default=str),
+                time.time()
+            ))
+        return True
+
+    def cargar(self, run, fecha_evaluacion):
+        """Devuelve el form_data guardado, o None si no existe."""
+        fila = self._conexion().execute(_SQL_CARGAR, (normalizar_run(run), fecha_iso(fecha_evaluacion))).fetchone()
+        return json.loads(fila[0]) if fila else None
+
+    def buscar_por_run(self, run):
+        filas = self._conexion().execute(_SQL_POR_RUN, (normalizar_run(run),)).fetchall()
+        return [_fila_a_resumen(fila) for fila in filas]
+
+    def buscar_por_psicologa(self, psicologa, limite=50):
+        filas = self._conexion().execute(_SQL_POR_PSICOLOGA, (psicologa, limite)).fetchall()
+        return [_fila_a_resumen(fila) for fila in filas]
+
+    def buscar_por_fecha(self, desde, hasta, limite=200):
+        filas = self._conexion().execute(_SQL_POR_FECHA, (fecha_iso(desde), fecha_iso(hasta), limite)).fetchall()
+        return [_fila_a_resumen(fila) for fila in filas]
@@ -0,0 +1,670 @@
+import email.utils
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cache_ia import clave_cache
+from circuito_api import CircuitoAPI
+from metricas import REGISTRO
+
+# Endpoint y versión de la API de mensajes de Anthropic
+# (ANTHROPIC_API_URL permite apuntar a un servidor local, p. ej. stub_anthropic.py)
+API_URL = os.environ.get("ANTHROPIC_API_URL", "https://api.anthropic.com/v1/messages")
+API_VERSION = "2023-06-01"
+
+# Modelo y plantilla del prompt usados para mejorar la redacción
+MODELO = "claude-3-haiku-20240307"
+PLANTILLA_PROMPT = "Por favor, corrige errores gramaticales y mejora la redacción del siguiente texto para un informe psicológico, manteniendo toda la información original pero haciéndolo más profesional y claro:\n\n{texto}"
+
+# Respuesta estructurada: se obliga al modelo a usar esta herramienta, cuyo único campo es
+# el texto mejorado, para que no agregue introducciones ni comentarios
+SALIDA_ESTRUCTURADA = os.environ.get("ANTHROPIC_SALIDA_ESTRUCTURADA", "1") != "0"
+CAMPO_TEXTO = "texto_mejorado"
+HERRAMIENTA_TEXTO = {
+    "name": "entregar_texto_mejorado",
+    "description": "Entrega el texto mejorado, listo para copiarse en el informe, sin introducciones, títulos ni comentarios.",
+    "input_schema": {
+        "type": "object",
+        "properties": {CAMPO_TEXTO: {"type": "string", "description": "Texto corregido y mejorado."}},
+        "required": [CAMPO_TEXTO]
+    }
+}
+
+# Respaldo para respuestas en texto libre (las estructuradas no traen introducciones):
+# una línea inicial que presenta el texto corregido ("Aquí está el texto corregido:", un
+# título "Informe Psicológico" suelto) o un párrafo final que comenta la propia corrección.
+# Solo se buscan en los bordes del texto y deben hablar del texto o de su redacción, para no
+# tocar contenido clínico como "Los cambios realizados en su alimentación..."
+_RELLENO_RESPUESTA = re.compile(r"""
+    \A\s*(?:
+        (?:aquí|he\ aquí|a\ continuación|esta\ es|este\ es)\b[^\n:]{0,60}?\b(?:texto|versión|redacción)\b
+            [^\n:]{0,40}?\b(?:corregid|mejorad|revisad|reformulad|editad|correccion|mejora)\w*[^\n:]{0,40}
+            :[ \t]*\n  # línea que presenta el texto corregido
+      | (?:informe\ psicol[oó]gico|texto\ (?:corregido|mejorado|revisado))[ \t]*:?[ \t]*\n  # título suelto
+    )+\s*
+  | \n\s*\n[ \t]*(?:
+        he\ (?:corregido|mejorado|reformulado|revisado|ajustado|realizado)\b[^\n]{0,60}?
+            \b(?:texto|redacción|ortografía|gramática|puntuación|estilo|correcciones)\b
+      | (?:en\ )?esta\ versión\ (?:he|se\ (?:ha|han))\b
+      | (?:los\ )?cambios\ (?:realizados|aplicados|introducidos)\ (?:al|en\ el)\ texto\b
+      | la\ redacción\ (?:es|resulta|queda)\ (?:ahora\ )?más\b
+    )[^\n]*\s*\Z  # comentario final sobre la corrección
+""", re.IGNORECASE | re.VERBOSE)
+
+# Tiempos máximos de espera en segundos: conexión (TCP+TLS) y lectura de la respuesta
+TIMEOUT_CONEXION = float(os.environ.get("ANTHROPIC_TIMEOUT_CONEXION", "5"))
+TIMEOUT_LECTURA = float(os.environ.get("ANTHROPIC_TIMEOUT_LECTURA", "60"))
+
+# Conexiones keep-alive que se conservan abiertas por host
+POOL_CONEXIONES = int(os.environ.get("ANTHROPIC_POOL_CONEXIONES", "10"))
+
+# Máximo de solicitudes simultáneas a la API (1 = una sección tras otra)
+MAX_SOLICITUDES_CONCURRENTES = int(os.environ.get("MAX_SOLICITUDES_CONCURRENTES", "4"))
+
+# Reintentos ante 429, 529, 5xx, timeouts y errores de conexión: cantidad máxima, espera
+# exponencial con jitter (base y tope en segundos) y tiempo total máximo por texto
+REINTENTOS_MAXIMOS = int(os.environ.get("ANTHROPIC_REINTENTOS_MAXIMOS", "3"))
+BACKOFF_BASE = float(os.environ.get("ANTHROPIC_BACKOFF_BASE", "0.5"))
+BACKOFF_MAXIMO = float(os.environ.get("ANTHROPIC_BACKOFF_MAXIMO", "8"))
+PRESUPUESTO_SEGUNDOS = float(os.environ.get("ANTHROPIC_PRESUPUESTO_SEGUNDOS", "90"))
+CODIGOS_REINTENTABLES = {408, 429, 500, 502, 503, 504, 529}
+TIPOS_ERROR_REINTENTABLES = {"overloaded_error", "rate_limit_error", "api_error"}
+
+# Tokens máximos de cada respuesta. Si una respuesta se corta (stop_reason "max_tokens")
+# se pide que continúe donde quedó, hasta MAX_CONTINUACIONES veces
+MAX_TOKENS = int(os.environ.get("ANTHROPIC_MAX_TOKENS", "1024"))
+MAX_CONTINUACIONES = int(os.environ.get("ANTHROPIC_MAX_CONTINUACIONES", "2"))
+
+# Textos más largos que esto se dividen en partes que se mejoran en paralelo
+CARACTERES_POR_FRAGMENTO = int(os.environ.get("ANTHROPIC_CARACTERES_POR_FRAGMENTO", "2000"))
+FRAGMENTOS_CONCURRENTES = int(os.environ.get("ANTHROPIC_FRAGMENTOS_CONCURRENTES", "4"))
+
+# Mostrar el texto mejorado a medida que llega (server-sent events) en lugar de esperar la respuesta completa
+STREAMING = os.environ.get("ANTHROPIC_STREAMING", "1") != "0"
+
+# Circuito compartido por todas las sesiones del proceso
+CIRCUITO = CircuitoAPI()
+
+_cliente_compartido = None
+_lock_cliente = threading.Lock()
+
+# Función para crear el cliente HTTP con pool de conexiones reutilizables
+def crear_cliente_http(pool_conexiones=POOL_CONEXIONES):
+    """Crea una sesión de requests cuyas conexiones se reutilizan entre llamadas."""
+    cliente = requests.Session()
+    # pool_block=False: si hay más solicitudes simultáneas que conexiones en el pool,
+    # se abren conexiones extra que se descartan al terminar en lugar de bloquear
+    adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=pool_conexiones, pool_block=False)
+    cliente.mount("https://", adaptador)
+    cliente.mount("http://", adaptador)
+    cliente.headers.update({
+        "content-type": "application/json",
+        "anthropic-version": API_VERSION
+    })
+    return cliente
+
+# Función para obtener el cliente compartido por todo el proceso
+def obtener_cliente_http():
+    global _cliente_compartido
+    if _cliente_compartido is None:
+        with _lock_cliente:
+            if _cliente_compartido is None:
+                _cliente_compartido = crear_cliente_http()
+    return _cliente_compartido
+
+# Función para quitar introducciones y comentarios del modelo en una sola pasada
+def limpiar_respuesta(texto):
+    return _RELLENO_RESPUESTA.sub("", texto).strip() if texto else texto
+
+def _clave(texto_original):
+    # El formato de respuesta forma parte de la clave: los textos guardados antes de la
+    # salida estructurada pueden traer introducciones
+    plantilla = PLANTILLA_PROMPT + (json.dumps(HERRAMIENTA_TEXTO, sort_keys=True) if SALIDA_ESTRUCTURADA else "")
+    return clave_cache(texto_original, MODELO, plantilla)
+
+# Función para mejorar el texto con la API de Anthropic
+def mejorar_texto_con_anthropic(texto_original, api_key, cliente=None, cache=None):
+    if not api_key or not texto_original:
+        return texto_original, "Se requiere una API key válida y texto para procesar."
+    
+    def calcular():
+        return _mejorar_por_fragmentos(
+            texto_original,
+            lambda indice, fragmento, prefijo, timeout_lectura: _solicitar_mejora(fragmento, api_key, cliente, timeout_lectura, prefijo)
+        )
+    
+    if cache is not None:
+        clave = _clave(texto_original)
+        return cache.obtener_o_calcular(clave, calcular)
+    
+    return calcular()
+
+# Función para mejorar el texto mostrando la respuesta a medida que se genera
+def mejorar_texto_en_streaming(texto_original, api_key, al_recibir, cliente=None, cache=None, al_descartar=None):
+    """Como mejorar_texto_con_anthropic, pero llama a al_recibir(fragmento) con cada trozo de texto
+    y a al_descartar(caracteres) cuando hay que retirar ese número de caracteres del final de
+    lo recibido (una respuesta estructurada cortada que se vuelve a pedir desde el inicio).
+
+    Ambas se ejecutan en el hilo que hace la solicitud. Si el resultado viene de la
+    caché (o de otra solicitud idéntica en curso) se entrega completo en una sola llamada."""
+    if not api_key or not texto_original:
+        return texto_original, "Se requiere una API key válida y texto para procesar."
+    
+    recibido = []
+    def reenviar(fragmento):
+        recibido.append(fragmento)
+        al_recibir(fragmento)
+    
+    def calcular():
+        emisor = _EmisorOrdenado(reenviar, al_descartar)
+        return _mejorar_por_fragmentos(
+            texto_original,
+            lambda indice, fragmento, prefijo, timeout_lectura: _solicitar_mejora_en_streaming(
+                fragmento, api_key, lambda texto: emisor.recibir(indice, texto), cliente, timeout_lectura, prefijo,
+                lambda caracteres: emisor.descartar(indice, caracteres)),
+            emisor
+        )
+    
+    if cache is None:
+        return calcular()
+    
+    clave = _clave(texto_original)
+    texto, error = cache.obtener_o_calcular(clave, calcular)
+    if error is None and not recibido:
+        al_recibir(texto)
+    return texto, error
+
+# Función para dividir un texto largo en partes que quepan en una respuesta
+def dividir_texto(texto, max_caracteres=CARACTERES_POR_FRAGMENTO):
+    """Devuelve [(parte, separador)] cortando entre párrafos y, si un párrafo no cabe, entre
+    oraciones (o, en último caso, entre palabras). `separador` es lo que va después de la
+    parte al volver a unirlas."""
+    piezas = []
+    for parrafo in re.split(r"\n\s*\n", texto.strip()):
+        parrafo = parrafo.strip()
+        if not parrafo:
+            continue
+        if len(parrafo) <= max_caracteres:
+            piezas.append((parrafo, "\n\n"))
+            continue
+        for oracion in _FIN_DE_ORACION.split(parrafo):
+            while len(oracion) > max_caracteres:
+                corte = oracion.rfind(" ", 0, max_caracteres)
+                if corte <= 0:
+                    corte = max_caracteres
+                piezas.append((oracion[:corte], " "))
+                oracion = oracion[corte:].lstrip()
+            piezas.append((oracion, " "))
+        piezas[-1] = (piezas[-1][0], "\n\n")
+    
+    # Agrupar piezas consecutivas mientras quepan en una parte
+    partes = []
+    actual = separador_actual = ""
+    for pieza, separador in piezas:
+        if actual and len(actual) + len(separador_actual) + len(pieza) > max_caracteres:
+            partes.append((actual, separador_actual))
+            actual = pieza
+        else:
+            actual = actual + separador_actual + pieza if actual else pieza
+        separador_actual = separador
+    if actual:
+        partes.append((actual, ""))
+    return partes
+
+_FIN_DE_ORACION = re.compile(r"(?<=[.!?…])\s+")
+
+# Función para mejorar un texto, en paralelo por partes si es largo; devuelve (texto, error)
+def _mejorar_por_fragmentos(texto_original, solicitar, emisor=None):
+    """solicitar(indice, parte, prefijo, timeout_lectura) hace un intento para una parte.
+    Si alguna parte falla se devuelve el texto original completo, nunca una mezcla."""
+    if len(texto_original) > CARACTERES_POR_FRAGMENTO:
+        partes = dividir_texto(texto_original)
+    else:
+        partes = [(texto_original, "")]
+    if emisor is not None:
+        emisor.separadores = [separador for _, separador in partes]
+    
+    def mejorar(indice):
+        parte = partes[indice][0]
+        try:
+            return _mejorar_completo(parte, lambda prefijo, timeout_lectura: solicitar(indice, parte, prefijo, timeout_lectura))
+        finally:
+            if emisor is not None:
+                emisor.terminar(indice)
+    
+    if len(partes) == 1:
+        return mejorar(0)
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(FRAGMENTOS_CONCURRENTES, len(partes)))) as executor:
+        resultados = list(executor.map(mejorar, range(len(partes))))
+    REGISTRO.observar("api_anthropic_partes_por_texto", len(partes))
+    
+    for _, error in resultados:
+        if error:
+            return texto_original, error
+    return "".join(texto.strip() + separador for (texto, _), (_, separador) in zip(resultados, partes)), None
+
+# Función para mejorar una parte, pidiendo que continúe si la respuesta se corta
+def _mejorar_completo(parte, solicitar):
+    """La primera solicitud pide la respuesta estructurada; las continuaciones, texto libre a
+    partir de lo ya recibido. Si alguna parte llegó como texto libre, el resultado se limpia
+    una sola vez, al terminar; la respuesta estructurada se usa tal cual."""
+    acumulado = None
+    texto_libre = False
+    for _ in range(MAX_CONTINUACIONES + 1):
+        # La API rechaza un prefijo del asistente que termine en espacio
+        prefijo = None if acumulado is None else acumulado.rstrip()
+        resultado, error = _con_reintentos(lambda timeout_lectura: solicitar(prefijo, timeout_lectura))
+        if error:
+            return parte, error
+        texto, motivo, estructurado = resultado
+        texto_libre = texto_libre or (bool(texto) and not estructurado)
+        acumulado = (prefijo or "") + texto
+        if motivo != "max_tokens":
+            return (limpiar_respuesta(acumulado) if texto_libre else acumulado), None
+    return parte, "La respuesta superó el largo máximo permitido; se mantiene el texto original."
+
+class _EmisorOrdenado:
+    """Entrega los fragmentos en el orden del texto aunque las partes se mejoren en paralelo:
+    los de la parte en curso pasan directo y los de las siguientes esperan su turno."""
+
+    def __init__(self, al_recibir, al_descartar=None):
+        self.al_recibir = al_recibir
+        self.al_descartar = al_descartar
+        self.separadores = [""]
+        self._actual = 0
+        self._pendientes = {}  # indice -> fragmentos recibidos antes de su turno
+        self._terminadas = set()
+        self._lock = threading.Lock()
+
+    def recibir(self, indice, fragmento):
+        with self._lock:
+            if indice == self._actual:
+                self.al_recibir(fragmento)
+            else:
+                self._pendientes.setdefault(indice, []).append(fragmento)
+
+    def descartar(self, indice, caracteres):
+        """Retira los últimos `caracteres` recibidos de una parte: si aún esperaba su turno
+        se quitan de los pendientes; si es la parte en curso, se avisa a al_descartar."""
+        with self._lock:
+            if indice != self._actual:
+                self._pendientes.pop(indice, None)
+            elif self.al_descartar is not None:
+                self.al_descartar(caracteres)
+
+    def terminar(self, indice):
+        with self._lock:
+            self._terminadas.add(indice)
+            while self._actual in self._terminadas:
+                if self.separadores[self._actual]:
+                    self.al_recibir(self.separadores[self._actual])
+                self._actual += 1
+                for fragmento in self._pendientes.pop(self._actual, []):
+                    self.al_recibir(fragmento)
+
+# Función para obtener el estado del circuito de la API (para mostrarlo en la interfaz)
+def estado_circuito():
+    return CIRCUITO.estado()
+
+class _FalloSolicitud(Exception):
+    """Fallo de un intento. `reintentable` indica si conviene repetirlo y `espera`
+    los segundos pedidos por la API en retry-after (None si no los indicó)."""
+
+    def __init__(self, mensaje, reintentable=False, espera=None):
+        super().__init__(mensaje)
+        self.reintentable = reintentable
+        self.espera = espera
+
+# Función para leer la cabecera retry-after (segundos o fecha HTTP)
+def _segundos_retry_after(response):
+    valor = response.headers.get("retry-after")
+    if not valor:
+        return None
+    try:
+        return max(float(valor), 0.0)
+    except ValueError:
+        try:
+            fecha = email.utils.parsedate_to_datetime(valor)
+            return max(fecha.timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+def _fallo_http(response):
+    return _FalloSolicitud(
+        f"Error al procesar el texto: {response.status_code} - {response.text}",
+        reintentable=response.status_code in CODIGOS_REINTENTABLES,
+        espera=_segundos_retry_after(response)
+    )
+
+# Función para ejecutar una solicitud con reintentos y circuito; devuelve (resultado, error)
+def _con_reintentos(solicitar):
+    """Reintenta los fallos reintentables (429, 5xx, timeouts, conexión) con espera exponencial
+    con jitter, o la indicada en retry-after, sin superar PRESUPUESTO_SEGUNDOS en total.
+    Mientras el circuito está abierto devuelve el texto original sin llamar a la API. Al
+    circuito se le informa un solo resultado por llamada, después de los reintentos."""
+    if not CIRCUITO.permitir():
+        return None, (
+            "La API presenta fallas reiteradas; se mantiene el texto original. "
+            f"Se volverá a intentar en {CIRCUITO.segundos_para_reintentar():.0f} s."
+        )
+    
+    inicio = time.monotonic()
+    intento = 0
+    while True:
+        restante = PRESUPUESTO_SEGUNDOS - (time.monotonic() - inicio)
+        try:
+            resultado = solicitar(max(min(TIMEOUT_LECTURA, restante), 1.0))
+            CIRCUITO.registrar_exito()
+            return resultado, None
+        except _FalloSolicitud as fallo:
+            if not fallo.reintentable:
+                # Errores del cliente (401, 400...): la API responde, el circuito no se ve afectado
+                CIRCUITO.registrar_exito()
+                return None, str(fallo)
+            
+            espera = fallo.espera if fallo.espera is not None else random.uniform(0, min(BACKOFF_MAXIMO, BACKOFF_BASE * 2 ** intento))
+            intento += 1
+            if intento > REINTENTOS_MAXIMOS or time.monotonic() - inicio + espera >= PRESUPUESTO_SEGUNDOS:
+                CIRCUITO.registrar_fallo()
+                return None, str(fallo)
+            REGISTRO.observar("api_anthropic_espera_reintento_segundos", espera)
+            time.sleep(espera)
+
+def _cuerpo_solicitud(texto_original, stream=False, prefijo=None):
+    """prefijo=None es la primera solicitud (estructurada si está activada); un prefijo,
+    aunque sea vacío, pide texto libre que continúa desde él."""
+    data = {
+        "model": MODELO,
+        "max_tokens": MAX_TOKENS,
+        "messages": [
+            {"role": "user", "content": PLANTILLA_PROMPT.format(texto=texto_original)}
+        ]
+    }
+    if prefijo:
+        # Continuación de una respuesta cortada: el modelo sigue desde este texto
+        data["messages"].append({"role": "assistant", "content": prefijo})
+    elif prefijo is None and SALIDA_ESTRUCTURADA:
+        data["tools"] = [HERRAMIENTA_TEXTO]
+        data["tool_choice"] = {"type": "tool", "name": HERRAMIENTA_TEXTO["name"]}
+    if stream:
+        data["stream"] = True
+    return data
+
+def _solicitar_mejora(texto_original, api_key, cliente=None, timeout_lectura=TIMEOUT_LECTURA, prefijo=None):
+    """Un intento de solicitud. Devuelve (texto, stop_reason, estructurado) o lanza _FalloSolicitud."""
+    if cliente is None:
+        cliente = obtener_cliente_http()
+    
+    # La latencia de cada intento se registra junto al estado de la respuesta
+    inicio = time.perf_counter()
+    estado = "error"
+    try:
+        response = cliente.post(
+            API_URL,
+            headers={"x-api-key": api_key},
+            json=_cuerpo_solicitud(texto_original, prefijo=prefijo),
+            timeout=(TIMEOUT_CONEXION, timeout_lectura)
+        )
+        estado = str(response.status_code)
+        
+        if response.status_code != 200:
+            raise _fallo_http(response)
+        response_data = response.json()
+        texto, estructurado = _texto_de_respuesta(response_data)
+        return texto, response_data.get("stop_reason"), estructurado
+    
+    except _FalloSolicitud:
+        raise
+    except requests.exceptions.Timeout:
+        estado = "timeout"
+        raise _FalloSolicitud("La API no respondió dentro del tiempo de espera. Intente nuevamente.", reintentable=True)
+    except requests.exceptions.ConnectionError as e:
+        raise _FalloSolicitud(f"Error al conectar con la API: {str(e)}", reintentable=True)
+    except Exception as e:
+        raise _FalloSolicitud(f"Error al conectar con la API: {str(e)}")
+    finally:
+        REGISTRO.observar("api_anthropic_segundos", time.perf_counter() - inicio, estado=estado)
+
+# Función para obtener (texto, estructurado) de una respuesta completa (estructurada o de texto libre)
+def _texto_de_respuesta(response_data):
+    bloques = response_data.get("content") or []
+    for bloque in bloques:
+        if bloque.get("type") == "tool_use":
+            if response_data.get("stop_reason") == "max_tokens":
+                # JSON cortado: se descarta y se vuelve a pedir como texto libre, que sí puede
+                # continuar (lo mismo que hace el streaming con lo que ya mostró)
+                return "", True
+            texto = (bloque.get("input") or {}).get(CAMPO_TEXTO)
+            if isinstance(texto, str):
+                return texto, True
+            raise _FalloSolicitud("La API no devolvió el texto mejorado en el formato esperado.")
+    return "".join(bloque.get("text", "") for bloque in bloques if bloque.get("type") == "text"), False
+
+_ESCAPES_JSON = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_CARACTERES_SIMPLES_JSON = re.compile(r'[^"\\]+')
+
+class _LectorTextoJSON:
+    """Decodifica de forma incremental el valor de texto_mejorado a medida que llega el JSON
+    de la herramienta (eventos input_json_delta), para poder mostrarlo mientras se genera."""
+
+    def __init__(self, campo=CAMPO_TEXTO):
+        self._inicio_valor = re.compile(r'"%s"\s*:\s*"' % re.escape(campo))
+        self._json = ""
+        self._posicion = None  # primer carácter aún no decodificado del valor
+        self.terminado = False
+
+    def agregar(self, parcial):
+        """Agrega un trozo de JSON y devuelve el texto nuevo que se pudo decodificar."""
+        self._json += parcial
+        if self.terminado:
+            return ""
+        if self._posicion is None:
+            encontrado = self._inicio_valor.search(self._json)
+            if not encontrado:
+                return ""
+            self._posicion = encontrado.end()
+        
+        salida = []
+        datos, i = self._json, self._posicion
+        while i < len(datos):
+            simples = _CARACTERES_SIMPLES_JSON.match(datos, i)
+            if simples:
+                salida.append(simples.group())
+                i = simples.end()
+                continue
+            if datos[i] == '"':
+                self.terminado = True
+                i += 1
+                break
+            # Secuencia de escape: se espera a tenerla completa
+            if i + 1 >= len(datos):
+                break
+            if datos[i + 1] != "u":
+                salida.append(_ESCAPES_JSON.get(datos[i + 1], datos[i + 1]))
+                i += 2
+                continue
+            if i + 6 > len(datos):
+                break
+            codigo = int(datos[i + 2:i + 6], 16)
+            if 0xD800 <= codigo < 0xDC00:
+                # Par sustituto (emojis y otros caracteres fuera del plano básico)
+                if i + 12 > len(datos):
+                    break
+                codigo = 0x10000 + ((codigo - 0xD800) << 10) + (int(datos[i + 8:i + 12], 16) - 0xDC00)
+                i += 6
+            salida.append(chr(codigo))
+            i += 6
+        self._posicion = i
+        return "".join(salida)
+
+    def texto(self):
+        """Valor completo si el JSON terminó de llegar, o None."""
+        try:
+            valor = json.loads(self._json).get(CAMPO_TEXTO)
+        except ValueError:
+            return None
+        return valor if isinstance(valor, str) else None
+
+# Función para recorrer los eventos (nombre, datos) de una respuesta server-sent events
+def _eventos_sse(response):
+    evento, datos = None, []
+    for linea in response.iter_lines(decode_unicode=True):
+        if not linea:
+            if datos:
+                yield evento, json.loads("\n".join(datos))
+            evento, datos = None, []
+        elif linea.startswith("event:"):
+            evento = linea[6:].strip()
+        elif linea.startswith("data:"):
+            datos.append(linea[5:].lstrip())
+
+def _solicitar_mejora_en_streaming(texto_original, api_key, al_recibir, cliente=None, timeout_lectura=TIMEOUT_LECTURA, prefijo=None, al_descartar=None):
+    """Un intento en modo streaming. Una vez entregado algún fragmento, los fallos ya no son
+    reintentables: repetir la solicitud duplicaría el texto mostrado. al_descartar(caracteres)
+    retira el final de lo ya entregado cuando la respuesta estructurada llega cortada."""
+    if cliente is None:
+        cliente = obtener_cliente_http()
+    
+    inicio = time.perf_counter()
+    estado = "error"
+    partes = []
+    motivo = None
+    try:
+        with cliente.post(
+            API_URL,
+            headers={"x-api-key": api_key},
+            json=_cuerpo_solicitud(texto_original, stream=True, prefijo=prefijo),
+            timeout=(TIMEOUT_CONEXION, timeout_lectura),
+            stream=True
+        ) as response:
+            estado = str(response.status_code)
+            if response.status_code != 200:
+                raise _fallo_http(response)
+            
+            # text/event-stream no declara charset y requests asumiría latin-1
+            response.encoding = "utf-8"
+            lector = None
+            for evento, datos in _eventos_sse(response):
+                if evento == "content_block_start" and datos["content_block"].get("type") == "tool_use":
+                    lector = _LectorTextoJSON()
+                elif evento == "content_block_delta":
+                    delta = datos["delta"]
+                    if delta.get("type") == "text_delta":
+                        fragmento = delta["text"]
+                    elif delta.get("type") == "input_json_delta" and lector is not None:
+                        fragmento = lector.agregar(delta.get("partial_json", ""))
+                    else:
+                        continue
+                    if not fragmento:
+                        continue
+                    if not partes:
+                        REGISTRO.observar("api_anthropic_primer_fragmento_segundos", time.perf_counter() - inicio)
+                    partes.append(fragmento)
+                    al_recibir(fragmento)
+                elif evento == "message_delta":
+                    motivo = datos["delta"].get("stop_reason")
+                elif evento == "error":
+                    # p. ej. overloaded_error a mitad de la respuesta
+                    estado = "error_stream"
+                    raise _FalloSolicitud(
+                        f"Error al procesar el texto: {datos['error'].get('message', datos['error'])}",
+                        reintentable=datos["error"].get("type") in TIPOS_ERROR_REINTENTABLES
+                    )
+                elif evento == "message_stop":
+                    if lector is None:
+                        return "".join(partes), motivo, False
+                    # Con el JSON completo se usa su valor decodificado de una vez
+                    completo = lector.texto()
+                    if completo is None and motivo == "max_tokens":
+                        # JSON cortado: igual que sin streaming, se descarta lo mostrado y se
+                        # vuelve a pedir como texto libre
+                        if partes and al_descartar is not None:
+                            al_descartar(len("".join(partes)))
+                        return "", motivo, True
+                    return (completo if completo is not None else "".join(partes)), motivo, True
+            
+            estado = "interrumpido"
+            raise _FalloSolicitud("La respuesta de la API se interrumpió antes de terminar. Intente nuevamente.", reintentable=True)
+    
+    except _FalloSolicitud as fallo:
+        fallo.reintentable = fallo.reintentable and not partes
+        raise
+    except requests.exceptions.Timeout:
+        estado = "timeout"
+        raise _FalloSolicitud("La API no respondió dentro del tiempo de espera. Intente nuevamente.", reintentable=not partes)
+    except requests.exceptions.ConnectionError as e:
+        raise _FalloSolicitud(f"Error al conectar con la API: {str(e)}", reintentable=not partes)
+    except Exception as e:
+        raise _FalloSolicitud(f"Error al conectar con la API: {str(e)}")
+    finally:
+        REGISTRO.observar("api_anthropic_segundos", time.perf_counter() - inicio, estado=estado)
+
+# Función para mejorar varios textos a la vez con un límite de concurrencia
+def mejorar_textos_concurrentemente(textos, api_key, max_concurrencia=MAX_SOLICITUDES_CONCURRENTES, cliente=None, cache=None):
+    """Devuelve una lista de (texto_mejorado, error) en el mismo orden que los textos recibidos."""
+    if cliente is None:
+        cliente = obtener_cliente_http()
+    
+    # Los textos repetidos se envían una sola vez
+    unicos = list(dict.fromkeys(textos))
+    
+    if max_concurrencia <= 1 or len(unicos) <= 1:
+        resultados = [mejorar_texto_con_anthropic(texto, api_key, cliente, cache) for texto in unicos]
+    else:
+        # Las llamadas no usan Streamlit, por lo que pueden ejecutarse fuera del hilo del script
+        with ThreadPoolExecutor(max_workers=min(max_concurrencia, len(unicos))) as executor:
+            resultados = list(executor.map(lambda texto: mejorar_texto_con_anthropic(texto, api_key, cliente, cache), unicos))
+    
+    por_texto = dict(zip(unicos, resultados))
+    return [por_texto[texto] for texto in textos]
+
+# Función para mejorar varios textos a la vez recibiendo los fragmentos a medida que llegan
+def mejorar_textos_en_streaming(textos, api_key, max_concurrencia=MAX_SOLICITUDES_CONCURRENTES, cliente=None, cache=None):
+    """Genera eventos ("fragmento", indice, texto) mientras llegan las respuestas,
+    ("descarte", indice, caracteres) cuando hay que retirar ese número de caracteres del final
+    de lo recibido y ("fin", indice, (texto_mejorado, error)) cuando termina cada texto.
+
+    Las solicitudes se hacen en hilos; los eventos se entregan a través de una cola en el
+    hilo que consume el generador, que es el único que debe tocar la interfaz."""
+    if cliente is None:
+        cliente = obtener_cliente_http()
+    
+    # Los textos repetidos se envían una sola vez y sus eventos se entregan a cada índice
+    indices_por_texto = {}
+    for indice, texto in enumerate(textos):
+        indices_por_texto.setdefault(texto, []).append(indice)
+    
+    cola = queue.Queue()
+    
+    def tarea(texto, indices):
+        def al_recibir(fragmento):
+            for indice in indices:
+                cola.put(("fragmento", indice, fragmento))
+        def al_descartar(caracteres):
+            for indice in indices:
+                cola.put(("descarte", indice, caracteres))
+        try:
+            resultado = mejorar_texto_en_streaming(texto, api_key, al_recibir, cliente, cache, al_descartar)
+        except Exception as e:
+            resultado = (texto, f"Error al conectar con la API: {str(e)}")
+        for indice in indices:
+            cola.put(("fin", indice, resultado))
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrencia, len(indices_por_texto)))) as executor:
+        for texto, indices in indices_por_texto.items():
+            executor.submit(tarea, texto, indices)
+        pendientes = len(textos)
+        while pendientes:
+            evento = cola.get()
+            if evento[0] == "fin":
+                pendientes -= 1
+            yield evento
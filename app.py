@@ -1,11 +1,26 @@
 import streamlit as st
-import pandas as pd
+import copy
 import datetime
-import requests
+import html
 import json
 import os
-from fpdf import FPDF
-import base64
+import secrets
+import sys
+import time
+from api_anthropic import crear_cliente_http, estado_circuito, mejorar_textos_concurrentemente, mejorar_textos_en_streaming, MAX_SOLICITUDES_CONCURRENTES, STREAMING
+from cache_ia import CacheMejoras
+from cola_informes import ColaInformes, EN_COLA, GENERANDO, LISTO, huella_entrada
+from opciones_informe import OPCIONES_INFORME
+from almacen_blobs import AlmacenBlobs
+from almacen_evaluaciones import AlmacenEvaluaciones
+from esquema_formulario import CAMPOS, CAMPOS_POR_PASO, PASOS, RESUMEN, SECCIONES_MEJORABLES, indice_opcion
+from metricas import REGISTRO
+from sesiones import crear_almacen_sesiones
+from diario_autoguardado import crear_diario
+from mejora_por_parrafos import actualizar_historial, ensamblar, planificar, unir
+
+# Inicio de esta ejecución del script, para medir la duración de la recarga
+inicio_recarga = time.perf_counter()
 
 # Configuración de la página con nuevo ícono de psicología
 st.set_page_config(
@@ -40,7 +55,7 @@ st.markdown("""
         border-radius: 5px;
         margin-bottom: 20px;
     }
-    .stButton > button {
+    .stButton > button, .stFormSubmitButton > button {
         background-color: #1E3A8A;
         color: white;
         font-weight: bold;
@@ -61,397 +76,74 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Función para mejorar el texto con la API de Anthropic
-def mejorar_texto_con_anthropic(texto_original, api_key):
-    # Código original sin cambios
-    if not api_key or not texto_original:
-        return texto_original, "Se requiere una API key válida y texto para procesar."
-    
+# Cliente HTTP compartido por todas las sesiones del servidor
+@st.cache_resource
+def obtener_cliente_http():
+    return crear_cliente_http()
+
+# Caché de textos mejorados compartida por todas las sesiones del servidor
+@st.cache_resource
+def obtener_cache_ia():
+    return CacheMejoras()
+
+# Almacén persistente de evaluaciones compartido por todas las sesiones del servidor
+@st.cache_resource
+def obtener_almacen():
+    return AlmacenEvaluaciones()
+
+# Almacén en disco de los informes generados, compartido por todas las sesiones del servidor
+@st.cache_resource
+def obtener_almacen_blobs():
+    return AlmacenBlobs()
+
+# Cola de informes PDF (pool de procesos) compartida por todas las sesiones del servidor
+@st.cache_resource
+def obtener_cola_informes():
+    cola = ColaInformes(directorio_blobs=obtener_almacen_blobs().directorio)
+    cola.iniciar()
+    return cola
+
+# Almacén del estado de las sesiones compartido por todas las sesiones del servidor
+@st.cache_resource
+def obtener_almacen_sesiones():
+    return crear_almacen_sesiones()
+
+# Diario de autoguardado compartido por todas las sesiones del servidor
+@st.cache_resource
+def obtener_diario():
+    return crear_diario()
+
+# Función para guardar la evaluación en curso (requiere R.U.N. y fecha de evaluación)
+def guardar_evaluacion():
     try:
-        headers = {
-            "x-api-key": api_key,
-            "content-type": "application/json",
-            "anthropic-version": "2023-06-01"
-        }
-        
-        data = {
-            "model": "claude-3-haiku-20240307",
-            "max_tokens": 1024,
-            "messages": [
-                {"role": "user", "content": f"Por favor, corrige errores gramaticales y mejora la redacción del siguiente texto para un informe psicológico, manteniendo toda la información original pero haciéndolo más profesional y claro:\n\n{texto_original}"}
-            ]
-        }
-        
-        response = requests.post(
-            "https://api.anthropic.com/v1/messages",
-            headers=headers,
-            json=data
-        )
-        
-        if response.status_code == 200:
-            response_data = response.json()
-            return response_data["content"][0]["text"], None
-        else:
-            return texto_original, f"Error al procesar el texto: {response.status_code} - {response.text}"
-    
+        obtener_almacen().guardar(st.session_state.form_data)
     except Exception as e:
-        return texto_original, f"Error al conectar con la API: {str(e)}"
-
-# Función para generar el informe en PDF mejorado con mejor uso del espacio horizontal
-def generar_pdf(datos):
-    # Limpieza y validación de datos
-    datos_limpios = {}
-    
-    # Asegurar que todos los campos existan con valores predeterminados
-    for campo in [
-        'nombre_completo', 'run', 'fecha_nacimiento', 'edad', 'email', 'telefono',
-        'domicilio', 'prevision', 'escolaridad', 'ocupacion', 'sexo', 'psicologa',
-        'datos_procedimiento', 'fecha_procedimiento', 'familia_nuclear',
-        'situacion_conyugal_padres', 'estado_civil', 'hijos', 'redes_apoyo',
-        'enfermedades_familia', 'antecedentes_natales', 'enfermedades_infancia',
-        'enfermedades_actuales', 'operaciones', 'antecedentes_salud_mental',
-        'estado_salud_mental', 'repitencias', 'rendimiento_academico',
-        'comportamiento_escolar', 'consumo_alcohol', 'consumo_tabaco',
-        'consumo_marihuana', 'consumo_otras_drogas', 'peso_maximo', 'peso_minimo',
-        'peso_ideal', 'altura', 'arfid', 'comedor_emocional', 'anorexia',
-        'comedor_nocturno', 'bulimia', 'picoteador', 't_atracon', 'food_craving',
-        'factores_origen', 'razones_cambiar', 'paciente_apto', 'observaciones',
-        'rut_psicologa'
-    ]:
-        if campo not in datos or datos[campo] is None:
-            datos_limpios[campo] = ""
-        else:
-            # Convertir números a strings para seguridad
-            if isinstance(datos[campo], (int, float)):
-                datos_limpios[campo] = str(datos[campo])
-            else:
-                datos_limpios[campo] = datos[campo]
-    
-    # Limpieza específica de textos de la API
-    for campo in ['antecedentes_natales', 'factores_origen', 'razones_cambiar', 'observaciones']:
-        texto = datos_limpios[campo]
-        
-        # Eliminar frases como "Aquí está el texto corregido" y similares
-        frases_a_eliminar = [
-            "Aquí está el texto corregido y mejorado:",
-            "El texto se puede reformular",
-            "Esta versión reformulada",
-            "Informe Psicológico",
-            "La redacción es más clara",
-            "A continuación, presento una versión revisada"
-        ]
-        
-        for frase in frases_a_eliminar:
-            if frase in texto:
-                texto = texto.replace(frase, "").strip()
-        
-        # Si sigue siendo muy largo o tiene estructura extraña, usar un valor predeterminado
-        if not texto.strip():
-            if campo == 'antecedentes_natales':
-                texto = "Sin antecedentes relevantes."
-            elif campo == 'factores_origen':
-                texto = "Se identifican factores relacionados con hábitos alimenticios inadecuados."
-            elif campo == 'razones_cambiar':
-                texto = "Mejorar calidad de vida y estado de salud general."
-            elif campo == 'observaciones':
-                texto = "Sin observaciones relevantes que destacar."
-        
-        datos_limpios[campo] = texto
-    
-    # Definir clase PDF con métodos mejorados
-    class PDF(FPDF):
-        def header(self):
-        # Verificar si estamos en la primera página
-            if self.page_no() == 1:
-                self.set_font('Arial', 'B', 15)
-                self.cell(0, 10, 'INFORME PSICOLÓGICO PARA PROCEDIMIENTO BARIÁTRICO', 0, 1, 'C')
-                self.ln(2)  # Reducido espacio para aprovechar mejor el área
-    
-        def footer(self):
-            self.set_y(-15)
-            self.set_font('Arial', 'I', 8)
-            self.cell(0, 10, f'Página {self.page_no()}', 0, 0, 'C')
-    
-        def add_section_title(self, title):
-            self.set_font('Arial', 'B', 12)
-            self.ln(5)
-            self.cell(0, 10, title, 0, 1)
-            self.ln(2)
-        
-        def check_page_break(self, height=30):
-            """Verifica si hay suficiente espacio en la página actual, si no, añade una nueva página."""
-            if self.get_y() > self.h - height:
-                self.add_page()
-        
-        # Método para campos emparejados con espaciado explícito
-        def add_field_pair(self, label1, value1, label2, value2, col1_x=10, val1_x=55, col2_x=110, val2_x=145):
-            """Crea un par de campos con posicionamiento flexible."""
-            y_pos = self.get_y()
-    
-    # Primera etiqueta
-            self.set_font('Arial', 'B', 10)
-            self.set_xy(col1_x, y_pos)
-            self.cell(val1_x - col1_x, 6, label1, 0, 0)
-    
-    # Primer valor
-            self.set_font('Arial', '', 10)
-            self.set_xy(val1_x, y_pos)
-            self.cell(col2_x - val1_x, 6, " " + str(value1), 0, 0)
-    
-    # Segunda etiqueta
-            self.set_font('Arial', 'B', 10)
-            self.set_xy(col2_x, y_pos)
-            self.cell(val2_x - col2_x, 6, label2, 0, 0)
-    
-    # Segundo valor
-            self.set_font('Arial', '', 10)
-            self.set_xy(val2_x, y_pos)
-            self.cell(0, 6, " " + str(value2), 0, 1)
-    
-            return self.get_y()
-        # Para textos largos con etiqueta
-        def add_long_field(self, label, value):
-            # Etiqueta en línea separada
-            self.set_font('Arial', 'B', 10)
-            self.cell(0, 6, label, 0, 1)
-            
-            # Valor
-            self.set_font('Arial', '', 10)
-            self.multi_cell(0, 6, value, 0, 'L')
-            self.ln(2)
-        
-        # Crear tabla mejorada
-        def add_table(self, headers, data, widths=None):
-            if widths is None:
-                page_width = self.w - 20
-                widths = [page_width / len(headers)] * len(headers)
-            
-            # Encabezados
-            self.set_font('Arial', 'B', 10)
-            self.set_fill_color(240, 240, 240)
-            
-            for i, header in enumerate(headers):
-                self.cell(widths[i], 8, header, 1, 0, 'C', 1)
-            self.ln()
-            
-            # Datos
-            self.set_font('Arial', '', 10)
-            for row in data:
-                for i, cell in enumerate(row):
-                    self.cell(widths[i], 8, str(cell), 1, 0, 'C')
-                self.ln()
-            
-            self.ln(4)
-        
-        def formatear_rut(self, rut):
-            if not rut or not isinstance(rut, str) or len(rut.strip()) < 2:
-                return ""
-                
-            rut = rut.replace(".", "").replace("-", "").strip()
-            if len(rut) < 2:
-                return rut
-                
-            dv = rut[-1]
-            num = rut[:-1]
-            
-            formato = ""
-            while len(num) > 3:
-                formato = "." + num[-3:] + formato
-                num = num[:-3]
-            formato = num + formato
-            
-            return formato + "-" + dv
-    
-    # Generar el PDF con la nueva estructura
-    pdf = PDF()
-    pdf.add_page()
-    
-    # Datos del paciente
-    pdf.add_section_title('I. DATOS DEL PACIENTE')
-    
-    # Usar posicionamiento absoluto para garantizar alineación
-    pdf.add_field_pair("Nombre:", datos_limpios['nombre_completo'], 
-                     "RUN:", pdf.formatear_rut(datos_limpios['run']))
-    
-    pdf.add_field_pair("F. Nac.:", datos_limpios['fecha_nacimiento'], 
-                     "Edad:", f"{datos_limpios['edad']} Años")
-    
-    pdf.add_field_pair("Email:", datos_limpios['email'], 
-                     "Teléfono:", datos_limpios['telefono'])
-    
-    # Domicilio (campo individual)
-    pdf.set_font('Arial', 'B', 10)
-    pdf.cell(45, 6, "Domicilio:", 0, 0)
-    pdf.set_font('Arial', '', 10)
-    pdf.cell(0, 6, datos_limpios['domicilio'], 0, 1)
-    
-    pdf.add_field_pair("Previsión:", datos_limpios['prevision'], 
-                     "Escolaridad:", datos_limpios['escolaridad'])
-    
-    pdf.add_field_pair("Profesión:", datos_limpios['ocupacion'], 
-                     "Sexo:", datos_limpios['sexo'])
-    
-    # Psicóloga (campo individual)
-    pdf.set_font('Arial', 'B', 10)
-    pdf.cell(45, 6, "Psicóloga:", 0, 0)
-    pdf.set_font('Arial', '', 10)
-    pdf.cell(0, 6, datos_limpios['psicologa'], 0, 1)
-    
-    pdf.add_field_pair("Procedimiento:", datos_limpios['datos_procedimiento'], 
-                     "Fecha:", datos_limpios['fecha_procedimiento'])
-    
-    # Antecedentes familiares
-    pdf.add_section_title('II. ANTECEDENTES FAMILIARES')
-    
-    # Familia nuclear
-    pdf.set_font('Arial', 'B', 10)
-    pdf.cell(45, 6, "Familia Nuclear:", 0, 0)
-    pdf.set_font('Arial', '', 10)
-    pdf.cell(0, 6, datos_limpios['familia_nuclear'], 0, 1)
-    
-    pdf.add_field_pair("Estado Civil Padres:", datos_limpios['situacion_conyugal_padres'], 
-                     "Estado Civil:", datos_limpios['estado_civil'])
-    
-    pdf.add_field_pair("Hijos:", datos_limpios['hijos'], 
-                     "Redes de Apoyo:", datos_limpios['redes_apoyo'])
-    
-    # Enfermedades familiares (etiqueta larga en línea separada)
-    pdf.add_long_field("Enfermedades de importancia/Trastornos mentales/Adicciones familiares:", 
-                     datos_limpios['enfermedades_familia'])
-    
-    # Antecedentes mórbidos
-    pdf.check_page_break()
-    pdf.add_section_title('III. ANTECEDENTES MÓRBIDOS')
-    
-    pdf.add_long_field("Antecedentes pre, peri y post natales:", 
-                     datos_limpios['antecedentes_natales'])
-    
-    pdf.add_long_field("Enfermedades importantes en infancia y adolescencia:", 
-                     datos_limpios['enfermedades_infancia'])
-    
-    pdf.add_long_field("Enfermedades actuales:", 
-                     datos_limpios['enfermedades_actuales'])
-    
-    pdf.add_long_field("Operaciones:", datos_limpios['operaciones'])
-    
-    # Estado de salud mental
-    pdf.check_page_break()
-    pdf.add_section_title('IV. ESTADO DE SALUD MENTAL')
-    
-    pdf.add_long_field("Antecedentes de Salud Mental:", 
-                     datos_limpios['antecedentes_salud_mental'])
-    
-    pdf.set_font('Arial', 'B', 10)
-    pdf.cell(45, 6, "Estado de salud mental:", 0, 0)
-    pdf.set_font('Arial', '', 10)
-    pdf.cell(0, 6, datos_limpios['estado_salud_mental'], 0, 1)
-    
-    # Historia escolar
-    pdf.check_page_break()
-    pdf.add_section_title('V. HISTORIA ESCOLAR')
-    
-    pdf.add_field_pair("Repitencias:", datos_limpios['repitencias'], 
-                 "Rendimiento Académico:", datos_limpios['rendimiento_academico'],
-                 col2_x=90, val2_x=135)
-    pdf.set_font('Arial', 'B', 10)
-    pdf.cell(45, 6, "Comportamiento Escolar:", 0, 0)
-    pdf.set_font('Arial', '', 10)
-    pdf.cell(0, 6, datos_limpios['comportamiento_escolar'], 0, 1)
-    
-    # Abuso o dependencias de sustancias
-    pdf.check_page_break()
-    pdf.add_section_title('VI. ABUSO O DEPENDENCIAS DE SUSTANCIAS')
-    
-    # Tabla de sustancias
-    headers = ["Sustancia", "Consumo"]
-    data = [
-        ["Alcohol", datos_limpios['consumo_alcohol']],
-        ["Tabaco", datos_limpios['consumo_tabaco']],
-        ["Marihuana", datos_limpios['consumo_marihuana']],
-        ["Otras drogas", datos_limpios['consumo_otras_drogas']]
-    ]
-    widths = [75, 105]
-    
-    pdf.add_table(headers, data, widths)
-    
-    # Trastornos de la conducta alimentarios
-    pdf.check_page_break()
-    pdf.add_section_title('VII. TRASTORNOS DE LA CONDUCTA ALIMENTARIOS')
-    
-    # Datos de peso y altura - todos en la misma página
-    pdf.add_field_pair("Peso máximo:", f"{datos_limpios['peso_maximo']} kg", 
-                     "Peso mínimo:", f"{datos_limpios['peso_minimo']} kg")
-    
-    pdf.add_field_pair("Peso ideal:", f"{datos_limpios['peso_ideal']} kg", 
-                     "Altura:", f"{datos_limpios['altura']} m")
-    
-    # Tabla de trastornos
-    pdf.ln(4)
-    headers = ["Trastorno", "Estado", "Trastorno", "Estado"]
-    data = [
-        ["ARFID", datos_limpios['arfid'], "Comedor Emocional", datos_limpios['comedor_emocional']],
-        ["Anorexia Nerviosa", datos_limpios['anorexia'], "Comedor Nocturno", datos_limpios['comedor_nocturno']],
-        ["Bulimia Nerviosa", datos_limpios['bulimia'], "Picoteador", datos_limpios['picoteador']],
-        ["Trastorno por Atracón", datos_limpios['t_atracon'], "Food Craving", datos_limpios['food_craving']]
-    ]
-    widths = [55, 25, 55, 45]
-    
-    pdf.add_table(headers, data, widths)
-    
-    # Consciencia del problema
-    pdf.add_page()  # Nueva página para esta sección importante
-    pdf.add_section_title('VIII. CONSCIENCIA DEL PROBLEMA Y NIVEL DE MOTIVACIÓN PARA EL CAMBIO')
-    
-    pdf.add_long_field("Análisis de factores que dieron origen y perpetúan el problema:", 
-                     datos_limpios['factores_origen'])
-    
-    pdf.add_long_field("Razones para cambiar:", datos_limpios['razones_cambiar'])
-    
-    # Paciente apto destacado
-    pdf.set_font('Arial', 'B', 10)
-    pdf.cell(60, 6, "Paciente apto para procedimiento:", 0, 0)
-    pdf.set_font('Arial', 'B', 12)  # Más grande para destacar
-    pdf.cell(0, 6, datos_limpios['paciente_apto'], 0, 1)
-    
-    # Observaciones
-    pdf.ln(5)
-    pdf.add_section_title('IX. OBSERVACIONES')
-    
-    if datos_limpios['observaciones']:
-        pdf.multi_cell(0, 6, datos_limpios['observaciones'], 0, 'L')
-    else:
-        pdf.set_font('Arial', '', 10)
-        pdf.cell(0, 6, "Sin observaciones relevantes que destacar.", 0, 1)
-    
-    # Firma y datos de la psicóloga
-    pdf.ln(20)
-    
-    # Línea para firma
-    x_center = pdf.w / 2
-    pdf.line(x_center - 35, pdf.get_y(), x_center + 35, pdf.get_y())
-    pdf.ln(5)
-    
-    # Datos de la psicóloga
-    pdf.set_font('Arial', 'B', 10)
-    pdf.cell(0, 6, datos_limpios['psicologa'], 0, 1, 'C')
-    
-    if datos_limpios['rut_psicologa']:
-        pdf.set_font('Arial', '', 10)
-        pdf.cell(0, 6, f"Rut: {pdf.formatear_rut(datos_limpios['rut_psicologa'])}", 0, 1, 'C')
-    else:
-        pdf.set_font('Arial', '', 10)
-        pdf.cell(0, 6, "Rut:", 0, 1, 'C')
-    
-    pdf.cell(0, 6, "Psicóloga", 0, 1, 'C')
-    
-    # Generar el PDF
-    return pdf.output(dest='S').encode('latin1')
+        st.warning(f"No se pudo guardar la evaluación: {str(e)}")
+
+# Agrupar los envíos de cada paso en un formulario (AGRUPAR_ENVIOS_POR_PASO=0 para desactivar)
+AGRUPAR_ENVIOS_POR_PASO = os.environ.get("AGRUPAR_ENVIOS_POR_PASO", "1") != "0"
+
+# Generar los informes en procesos aparte (INFORMES_EN_SEGUNDO_PLANO=0 para generarlos en la recarga)
+INFORMES_EN_SEGUNDO_PLANO = os.environ.get("INFORMES_EN_SEGUNDO_PLANO", "1") != "0"
+
+# Segundos entre consultas del estado de un informe en preparación
+INTERVALO_CONSULTA_INFORME = 0.5
+
+# Cada cuántas recargas de una sesión se mide su memoria (recorre todo st.session_state)
+MEMORIA_SESION_CADA = max(int(os.environ.get("MEMORIA_SESION_CADA", "20")), 1)
+
+# Títulos de sección de cada paso del asistente
+TITULOS_PASOS = {numero: titulo for numero, titulo, _ in PASOS}
 
-# Función para descargar el PDF
-def get_pdf_download_link(pdf_bytes, filename):
-    b64 = base64.b64encode(pdf_bytes).decode()
-    href = f'<a href="data:application/pdf;base64,{b64}" download="{filename}">Descargar Informe PDF</a>'
-    return href
+# Función para medir lo que se envía al navegador para descargar el PDF
+def medir_descarga(bytes_pdf):
+    """Compara el tamaño del PDF con el del enlace base64 que se usaba antes.
+
+    El enlace data: incrustaba el PDF en base64 (4 bytes por cada 3) en el HTML y se
+    reenviaba por el websocket en cada recarga del paso 9. st.download_button solo
+    envía una URL; el archivo se transfiere por HTTP cuando se hace clic."""
+    bytes_data_uri = len('<a href="data:application/pdf;base64," download="Informe_Psicologico.pdf">Descargar Informe PDF</a>') + 4 * ((bytes_pdf + 2) // 3)
+    return {"bytes_pdf": bytes_pdf, "bytes_data_uri": bytes_data_uri, "recargas": 0}
 
 # Inicializar el estado de la sesión
 if 'step' not in st.session_state:
@@ -462,17 +154,482 @@ if 'anthropic_response' not in st.session_state:
     st.session_state.anthropic_response = None
 if 'anthropic_error' not in st.session_state:
     st.session_state.anthropic_error = None
-if 'pdf_bytes' not in st.session_state:
-    st.session_state.pdf_bytes = None
+if 'informe_pdf' not in st.session_state:
+    # Clave y tamaño del último informe en el almacén de informes (los bytes quedan en disco;
+    # en el paso 9, st.download_button guarda además una copia en memoria, ver memoria_sesion)
+    st.session_state.informe_pdf = None
+if 'metricas_descarga' not in st.session_state:
+    st.session_state.metricas_descarga = None
+if 'trabajo_pdf' not in st.session_state:
+    # Identificador del informe en preparación en la cola de informes
+    st.session_state.trabajo_pdf = None
+if 'aviso_informe' not in st.session_state:
+    # Resultado del último informe en preparación, para mostrarlo tras la recarga
+    st.session_state.aviso_informe = None
+if 'historial_mejoras' not in st.session_state:
+    # Por campo: párrafos de la última mejora con IA, para reenviar solo lo editado
+    st.session_state.historial_mejoras = {}
+if 'versiones_form' not in st.session_state:
+    # Versión de cada campo de form_data; "*" cambia cuando se reemplaza el formulario completo
+    st.session_state.versiones_form = {"*": 0}
+if 'cache_resumen' not in st.session_state:
+    # Tablas del resumen del paso 9 por grupo, junto a las versiones de campos con que se armaron
+    st.session_state.cache_resumen = {}
+if 'borrador' not in st.session_state:
+    # Valores del paso en curso ya anotados en el diario de autoguardado
+    st.session_state.borrador = {}
+if 'borrador_restaurado' not in st.session_state:
+    # Borrador recuperado del diario al restaurar la sesión: valores iniciales de los widgets
+    # hasta que se confirmen (una copia fija, para que los widgets no cambien de identidad)
+    st.session_state.borrador_restaurado = {}
+if 'recargas' not in st.session_state:
+    st.session_state.recargas = {"total": 0, "por_paso": {}}
+
+# Función para modificar campos de form_data registrando cuáles cambiaron
+def actualizar_form_data(valores):
+    datos, versiones = st.session_state.form_data, st.session_state.versiones_form
+    cambios = {clave: valor for clave, valor in valores.items() if clave not in datos or datos[clave] != valor}
+    for clave in cambios:
+        versiones[clave] = versiones.get(clave, 0) + 1
+    datos.update(valores)
+    for clave in valores:
+        st.session_state.borrador_restaurado.pop(clave, None)
+    if cambios:
+        registrar_en_diario(cambios)
+
+# Función para reemplazar form_data completo (al cargar o iniciar una evaluación)
+def reemplazar_form_data(datos, en_diario=True):
+    st.session_state.form_data = datos
+    st.session_state.versiones_form["*"] += 1
+    st.session_state.borrador = {}
+    st.session_state.borrador_restaurado = {}
+    if en_diario:
+        registrar_en_diario(datos, reemplazar=True)
+
+# Función para anotar cambios (y el paso, si cambió) en el diario de autoguardado
+def registrar_en_diario(cambios=None, reemplazar=False, borrador=None):
+    """Solo encola las líneas: el diario las escribe agrupadas en otro hilo."""
+    diario = obtener_diario()
+    paso = st.session_state.step
+    cambio_paso = paso != st.session_state.paso_diario
+    if diario is None or not (cambios or reemplazar or borrador or cambio_paso):
+        return
+    try:
+        diario.registrar(st.session_state.token_sesion, cambios, paso=paso if cambio_paso or reemplazar else None,
+                         reemplazar=reemplazar, borrador=borrador)
+    except Exception as e:
+        st.warning(f"No se pudo autoguardar: {str(e)}")
+        return
+    st.session_state.paso_diario = paso
+
+# Función para autoguardar lo que se está ingresando en el paso, antes de presionar Continuar
+def autoguardar_borrador(valores):
+    """Con envíos agrupados por paso los widgets informan sus valores recién al enviar el
+    formulario; sin agrupar, cada cambio llega en su recarga y se anota en el diario como
+    borrador, sin tocar form_data hasta que se confirme el paso."""
+    borrador, datos = st.session_state.borrador, st.session_state.form_data
+    # Los valores por defecto de un campo que se muestra por primera vez no se anotan
+    cambios = {clave: valor for clave, valor in valores.items() if borrador.get(clave, datos.get(clave, valor)) != valor}
+    borrador.update(valores)
+    if cambios:
+        registrar_en_diario(borrador=cambios)
+
+# Prefijo de las claves de form_data en el almacén de sesiones
+PREFIJO_FORMULARIO = "form_data."
+# Otras claves de la sesión que se guardan en el almacén (el informe, como clave del almacén
+# de informes: si otra réplica no comparte ese directorio, se pide generarlo de nuevo)
+CLAVES_PERSISTIDAS = ("historial_mejoras", "informe_pdf")
+
+# Función para anotar lo que ya está en el almacén de sesiones
+def marcar_persistida(versiones):
+    # Copias superficiales: historial_mejoras se modifica por campo e informe_pdf se reemplaza
+    st.session_state.sesion_persistida = dict(
+        {clave: copy.copy(st.session_state[clave]) for clave in CLAVES_PERSISTIDAS},
+        versiones=versiones, step=st.session_state.step
+    )
+
+# Función para recuperar la sesión indicada en la URL, o crear un token nuevo
+def restaurar_sesion():
+    """El token va en el parámetro ?sesion= de la URL: al recargar la página, o si otra
+    réplica atiende la conexión, el paso y el formulario se recuperan del almacén."""
+    almacen, diario = obtener_almacen_sesiones(), obtener_diario()
+    token = st.query_params.get("sesion")
+    estado = registro = None
+    if token:
+        try:
+            if almacen is not None:
+                estado = almacen.cargar(token)
+            if diario is not None:
+                registro = diario.reproducir(token)
+        except Exception as e:
+            st.warning(f"No se pudo recuperar la sesión: {str(e)}")
+    if estado is None and registro is None:
+        token = secrets.token_urlsafe(16)
+        st.query_params["sesion"] = token
+    else:
+        paso, datos = 1, {}
+        if estado is not None:
+            paso = estado.get("step", 1)
+            datos = {clave[len(PREFIJO_FORMULARIO):]: valor for clave, valor in estado.items() if clave.startswith(PREFIJO_FORMULARIO)}
+        if registro is not None:
+            # El diario tiene además lo autoguardado después del último estado del almacén
+            if registro["completo"]:
+                datos = {}
+            datos.update(registro["form_data"])
+            paso = registro["step"] or paso
+        st.session_state.step = paso
+        reemplazar_form_data(datos, en_diario=False)
+        if registro is not None:
+            # Lo no confirmado vuelve solo como borrador; form_data queda con lo confirmado
+            st.session_state.borrador = dict(registro["borrador"])
+            st.session_state.borrador_restaurado = dict(registro["borrador"])
+        for clave in CLAVES_PERSISTIDAS:
+            if estado is not None and estado.get(clave) is not None:
+                st.session_state[clave] = estado[clave]
+        if st.session_state.informe_pdf is not None:
+            st.session_state.metricas_descarga = medir_descarga(st.session_state.informe_pdf["bytes"])
+    st.session_state.token_sesion = token
+    st.session_state.paso_diario = st.session_state.step
+    # Lo que ya está en el almacén; persistir_sesion escribe solo lo que cambie desde aquí
+    # (todo, si el diario agregó cambios que el almacén no tenía)
+    versiones = dict(st.session_state.versiones_form)
+    if registro is not None:
+        versiones["*"] = -1
+    marcar_persistida(versiones)
+
+# Función para escribir en el almacén de sesiones los cambios de esta recarga
+def persistir_sesion():
+    """Usa las versiones de campo de form_data: solo se escriben los campos cuya versión
+    cambió (y el paso y las CLAVES_PERSISTIDAS que cambiaron), salvo que se haya
+    reemplazado el formulario completo."""
+    almacen = obtener_almacen_sesiones()
+    if almacen is None:
+        return
+    persistida = st.session_state.sesion_persistida
+    versiones, datos = st.session_state.versiones_form, st.session_state.form_data
+    reemplazar = versiones["*"] != persistida["versiones"]["*"]
+    if reemplazar:
+        claves = list(datos)
+    else:
+        claves = [clave for clave, version in versiones.items() if clave != "*" and persistida["versiones"].get(clave) != version]
+    cambios = {PREFIJO_FORMULARIO + clave: datos[clave] for clave in claves if clave in datos}
+    if reemplazar or st.session_state.step != persistida["step"]:
+        cambios["step"] = st.session_state.step
+    for clave in CLAVES_PERSISTIDAS:
+        if reemplazar or st.session_state[clave] != persistida[clave]:
+            cambios[clave] = st.session_state[clave]
+    if not cambios:
+        return
+    try:
+        with REGISTRO.medir("sesion_escritura_segundos"):
+            almacen.escribir(st.session_state.token_sesion, cambios, reemplazar=reemplazar)
+    except Exception as e:
+        st.warning(f"No se pudo guardar la sesión: {str(e)}")
+        return
+    marcar_persistida(dict(versiones))
+
+if 'token_sesion' not in st.session_state:
+    restaurar_sesion()
+
+# Contar cada ejecución del script para medir el efecto de agrupar los envíos por paso
+st.session_state.recargas["total"] += 1
+st.session_state.recargas["por_paso"][st.session_state.step] = st.session_state.recargas["por_paso"].get(st.session_state.step, 0) + 1
+paso_recarga = st.session_state.step
+
+# Función para preparar las métricas de rendimiento como tabla (tiempos en ms, tamaños en KB)
+def tabla_metricas():
+    filas = []
+    for fila in REGISTRO.resumen():
+        escala, unidad = (1000, "ms") if fila["metrica"].endswith("_segundos") else (1 / 1024, "KB")
+        filas.append({
+            "Métrica": fila["metrica"],
+            "Etiquetas": ", ".join(f"{k}={v}" for k, v in fila["etiquetas"].items()),
+            "N": fila["n"],
+            "p50": f"{fila['p50'] * escala:.1f} {unidad}",
+            "p95": f"{fila['p95'] * escala:.1f} {unidad}",
+            "p99": f"{fila['p99'] * escala:.1f} {unidad}"
+        })
+    return filas
+
+# Función para estimar la memoria que ocupa un valor (recorre dicts, listas y tuplas)
+def tamano_en_memoria(valor):
+    tamano = sys.getsizeof(valor)
+    if isinstance(valor, dict):
+        tamano += sum(tamano_en_memoria(clave) + tamano_en_memoria(v) for clave, v in valor.items())
+    elif isinstance(valor, (list, tuple, set)):
+        tamano += sum(tamano_en_memoria(v) for v in valor)
+    return tamano
+
+# Función para estimar la memoria de la sesión por clave de st.session_state, de mayor a menor
+def memoria_sesion():
+    """Aproximada: los objetos compartidos entre claves se cuentan en cada una. Incluye el
+    PDF que st.download_button mantiene en el almacén de medios en memoria mientras la
+    sesión está en el paso 9."""
+    memoria = [(clave, tamano_en_memoria(valor)) for clave, valor in st.session_state.items()]
+    if st.session_state.get("informe_pdf") is not None and st.session_state.get("step") == 9:
+        memoria.append(("PDF del botón de descarga", st.session_state.informe_pdf["bytes"]))
+    return sorted(memoria, key=lambda par: -par[1])
+
+# Función para construir una tabla HTML con los estilos de .pdf-table
+def tabla_html(encabezados, filas):
+    """Alternativa liviana a st.table(pd.DataFrame(...)) para las tablas de resumen: no
+    requiere cargar pandas en cada proceso del servidor."""
+    celda = lambda valor: html.escape("" if valor is None else str(valor)).replace("\n", "<br>")  # noqa: E731
+    cabecera = "".join(f"<th>{celda(encabezado)}</th>" for encabezado in encabezados)
+    cuerpo = "".join("<tr>" + "".join(f"<td>{celda(valor)}</td>" for valor in fila) + "</tr>" for fila in filas)
+    return f'<table class="pdf-table"><thead><tr>{cabecera}</tr></thead><tbody>{cuerpo}</tbody></table>'
+
+# Función para obtener la tabla de un grupo del resumen del paso 9
+def tabla_resumen(grupo):
+    """La tabla se reconstruye solo si cambió la versión de alguno de sus campos; en las
+    demás recargas del paso 9 (selecciones, botones) se reutiliza la de la sesión."""
+    versiones = st.session_state.versiones_form
+    version = (versiones["*"],) + tuple(versiones.get(clave, 0) for _, clave in grupo["filas"])
+    guardada = st.session_state.cache_resumen.get(grupo["titulo"])
+    if guardada is None or guardada[0] != version:
+        filas = [(etiqueta, st.session_state.form_data.get(clave, '')) for etiqueta, clave in grupo["filas"]]
+        guardada = (version, tabla_html(grupo["encabezados"], filas))
+        st.session_state.cache_resumen[grupo["titulo"]] = guardada
+    return guardada[1]
+
+# Intervalo mínimo en segundos entre actualizaciones del texto que se está recibiendo
+INTERVALO_STREAMING = 0.05
+
+# Función para mostrar las mejoras de redacción a medida que llegan
+def mostrar_mejoras_en_streaming(secciones, planes, api_key, max_concurrencia):
+    """Envía los tramos de todos los planes y devuelve sus (texto, error) en el mismo orden.
+    Cada sección muestra sus párrafos conservados junto al texto que va llegando."""
+    envios = [envio for plan in planes for envio in plan["envios"]]
+    # Sección y posición dentro de la sección de cada tramo enviado
+    ubicacion = [(i, j) for i, plan in enumerate(planes) for j in range(len(plan["envios"]))]
+    
+    marcadores = []
+    for seccion in secciones:
+        st.markdown(f"**{seccion}**")
+        marcadores.append(st.empty())
+    parciales = [[""] * len(plan["envios"]) for plan in planes]
+    ultima_actualizacion = [0.0] * len(secciones)
+    resultados = [None] * len(envios)
+    
+    # Los eventos llegan por una cola y se consumen en este hilo, el único que puede tocar la interfaz
+    for tipo, indice, valor in mejorar_textos_en_streaming(envios, api_key, max_concurrencia, obtener_cliente_http(), obtener_cache_ia()):
+        seccion, posicion = ubicacion[indice]
+        ahora = time.perf_counter()
+        if tipo in ("fragmento", "descarte"):
+            if tipo == "fragmento":
+                parciales[seccion][posicion] += valor
+            else:
+                parciales[seccion][posicion] = parciales[seccion][posicion][:-valor]
+            if ahora - ultima_actualizacion[seccion] >= INTERVALO_STREAMING:
+                marcadores[seccion].markdown(unir(planes[seccion], parciales[seccion]) + " ▌")
+                ultima_actualizacion[seccion] = ahora
+        else:
+            resultados[indice] = valor
+            texto_mejorado, error = valor
+            parciales[seccion][posicion] = envios[indice] if error else texto_mejorado
+            marcadores[seccion].markdown(unir(planes[seccion], parciales[seccion]))
+            ultima_actualizacion[seccion] = ahora
+    return resultados
+
+# Función para asociar a la sesión un informe recién guardado en el almacén de informes
+def adjuntar_pdf(clave_blob, bytes_pdf):
+    REGISTRO.observar("informe_pdf_bytes", bytes_pdf)
+    st.session_state.informe_pdf = {"clave": clave_blob, "bytes": bytes_pdf}
+    st.session_state.metricas_descarga = medir_descarga(bytes_pdf)
+
+# Función para descartar el informe en preparación, si lo hay
+def cancelar_informe():
+    if st.session_state.trabajo_pdf is not None:
+        obtener_cola_informes().cancelar(st.session_state.trabajo_pdf)
+        st.session_state.trabajo_pdf = None
+
+# Función para la sección de generación y descarga del informe del paso 9
+def seccion_informe():
+    """Se ejecuta como fragmento. El botón envía el informe a la cola y la recarga termina
+    de inmediato; mientras se prepara, el fragmento consulta su estado cada
+    INTERVALO_CONSULTA_INFORME segundos sin recargar el resto de la página."""
+    trabajo = st.session_state.trabajo_pdf
+    if trabajo is not None:
+        estado = obtener_cola_informes().consultar(trabajo)
+        if estado["estado"] in (EN_COLA, GENERANDO):
+            if estado["estado"] == EN_COLA:
+                st.info(f"⏳ Informe en cola (posición {estado['posicion']})...")
+            else:
+                st.info(f"⏳ Generando informe... ({estado['segundos']:.0f} s)")
+            if st.button("Cancelar", key="cancelar_informe"):
+                cancelar_informe()
+                st.rerun()
+            return
+        st.session_state.trabajo_pdf = None
+        if estado["estado"] == LISTO:
+            REGISTRO.observar("informe_pdf_segundos", estado["segundos_generacion"])
+            REGISTRO.observar("informe_pdf_espera_segundos", estado["segundos"])
+            adjuntar_pdf(estado["clave_blob"], estado["bytes_pdf"])
+            st.session_state.aviso_informe = ("success", "✅ Informe generado correctamente!")
+        else:
+            st.session_state.aviso_informe = ("error", f"Error al generar el PDF: {estado.get('error', 'el informe ya no está disponible')}")
+        # Recarga completa para dejar de consultar
+        st.rerun()
+    
+    if st.button("Generar Informe PDF"):
+        # Si ya se generó un informe con estos mismos datos, se reutiliza sin volver a dibujarlo
+        huella = huella_entrada(st.session_state.form_data)
+        existente = obtener_almacen_blobs().buscar(huella)
+        if existente is not None:
+            adjuntar_pdf(existente["clave"], existente["bytes"])
+            st.success("✅ Informe generado correctamente! (sin cambios desde el último informe)")
+        elif INFORMES_EN_SEGUNDO_PLANO:
+            identificador, error = obtener_cola_informes().enviar(st.session_state.form_data)
+            if error:
+                st.error(error)
+            else:
+                st.session_state.trabajo_pdf = identificador
+                st.session_state.aviso_informe = None
+                # Recarga completa para que el fragmento empiece a consultar el estado
+                st.rerun()
+        else:
+            with st.spinner("Generando informe..."):
+                try:
+                    # fpdf se carga recién la primera vez que se genera un informe
+                    from informe_pdf import generar_pdf
+                    with REGISTRO.medir("informe_pdf_segundos"):
+                        pdf_bytes = generar_pdf(st.session_state.form_data, **OPCIONES_INFORME)
+                    clave = obtener_almacen_blobs().guardar(pdf_bytes)
+                    obtener_almacen_blobs().asociar(huella, clave)
+                    adjuntar_pdf(clave, len(pdf_bytes))
+                    st.success("✅ Informe generado correctamente!")
+                except Exception as e:
+                    st.error(f"Error al generar el PDF: {str(e)}")
+    
+    if st.session_state.aviso_informe is not None:
+        tipo, mensaje = st.session_state.aviso_informe
+        st.session_state.aviso_informe = None
+        (st.success if tipo == "success" else st.error)(mensaje)
+    
+    pdf_bytes = None
+    if st.session_state.informe_pdf is not None:
+        pdf_bytes = obtener_almacen_blobs().leer(st.session_state.informe_pdf["clave"])
+        if pdf_bytes is None:
+            st.session_state.informe_pdf = None
+            st.warning("El informe generado venció; vuelva a generarlo.")
+    
+    if pdf_bytes is not None:
+        # Streamlit copia los bytes a su almacén de medios en memoria (uno por sesión, mientras el
+        # botón se muestre); en cada recarga al navegador solo viaja la URL del archivo
+        st.download_button(
+            "Descargar Informe PDF",
+            data=pdf_bytes,
+            file_name="Informe_Psicologico.pdf",
+            mime="application/pdf"
+        )
+        metricas = st.session_state.metricas_descarga
+        if metricas is not None:
+            metricas["recargas"] += 1
+            st.caption(
+                f"Informe: {metricas['bytes_pdf'] / 1024:.1f} KB (SHA-256 {st.session_state.informe_pdf['clave'][:12]}). "
+                f"El enlace base64 anterior enviaba {metricas['bytes_data_uri'] / 1024:.1f} KB por recarga; "
+                f"ahorro acumulado en {metricas['recargas']} recargas: {metricas['bytes_data_uri'] * metricas['recargas'] / 1024:.1f} KB."
+            )
 
 # Función para avanzar al siguiente paso
 def next_step():
+    guardar_evaluacion()
     st.session_state.step += 1
 
 # Función para retroceder al paso anterior
 def prev_step():
     st.session_state.step -= 1
 
+# Función para mostrar el título de la sección de un paso
+def encabezado_paso(numero):
+    st.markdown(f'<div class="section-header">{TITULOS_PASOS[numero]}</div>', unsafe_allow_html=True)
+
+# Función para dibujar el widget de un campo según el esquema y registrar su valor en `valores`
+def campo_formulario(clave, valores):
+    campo = CAMPOS[clave]
+    # Un borrador restaurado del diario tiene prioridad sobre lo confirmado
+    anteriores = {**st.session_state.form_data, **st.session_state.borrador_restaurado}
+    guardado = anteriores.get(clave, campo["defecto"])
+    
+    ayuda = None
+    
+    # Campos de detalle que solo se muestran según otra respuesta del mismo paso
+    if "mostrar_si" in campo:
+        controlador, valores_visibles = campo["mostrar_si"]
+        if agrupar_envios:
+            ayuda = f"Se guarda solo si «{CAMPOS[controlador]['etiqueta']}» es {' o '.join(valores_visibles)}."
+        elif valores.get(controlador) not in valores_visibles:
+            valores[clave] = ""
+            return ""
+    
+    tipo = campo["tipo"]
+    if tipo == "texto":
+        valor = st.text_input(campo["etiqueta"], value=guardado, help=ayuda)
+    elif tipo == "area":
+        valor = st.text_area(campo["etiqueta"], value=guardado, height=campo["alto"], help=ayuda)
+    elif tipo == "opciones":
+        valor = st.selectbox(campo["etiqueta"], campo["opciones"], index=indice_opcion(clave, guardado))
+    elif tipo == "radio":
+        valor = st.radio(campo["etiqueta"], campo["opciones"], index=indice_opcion(clave, guardado),
+                         key=clave if campo.get("widget_con_clave") else None)
+    elif tipo == "entero":
+        valor = st.number_input(campo["etiqueta"], min_value=campo["minimo"], value=int(guardado))
+    elif tipo == "decimal":
+        valor = st.number_input(campo["etiqueta"], min_value=campo["minimo"], step=campo.get("incremento"), value=float(guardado))
+    elif tipo == "fecha":
+        if clave in anteriores:
+            fecha = datetime.datetime.strptime(guardado, campo["formato"])
+        else:
+            fecha = campo["defecto"] or datetime.date.today()
+        valor = st.date_input(campo["etiqueta"], value=fecha, format="DD/MM/YYYY")
+        valores[clave] = valor.strftime(campo["formato"])
+        return valor
+    else:
+        raise ValueError(f"El campo {clave!r} de tipo {tipo!r} no tiene widget")
+    
+    valores[clave] = valor
+    return valor
+
+# Función para abrir el contenedor de los widgets de un paso
+def contenedor_paso(paso):
+    """Con envíos agrupados, el paso es un st.form: escribir o cambiar opciones no recarga
+    el script y los valores llegan juntos al presionar Atrás o Continuar."""
+    if agrupar_envios:
+        return st.form(f"form_paso_{paso}", border=False)
+    return st.container()
+
+# Función para los botones de un paso (botón de envío si el paso es un formulario)
+def boton_paso(etiqueta, key):
+    if agrupar_envios:
+        # Dentro de un formulario la etiqueta basta para distinguir el botón
+        return st.form_submit_button(etiqueta)
+    return st.button(etiqueta, key=key)
+
+# Función para guardar los valores de un paso y avanzar
+def confirmar_paso(valores):
+    # Los detalles cuya condición no se cumple se guardan vacíos; con envíos agrupados
+    # el widget se muestra siempre porque la condición solo se conoce al enviar
+    for clave in valores:
+        if "mostrar_si" in CAMPOS[clave]:
+            controlador, valores_visibles = CAMPOS[clave]["mostrar_si"]
+            if valores.get(controlador) not in valores_visibles:
+                valores[clave] = ""
+    actualizar_form_data(valores)
+    next_step()
+
+# Función para los botones Atrás/Continuar de los pasos 2 a 8
+def botones_navegacion(paso, valores):
+    autoguardar_borrador(valores)
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        if boton_paso("Atrás", key=f"atras_{paso}"):
+            prev_step()
+    
+    with col2:
+        if boton_paso("Continuar", key=f"continuar_{paso}"):
+            confirmar_paso(valores)
+
 # Encabezado principal
 st.markdown('<div class="main-header">EVALUACIÓN PSICOLÓGICA PARA PROCEDIMIENTO BARIÁTRICO</div>', unsafe_allow_html=True)
 
@@ -481,29 +638,93 @@ with st.sidebar:
     
     st.image("https://cdn-icons-png.flaticon.com/512/4076/4076478.png", width=100)  # Ícono de psicología/salud mental
     st.markdown("### Navegación")
-    if st.button("Datos del Paciente", disabled=st.session_state.step == 1):
-        st.session_state.step = 1
-    if st.button("Antecedentes Familiares", disabled=st.session_state.step == 2):
-        st.session_state.step = 2
-    if st.button("Antecedentes Mórbidos", disabled=st.session_state.step == 3):
-        st.session_state.step = 3
-    if st.button("Salud Mental", disabled=st.session_state.step == 4):
-        st.session_state.step = 4
-    if st.button("Historia Escolar", disabled=st.session_state.step == 5):
-        st.session_state.step = 5
-    if st.button("Abuso de Sustancias", disabled=st.session_state.step == 6):
-        st.session_state.step = 6
-    if st.button("Trastornos Alimentarios", disabled=st.session_state.step == 7):
-        st.session_state.step = 7
-    if st.button("Motivación para el Cambio", disabled=st.session_state.step == 8):
-        st.session_state.step = 8
-    if st.button("Revisión y Generación", disabled=st.session_state.step == 9):
-        st.session_state.step = 9
+    for numero, _, nombre_paso in PASOS:
+        if st.button(nombre_paso, disabled=st.session_state.step == numero):
+            st.session_state.step = numero
+    
+    st.divider()
+    
+    st.markdown("### Pacientes")
+    run_busqueda = st.text_input("Buscar evaluaciones por R.U.N.")
+    if run_busqueda:
+        evaluaciones_guardadas = obtener_almacen().buscar_por_run(run_busqueda)
+        if not evaluaciones_guardadas:
+            st.caption("No hay evaluaciones guardadas para este R.U.N.")
+        else:
+            evaluacion_elegida = st.selectbox(
+                "Evaluaciones guardadas",
+                evaluaciones_guardadas,
+                format_func=lambda ev: f"{ev['fecha_evaluacion']} · {ev['nombre_completo']} ({ev['psicologa'] or 'sin psicólogo/a'})"
+            )
+            if st.button("Cargar evaluación"):
+                datos_cargados = obtener_almacen().cargar(evaluacion_elegida['run'], evaluacion_elegida['fecha_evaluacion'])
+                if datos_cargados is None:
+                    # Se eliminó entre la búsqueda y el clic
+                    st.warning("La evaluación ya no está guardada; busque nuevamente.")
+                else:
+                    reemplazar_form_data(datos_cargados)
+                    cancelar_informe()
+                    st.session_state.informe_pdf = None
+                    st.session_state.metricas_descarga = None
+                    st.session_state.historial_mejoras = {}
+                    st.session_state.step = 1
+    
+    st.divider()
+    
+    st.markdown("### Formulario")
+    agrupar_envios = st.checkbox(
+        "Enviar cada paso al presionar Continuar",
+        value=AGRUPAR_ENVIOS_POR_PASO,
+        help="Los cambios dentro de un paso no recargan la aplicación hasta presionar Atrás o Continuar."
+    )
+    st.caption(f"Recargas en esta sesión: {st.session_state.recargas['total']} "
+               f"(paso actual: {st.session_state.recargas['por_paso'].get(st.session_state.step, 0)})")
     
     st.divider()
     
     st.markdown("### Configuración API")
     api_key = st.text_input("API Key de Anthropic", type="password", help="Introduce tu API key de Anthropic para mejorar la redacción")
+    max_concurrencia = st.number_input(
+        "Solicitudes simultáneas",
+        min_value=1,
+        max_value=len(SECCIONES_MEJORABLES),
+        value=min(max(MAX_SOLICITUDES_CONCURRENTES, 1), len(SECCIONES_MEJORABLES)),
+        help="Número máximo de secciones enviadas a la vez a la API. Con 1 se procesan una tras otra."
+    )
+    streaming = st.checkbox(
+        "Mostrar el texto mientras se genera",
+        value=STREAMING,
+        help="Muestra la redacción mejorada a medida que llega. El formulario se actualiza solo cuando terminan todas las secciones."
+    )
+    circuito = estado_circuito()
+    if circuito["estado"] == "abierto":
+        st.warning(f"API con fallas reiteradas: las mejoras se pausan {circuito['reintentar_en']:.0f} s y se conserva el texto original.")
+    elif circuito["estado"] == "semiabierto":
+        st.caption("Estado de la API: 🟡 comprobando si volvió a responder")
+    else:
+        st.caption(f"Estado de la API: 🟢 operativa ({circuito['fallos']} fallos en las últimas {circuito['solicitudes']} solicitudes)")
+    estadisticas_cache = obtener_cache_ia().estadisticas()
+    st.caption(f"Caché de redacción: {estadisticas_cache['aciertos']} aciertos · {estadisticas_cache['fallos']} fallos · {estadisticas_cache['entradas']} textos guardados")
+    
+    st.divider()
+    
+    st.markdown("### Rendimiento")
+    if st.checkbox("Mostrar métricas de rendimiento", help="Percentiles de las últimas recargas, informes generados y llamadas a la API de este servidor."):
+        metricas_proceso = tabla_metricas()
+        if not metricas_proceso:
+            st.caption("Aún no hay mediciones.")
+        else:
+            st.dataframe(metricas_proceso, hide_index=True)
+        memoria = memoria_sesion()
+        st.caption(f"Memoria de esta sesión: {sum(tamano for _, tamano in memoria) / 1024:.1f} KB (aprox.)")
+        st.markdown(tabla_html(("Clave", "KB"), [(clave, f"{tamano / 1024:.1f}") for clave, tamano in memoria[:8]]), unsafe_allow_html=True)
+        blobs = obtener_almacen_blobs().estadisticas()
+        st.caption(f"Informes en disco: {blobs['archivos']} archivos, {blobs['bytes'] / 1024 ** 2:.1f} de {blobs['max_bytes'] / 1024 ** 2:.0f} MB")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button("Prometheus", data=REGISTRO.exportar_prometheus(), file_name="metricas.prom", mime="text/plain")
+        with col2:
+            st.download_button("JSON lines", data=REGISTRO.exportar_jsonl(), file_name="metricas.jsonl", mime="application/x-ndjson")
     
     st.divider()
     
@@ -512,420 +733,201 @@ with st.sidebar:
 
 # PASO 1: DATOS DEL PACIENTE
 if st.session_state.step == 1:
-    st.markdown('<div class="section-header">I. DATOS DEL PACIENTE</div>', unsafe_allow_html=True)
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        nombre_completo = st.text_input("Nombre Completo", value=st.session_state.form_data.get('nombre_completo', ''))
-        fecha_nacimiento = st.date_input("Fecha de Nacimiento", value=datetime.datetime.strptime(st.session_state.form_data.get('fecha_nacimiento', '25 Mayo 1982'), '%d %B %Y') if 'fecha_nacimiento' in st.session_state.form_data else datetime.date(1982, 5, 25), format="DD/MM/YYYY")
-        domicilio = st.text_input("Domicilio", value=st.session_state.form_data.get('domicilio', ''))
-        email = st.text_input("Email", value=st.session_state.form_data.get('email', ''))
-        fecha_evaluacion = st.date_input("Fecha de Evaluación", value=datetime.datetime.strptime(st.session_state.form_data.get('fecha_evaluacion', '14-02-2025'), '%d-%m-%Y') if 'fecha_evaluacion' in st.session_state.form_data else datetime.date.today(), format="DD/MM/YYYY")
-        escolaridad = st.selectbox("Escolaridad", ["Básica Incompleta", "Básica Completa", "Media Incompleta", "Media Completa", "Técnica Incompleta", "Técnica Completa", "Universitaria Incompleta", "Universitaria Completa"], index=["Básica Incompleta", "Básica Completa", "Media Incompleta", "Media Completa", "Técnica Incompleta", "Técnica Completa", "Universitaria Incompleta", "Universitaria Completa"].index(st.session_state.form_data.get('escolaridad', "Media Completa")))
-        sexo = st.selectbox("Sexo", ["Femenino", "Masculino", "No Binario", "Prefiero no decir"], index=["Femenino", "Masculino", "No Binario", "Prefiero no decir"].index(st.session_state.form_data.get('sexo', "Femenino")))
-    
-    with col2:
-        run = st.text_input("R.U.N.", value=st.session_state.form_data.get('run', ''))
-        # Calcular edad automáticamente
-        today = datetime.date.today()
-        edad = today.year - fecha_nacimiento.year - ((today.month, today.day) < (fecha_nacimiento.month, fecha_nacimiento.day))
-        st.text_input("Edad (años)", value=str(edad), disabled=True)
-        telefono = st.text_input("Teléfono", value=st.session_state.form_data.get('telefono', ''))
-        prevision = st.selectbox("Previsión", ["Fonasa", "Isapre", "Particular", "Otra"], index=["Fonasa", "Isapre", "Particular", "Otra"].index(st.session_state.form_data.get('prevision', "Fonasa")))
-        ocupacion = st.text_input("Profesión/Ocupación", value=st.session_state.form_data.get('ocupacion', ''))
-        psicologa = st.text_input("Psicólogo/a", value=st.session_state.form_data.get('psicologa', ''))
-        rut_psicologa = st.text_input("RUT Psicólogo/a", value=st.session_state.form_data.get('rut_psicologa', ''))
-    
-    st.markdown("#### Datos del Procedimiento")
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        datos_procedimiento = st.text_input("Procedimiento y Doctor", value=st.session_state.form_data.get('datos_procedimiento', ''))
-    
-    with col2:
-        fecha_procedimiento = st.text_input("Fecha/Estado", value=st.session_state.form_data.get('fecha_procedimiento', 'En evaluación'))
-    
-    # Guardar datos en la sesión
-    if st.button("Continuar"):
-        st.session_state.form_data.update({
-            'nombre_completo': nombre_completo,
-            'run': run,
-            'fecha_nacimiento': fecha_nacimiento.strftime('%d %B %Y'),
-            'edad': edad,
-            'domicilio': domicilio,
-            'email': email,
-            'telefono': telefono,
-            'fecha_evaluacion': fecha_evaluacion.strftime('%d-%m-%Y'),
-            'prevision': prevision,
-            'escolaridad': escolaridad,
-            'ocupacion': ocupacion,
-            'sexo': sexo,
-            'psicologa': psicologa,
-            'rut_psicologa': rut_psicologa,
-            'datos_procedimiento': datos_procedimiento,
-            'fecha_procedimiento': fecha_procedimiento
-        })
-        next_step()
+    encabezado_paso(1)
+    with contenedor_paso(1):
+        valores = {}
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            campo_formulario('nombre_completo', valores)
+            fecha_nacimiento = campo_formulario('fecha_nacimiento', valores)
+            campo_formulario('domicilio', valores)
+            campo_formulario('email', valores)
+            campo_formulario('fecha_evaluacion', valores)
+            campo_formulario('escolaridad', valores)
+            campo_formulario('sexo', valores)
+        
+        with col2:
+            campo_formulario('run', valores)
+            # Calcular edad automáticamente
+            today = datetime.date.today()
+            edad = today.year - fecha_nacimiento.year - ((today.month, today.day) < (fecha_nacimiento.month, fecha_nacimiento.day))
+            st.text_input(CAMPOS['edad']['etiqueta'], value=str(edad), disabled=True,
+                          help="Se actualiza al continuar." if agrupar_envios else None)
+            valores['edad'] = edad
+            campo_formulario('telefono', valores)
+            campo_formulario('prevision', valores)
+            campo_formulario('ocupacion', valores)
+            campo_formulario('psicologa', valores)
+            campo_formulario('rut_psicologa', valores)
+        
+        st.markdown("#### Datos del Procedimiento")
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            campo_formulario('datos_procedimiento', valores)
+        
+        with col2:
+            campo_formulario('fecha_procedimiento', valores)
+        
+        autoguardar_borrador(valores)
+        
+        # Guardar datos en la sesión
+        if boton_paso("Continuar", key="continuar_1"):
+            confirmar_paso(valores)
 
 # PASO 2: ANTECEDENTES FAMILIARES
 elif st.session_state.step == 2:
-    st.markdown('<div class="section-header">II. ANTECEDENTES FAMILIARES</div>', unsafe_allow_html=True)
-    
-    familia_nuclear = st.text_area("Familia Nuclear (composición)", value=st.session_state.form_data.get('familia_nuclear', ''), height=100)
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        situacion_conyugal_padres = st.selectbox("Situación Conyugal de los Padres", ["Casados", "Separados", "Divorciados", "Viudo/a", "Convivencia", "No Aplica"], index=["Casados", "Separados", "Divorciados", "Viudo/a", "Convivencia", "No Aplica"].index(st.session_state.form_data.get('situacion_conyugal_padres', "Casados")))
-        estado_civil = st.selectbox("Estado Civil del Paciente", ["Soltero/a", "Casado/a", "Divorciado/a", "Viudo/a", "Convivencia"], index=["Soltero/a", "Casado/a", "Divorciado/a", "Viudo/a", "Convivencia"].index(st.session_state.form_data.get('estado_civil', "Soltero/a")))
-    
-    with col2:
-        hijos = st.number_input("Número de Hijos", min_value=0, value=int(st.session_state.form_data.get('hijos', 0)))
-        redes_apoyo = st.text_input("Redes de Apoyo", value=st.session_state.form_data.get('redes_apoyo', ''))
-    
-    enfermedades_familia = st.text_area("¿Existe alguna enfermedad de importancia en la familia? ¿Trastornos mentales y/o adicciones?", value=st.session_state.form_data.get('enfermedades_familia', 'Sin antecedentes relevantes.'), height=100)
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        if st.button("Atrás"):
-            prev_step()
-    
-    with col2:
-        if st.button("Continuar", key="continuar_2"):
-            st.session_state.form_data.update({
-                'familia_nuclear': familia_nuclear,
-                'situacion_conyugal_padres': situacion_conyugal_padres,
-                'estado_civil': estado_civil,
-                'hijos': hijos,
-                'redes_apoyo': redes_apoyo,
-                'enfermedades_familia': enfermedades_familia
-            })
-            next_step()
+    encabezado_paso(2)
+    with contenedor_paso(2):
+        valores = {}
+        
+        campo_formulario('familia_nuclear', valores)
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            campo_formulario('situacion_conyugal_padres', valores)
+            campo_formulario('estado_civil', valores)
+        
+        with col2:
+            campo_formulario('hijos', valores)
+            campo_formulario('redes_apoyo', valores)
+        
+        campo_formulario('enfermedades_familia', valores)
+        
+        botones_navegacion(2, valores)
 
 # PASO 3: ANTECEDENTES MÓRBIDOS
 elif st.session_state.step == 3:
-    st.markdown('<div class="section-header">III. ANTECEDENTES MÓRBIDOS</div>', unsafe_allow_html=True)
-    
-    antecedentes_natales = st.text_area("Antecedentes pre, peri y post natales", value=st.session_state.form_data.get('antecedentes_natales', ''), height=150)
-    enfermedades_infancia = st.text_area("Enfermedades importantes en la infancia y adolescencia", value=st.session_state.form_data.get('enfermedades_infancia', 'Sin antecedentes relevantes.'), height=100)
-    enfermedades_actuales = st.text_area("Enfermedades actuales", value=st.session_state.form_data.get('enfermedades_actuales', 'Sin antecedentes relevantes.'), height=100)
-    operaciones = st.text_area("Operaciones", value=st.session_state.form_data.get('operaciones', ''), height=100)
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        if st.button("Atrás", key="atras_3"):
-            prev_step()
-    
-    with col2:
-        if st.button("Continuar", key="continuar_3"):
-            st.session_state.form_data.update({
-                'antecedentes_natales': antecedentes_natales,
-                'enfermedades_infancia': enfermedades_infancia,
-                'enfermedades_actuales': enfermedades_actuales,
-                'operaciones': operaciones
-            })
-            next_step()
+    encabezado_paso(3)
+    with contenedor_paso(3):
+        valores = {}
+        
+        for clave in CAMPOS_POR_PASO[3]:
+            campo_formulario(clave, valores)
+        
+        botones_navegacion(3, valores)
 
 # PASO 4: ESTADO DE SALUD MENTAL
 elif st.session_state.step == 4:
-    st.markdown('<div class="section-header">IV. ESTADO DE SALUD MENTAL</div>', unsafe_allow_html=True)
-    
-    antecedentes_salud_mental = st.text_area("Antecedentes de Salud Mental", value=st.session_state.form_data.get('antecedentes_salud_mental', '-'), height=150)
-    
-    estado_salud_mental = st.selectbox("Estado de salud mental", ["Estable", "Inestable", "En tratamiento", "Otro"], index=["Estable", "Inestable", "En tratamiento", "Otro"].index(st.session_state.form_data.get('estado_salud_mental', "Estable")))
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        if st.button("Atrás", key="atras_4"):
-            prev_step()
-    
-    with col2:
-        if st.button("Continuar", key="continuar_4"):
-            st.session_state.form_data.update({
-                'antecedentes_salud_mental': antecedentes_salud_mental,
-                'estado_salud_mental': estado_salud_mental
-            })
-            next_step()
+    encabezado_paso(4)
+    with contenedor_paso(4):
+        valores = {}
+        
+        for clave in CAMPOS_POR_PASO[4]:
+            campo_formulario(clave, valores)
+        
+        botones_navegacion(4, valores)
 
 # PASO 5: HISTORIA ESCOLAR
 elif st.session_state.step == 5:
-    st.markdown('<div class="section-header">V. HISTORIA ESCOLAR</div>', unsafe_allow_html=True)
-    
-    col1, col2, col3 = st.columns(3)
-    
-    with col1:
-        repitencias = st.radio("Repitencias", ["No", "Sí"], index=0 if st.session_state.form_data.get('repitencias', "No") == "No" else 1)
-    
-    with col2:
-        rendimiento_academico = st.selectbox("Rendimiento Académico", ["Excelente", "Bueno", "Regular", "Deficiente"], index=["Excelente", "Bueno", "Regular", "Deficiente"].index(st.session_state.form_data.get('rendimiento_academico', "Excelente")))
-    
-    with col3:
-        comportamiento_escolar = st.selectbox("Comportamiento Escolar", ["Excelente", "Bueno", "Regular", "Deficiente"], index=["Excelente", "Bueno", "Regular", "Deficiente"].index(st.session_state.form_data.get('comportamiento_escolar', "Bueno")))
-    
-    if repitencias == "Sí":
-        repitencias_detalles = st.text_area("Detalle las repitencias (cursos, motivos)", value=st.session_state.form_data.get('repitencias_detalles', ''), height=100)
-    else:
-        repitencias_detalles = ""
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        if st.button("Atrás", key="atras_5"):
-            prev_step()
-    
-    with col2:
-        if st.button("Continuar", key="continuar_5"):
-            st.session_state.form_data.update({
-                'repitencias': repitencias,
-                'repitencias_detalles': repitencias_detalles,
-                'rendimiento_academico': rendimiento_academico,
-                'comportamiento_escolar': comportamiento_escolar
-            })
-            next_step()
+    encabezado_paso(5)
+    with contenedor_paso(5):
+        valores = {}
+        
+        col1, col2, col3 = st.columns(3)
+        
+        with col1:
+            campo_formulario('repitencias', valores)
+        
+        with col2:
+            campo_formulario('rendimiento_academico', valores)
+        
+        with col3:
+            campo_formulario('comportamiento_escolar', valores)
+        
+        campo_formulario('repitencias_detalles', valores)
+        
+        botones_navegacion(5, valores)
 
 # PASO 6: ABUSO O DEPENDENCIAS DE SUSTANCIAS
 elif st.session_state.step == 6:
-    st.markdown('<div class="section-header">VI. ABUSO O DEPENDENCIAS DE SUSTANCIAS</div>', unsafe_allow_html=True)
-    
-    st.markdown("#### Ingestión de:")
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        consumo_alcohol = st.radio("Alcohol", ["No", "Sí", "Ocasionalmente"], index=2 if st.session_state.form_data.get('consumo_alcohol', "Ocasionalmente") == "Ocasionalmente" else (1 if st.session_state.form_data.get('consumo_alcohol', "No") == "Sí" else 0))
-        if consumo_alcohol != "No":
-            detalles_alcohol = st.text_input("Detalles del consumo de alcohol", value=st.session_state.form_data.get('detalles_alcohol', 'Piña colada o Pisco sour'))
-        else:
-            detalles_alcohol = ""
+    encabezado_paso(6)
+    with contenedor_paso(6):
+        valores = {}
         
-        consumo_marihuana = st.radio("Marihuana", ["No", "Sí", "Ocasionalmente"], index=2 if st.session_state.form_data.get('consumo_marihuana', "No") == "Ocasionalmente" else (1 if st.session_state.form_data.get('consumo_marihuana', "No") == "Sí" else 0))
-        if consumo_marihuana != "No":
-            detalles_marihuana = st.text_input("Detalles del consumo de marihuana", value=st.session_state.form_data.get('detalles_marihuana', ''))
-        else:
-            detalles_marihuana = ""
-    
-    with col2:
-        consumo_tabaco = st.radio("Tabaco", ["No", "Sí", "Ocasionalmente"], index=2 if st.session_state.form_data.get('consumo_tabaco', "No") == "Ocasionalmente" else (1 if st.session_state.form_data.get('consumo_tabaco', "No") == "Sí" else 0))
-        if consumo_tabaco != "No":
-            detalles_tabaco = st.text_input("Detalles del consumo de tabaco", value=st.session_state.form_data.get('detalles_tabaco', ''))
-        else:
-            detalles_tabaco = ""
+        st.markdown("#### Ingestión de:")
         
-        consumo_otras_drogas = st.radio("Otras drogas", ["No", "Sí"], index=1 if st.session_state.form_data.get('consumo_otras_drogas', "No") == "Sí" else 0)
-        if consumo_otras_drogas == "Sí":
-            detalles_otras_drogas = st.text_input("Especifique otras drogas", value=st.session_state.form_data.get('detalles_otras_drogas', ''))
-        else:
-            detalles_otras_drogas = ""
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        if st.button("Atrás", key="atras_6"):
-            prev_step()
-    
-    with col2:
-        if st.button("Continuar", key="continuar_6"):
-            st.session_state.form_data.update({
-                'consumo_alcohol': consumo_alcohol,
-                'detalles_alcohol': detalles_alcohol,
-                'consumo_tabaco': consumo_tabaco,
-                'detalles_tabaco': detalles_tabaco,
-                'consumo_marihuana': consumo_marihuana,
-                'detalles_marihuana': detalles_marihuana,
-                'consumo_otras_drogas': consumo_otras_drogas,
-                'detalles_otras_drogas': detalles_otras_drogas
-            })
-            next_step()
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            campo_formulario('consumo_alcohol', valores)
+            campo_formulario('detalles_alcohol', valores)
+            campo_formulario('consumo_marihuana', valores)
+            campo_formulario('detalles_marihuana', valores)
+        
+        with col2:
+            campo_formulario('consumo_tabaco', valores)
+            campo_formulario('detalles_tabaco', valores)
+            campo_formulario('consumo_otras_drogas', valores)
+            campo_formulario('detalles_otras_drogas', valores)
+        
+        botones_navegacion(6, valores)
 
 # PASO 7: TRASTORNOS DE LA CONDUCTA ALIMENTARIOS
 elif st.session_state.step == 7:
-    st.markdown('<div class="section-header">VII. TRASTORNOS DE LA CONDUCTA ALIMENTARIOS</div>', unsafe_allow_html=True)
-    
-    col1, col2, col3, col4 = st.columns(4)
-    
-    with col1:
-        peso_maximo = st.number_input("Peso máximo (kg)", min_value=0.0, value=float(st.session_state.form_data.get('peso_maximo', 94)))
-    
-    with col2:
-        peso_minimo = st.number_input("Peso mínimo adulto (kg)", min_value=0.0, value=float(st.session_state.form_data.get('peso_minimo', 68)))
-    
-    with col3:
-        peso_ideal = st.number_input("Peso ideal (kg)", min_value=0.0, value=float(st.session_state.form_data.get('peso_ideal', 65)))
-    
-    with col4:
-        altura = st.number_input("Altura (m)", min_value=0.0, step=0.01, value=float(st.session_state.form_data.get('altura', 1.60)))
-    
-    st.markdown("#### Trastornos Alimentarios:")
-    
-    col1, col2, col3, col4 = st.columns(4)
-    
-    with col1:
-        arfid = st.radio("ARFID", ["No", "Sí"], index=1 if st.session_state.form_data.get('arfid', "No") == "Sí" else 0, key="arfid")
-        anorexia = st.radio("Anorexia Nerviosa", ["No", "Sí"], index=1 if st.session_state.form_data.get('anorexia', "No") == "Sí" else 0, key="anorexia")
-    
-    with col2:
-        comedor_emocional = st.radio("Comedor Emocional", ["No", "Sí"], index=1 if st.session_state.form_data.get('comedor_emocional', "No") == "Sí" else 0, key="comedor_emocional")
-        comedor_nocturno = st.radio("Comedor Nocturno", ["No", "Sí"], index=1 if st.session_state.form_data.get('comedor_nocturno', "Si") == "Sí" else 0, key="comedor_nocturno")
-    
-    with col3:
-        bulimia = st.radio("Bulimia Nerviosa", ["No", "Sí"], index=1 if st.session_state.form_data.get('bulimia', "No") == "Sí" else 0, key="bulimia")
-        picoteador = st.radio("Picoteador", ["No", "Sí"], index=1 if st.session_state.form_data.get('picoteador', "Si") == "Sí" else 0, key="picoteador")
-    
-    with col4:
-        t_atracon = st.radio("Trastorno por Atracón", ["No", "Sí"], index=1 if st.session_state.form_data.get('t_atracon', "No") == "Sí" else 0, key="t_atracon")
-        food_craving = st.radio("Food Craving", ["No", "Sí"], index=1 if st.session_state.form_data.get('food_craving', "No") == "Sí" else 0, key="food_craving")
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        if st.button("Atrás", key="atras_7"):
-            prev_step()
-    
-    with col2:
-        if st.button("Continuar", key="continuar_7"):
-            st.session_state.form_data.update({
-                'peso_maximo': peso_maximo,
-                'peso_minimo': peso_minimo,
-                'peso_ideal': peso_ideal,
-                'altura': altura,
-                'arfid': arfid,
-                'comedor_emocional': comedor_emocional,
-                'anorexia': anorexia,
-                'comedor_nocturno': comedor_nocturno,
-                'bulimia': bulimia,
-                'picoteador': picoteador,
-                't_atracon': t_atracon,
-                'food_craving': food_craving
-            })
-            next_step()
+    encabezado_paso(7)
+    with contenedor_paso(7):
+        valores = {}
+        
+        for columna, clave in zip(st.columns(4), ('peso_maximo', 'peso_minimo', 'peso_ideal', 'altura')):
+            with columna:
+                campo_formulario(clave, valores)
+        
+        st.markdown("#### Trastornos Alimentarios:")
+        
+        col1, col2, col3, col4 = st.columns(4)
+        
+        with col1:
+            campo_formulario('arfid', valores)
+            campo_formulario('anorexia', valores)
+        
+        with col2:
+            campo_formulario('comedor_emocional', valores)
+            campo_formulario('comedor_nocturno', valores)
+        
+        with col3:
+            campo_formulario('bulimia', valores)
+            campo_formulario('picoteador', valores)
+        
+        with col4:
+            campo_formulario('t_atracon', valores)
+            campo_formulario('food_craving', valores)
+        
+        botones_navegacion(7, valores)
 
 # PASO 8: CONSCIENCIA DEL PROBLEMA Y NIVEL DE MOTIVACIÓN PARA EL CAMBIO
 elif st.session_state.step == 8:
-    st.markdown('<div class="section-header">VIII. CONSCIENCIA DEL PROBLEMA Y NIVEL DE MOTIVACIÓN PARA EL CAMBIO</div>', unsafe_allow_html=True)
-    
-    factores_origen = st.text_area("Análisis de factores que dieron origen y perpetúan el problema", value=st.session_state.form_data.get('factores_origen', ''), height=200)
-    
-    razones_cambiar = st.text_area("Razones para cambiar", value=st.session_state.form_data.get('razones_cambiar', ''), height=150)
-    
-    paciente_apto = st.radio("Paciente apto para procedimiento", ["SI", "NO", "SI, CON SEGUIMIENTO"], index=2 if st.session_state.form_data.get('paciente_apto', "SI, CON SEGUIMIENTO") == "SI, CON SEGUIMIENTO" else (1 if st.session_state.form_data.get('paciente_apto', "") == "NO" else 0))
-    
-    observaciones = st.text_area("Observaciones", value=st.session_state.form_data.get('observaciones', ''), height=150)
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        if st.button("Atrás", key="atras_8"):
-            prev_step()
-    
-    with col2:
-        if st.button("Continuar", key="continuar_8"):
-            st.session_state.form_data.update({
-                'factores_origen': factores_origen,
-                'razones_cambiar': razones_cambiar,
-                'paciente_apto': paciente_apto,
-                'observaciones': observaciones
-            })
-            next_step()
+    encabezado_paso(8)
+    with contenedor_paso(8):
+        valores = {}
+        
+        for clave in CAMPOS_POR_PASO[8]:
+            campo_formulario(clave, valores)
+        
+        botones_navegacion(8, valores)
 
 # PASO 9: REVISIÓN Y GENERACIÓN
 elif st.session_state.step == 9:
-    st.markdown('<div class="section-header">REVISIÓN Y GENERACIÓN DE INFORME</div>', unsafe_allow_html=True)
+    encabezado_paso(9)
     
     st.markdown('<div class="info-box">Revise la información ingresada antes de generar el informe. Si desea mejorar la redacción, asegúrese de tener configurada la API key de Anthropic.</div>', unsafe_allow_html=True)
     
     # Mostrar datos ingresados en formato de tabla
     st.markdown("### Resumen de la Información Ingresada")
     
-    with st.expander("I. DATOS DEL PACIENTE"):
-        datos_paciente = {
-            "Nombre Completo": st.session_state.form_data.get('nombre_completo', ''),
-            "R.U.N.": st.session_state.form_data.get('run', ''),
-            "Fecha de Nacimiento": st.session_state.form_data.get('fecha_nacimiento', ''),
-            "Edad": st.session_state.form_data.get('edad', ''),
-            "Domicilio": st.session_state.form_data.get('domicilio', ''),
-            "Email": st.session_state.form_data.get('email', ''),
-            "Teléfono": st.session_state.form_data.get('telefono', ''),
-            "Escolaridad": st.session_state.form_data.get('escolaridad', ''),
-            "Profesión/Ocupación": st.session_state.form_data.get('ocupacion', '')
-        }
-        st.table(pd.DataFrame(list(datos_paciente.items()), columns=['Campo', 'Valor']))
-    
-    with st.expander("II. ANTECEDENTES FAMILIARES"):
-        antecedentes_familiares = {
-            "Familia Nuclear": st.session_state.form_data.get('familia_nuclear', ''),
-            "Situación Conyugal Padres": st.session_state.form_data.get('situacion_conyugal_padres', ''),
-            "Estado Civil": st.session_state.form_data.get('estado_civil', ''),
-            "Hijos": st.session_state.form_data.get('hijos', ''),
-            "Redes de Apoyo": st.session_state.form_data.get('redes_apoyo', ''),
-            "Enfermedades Familia": st.session_state.form_data.get('enfermedades_familia', '')
-        }
-        st.table(pd.DataFrame(list(antecedentes_familiares.items()), columns=['Campo', 'Valor']))
-    
-    # Otras secciones expandibles para revisar
-    with st.expander("III. ANTECEDENTES MÓRBIDOS"):
-        antecedentes_morbidos = {
-            "Antecedentes pre, peri y post natales": st.session_state.form_data.get('antecedentes_natales', ''),
-            "Enfermedades en infancia y adolescencia": st.session_state.form_data.get('enfermedades_infancia', ''),
-            "Enfermedades actuales": st.session_state.form_data.get('enfermedades_actuales', ''),
-            "Operaciones": st.session_state.form_data.get('operaciones', '')
-        }
-        st.table(pd.DataFrame(list(antecedentes_morbidos.items()), columns=['Campo', 'Valor']))
-    
-    with st.expander("IV-V. SALUD MENTAL E HISTORIA ESCOLAR"):
-        salud_mental_escolar = {
-            "Antecedentes Salud Mental": st.session_state.form_data.get('antecedentes_salud_mental', ''),
-            "Estado Salud Mental": st.session_state.form_data.get('estado_salud_mental', ''),
-            "Repitencias": st.session_state.form_data.get('repitencias', ''),
-            "Rendimiento Académico": st.session_state.form_data.get('rendimiento_academico', ''),
-            "Comportamiento Escolar": st.session_state.form_data.get('comportamiento_escolar', '')
-        }
-        st.table(pd.DataFrame(list(salud_mental_escolar.items()), columns=['Campo', 'Valor']))
-    
-    with st.expander("VI. ABUSO O DEPENDENCIAS DE SUSTANCIAS"):
-        sustancias = {
-            "Alcohol": st.session_state.form_data.get('consumo_alcohol', ''),
-            "Tabaco": st.session_state.form_data.get('consumo_tabaco', ''),
-            "Marihuana": st.session_state.form_data.get('consumo_marihuana', ''),
-            "Otras drogas": st.session_state.form_data.get('consumo_otras_drogas', '')
-        }
-        st.table(pd.DataFrame(list(sustancias.items()), columns=['Sustancia', 'Consumo']))
-    
-    with st.expander("VII. TRASTORNOS DE LA CONDUCTA ALIMENTARIOS"):
-        alimentarios = {
-            "Peso máximo": st.session_state.form_data.get('peso_maximo', ''),
-            "Peso mínimo": st.session_state.form_data.get('peso_minimo', ''),
-            "Peso ideal": st.session_state.form_data.get('peso_ideal', ''),
-            "Altura": st.session_state.form_data.get('altura', ''),
-            "ARFID": st.session_state.form_data.get('arfid', ''),
-            "Comedor Emocional": st.session_state.form_data.get('comedor_emocional', ''),
-            "Anorexia": st.session_state.form_data.get('anorexia', ''),
-            "Comedor Nocturno": st.session_state.form_data.get('comedor_nocturno', ''),
-            "Bulimia": st.session_state.form_data.get('bulimia', ''),
-            "Picoteador": st.session_state.form_data.get('picoteador', ''),
-            "Trastorno Atracón": st.session_state.form_data.get('t_atracon', ''),
-            "Food Craving": st.session_state.form_data.get('food_craving', '')
-        }
-        st.table(pd.DataFrame(list(alimentarios.items()), columns=['Campo', 'Valor']))
-    
-    with st.expander("VIII-IX. CONSCIENCIA DEL PROBLEMA Y OBSERVACIONES"):
-        problema_motivacion = {
-            "Factores de origen": st.session_state.form_data.get('factores_origen', ''),
-            "Razones para cambiar": st.session_state.form_data.get('razones_cambiar', ''),
-            "Paciente apto": st.session_state.form_data.get('paciente_apto', ''),
-            "Observaciones": st.session_state.form_data.get('observaciones', '')
-        }
-        st.table(pd.DataFrame(list(problema_motivacion.items()), columns=['Campo', 'Valor']))
+    for grupo in RESUMEN:
+        with st.expander(grupo["titulo"]):
+            st.markdown(tabla_resumen(grupo), unsafe_allow_html=True)
     
     # Opciones para mejorar el texto con Anthropic
     st.markdown("### Mejorar la Redacción")
     
     mejorar_opciones = st.multiselect(
         "Seleccione las secciones para mejorar la redacción",
-        ["Antecedentes Natales", "Factores de Origen", "Razones para Cambiar", "Observaciones"]
+        list(SECCIONES_MEJORABLES)
     )
     
     if st.button("Mejorar Redacción Seleccionada") and mejorar_opciones:
@@ -933,67 +935,68 @@ elif st.session_state.step == 9:
             st.warning("Debe ingresar una API key de Anthropic para mejorar la redacción.")
         else:
             with st.spinner("Mejorando la redacción con IA..."):
-                # Procesar cada sección seleccionada
-                for opcion in mejorar_opciones:
-                    if opcion == "Antecedentes Natales":
-                        texto_original = st.session_state.form_data.get('antecedentes_natales', '')
-                        texto_mejorado, error = mejorar_texto_con_anthropic(texto_original, api_key)
-                        if error:
-                            st.error(f"Error al mejorar Antecedentes Natales: {error}")
-                        else:
-                            st.session_state.form_data['antecedentes_natales'] = texto_mejorado
-                            st.success("✅ Antecedentes Natales mejorado")
-                    
-                    elif opcion == "Factores de Origen":
-                        texto_original = st.session_state.form_data.get('factores_origen', '')
-                        texto_mejorado, error = mejorar_texto_con_anthropic(texto_original, api_key)
-                        if error:
-                            st.error(f"Error al mejorar Factores de Origen: {error}")
-                        else:
-                            st.session_state.form_data['factores_origen'] = texto_mejorado
-                            st.success("✅ Factores de Origen mejorado")
-                    
-                    elif opcion == "Razones para Cambiar":
-                        texto_original = st.session_state.form_data.get('razones_cambiar', '')
-                        texto_mejorado, error = mejorar_texto_con_anthropic(texto_original, api_key)
-                        if error:
-                            st.error(f"Error al mejorar Razones para Cambiar: {error}")
-                        else:
-                            st.session_state.form_data['razones_cambiar'] = texto_mejorado
-                            st.success("✅ Razones para Cambiar mejorado")
-                    
-                    elif opcion == "Observaciones":
-                        texto_original = st.session_state.form_data.get('observaciones', '')
-                        texto_mejorado, error = mejorar_texto_con_anthropic(texto_original, api_key)
-                        if error:
-                            st.error(f"Error al mejorar Observaciones: {error}")
+                # Orden fijo de las secciones, independiente del orden de selección
+                seleccionadas = [opcion for opcion in SECCIONES_MEJORABLES if opcion in mejorar_opciones]
+                textos = [st.session_state.form_data.get(SECCIONES_MEJORABLES[opcion], '') for opcion in seleccionadas]
+                
+                # Tras una mejora previa solo se envían los párrafos nuevos o editados
+                historial = st.session_state.historial_mejoras
+                planes = [planificar(texto, historial.get(SECCIONES_MEJORABLES[opcion])) for opcion, texto in zip(seleccionadas, textos)]
+                
+                # Enviar los tramos de todas las secciones seleccionadas a la vez
+                if streaming:
+                    resultados_envios = mostrar_mejoras_en_streaming(seleccionadas, planes, api_key, max_concurrencia)
+                else:
+                    envios = [envio for plan in planes for envio in plan["envios"]]
+                    resultados_envios = mejorar_textos_concurrentemente(envios, api_key, max_concurrencia, obtener_cliente_http(), obtener_cache_ia())
+                
+                # Los textos mejorados se copian a form_data juntos, una vez terminadas todas las secciones
+                inicio = 0
+                for opcion, texto, plan in zip(seleccionadas, textos, planes):
+                    propios = resultados_envios[inicio:inicio + len(plan["envios"])]
+                    inicio += len(plan["envios"])
+                    texto_mejorado, error = ensamblar(plan, texto, propios)
+                    if error:
+                        st.error(f"Error al mejorar {opcion}: {error}")
+                    else:
+                        campo = SECCIONES_MEJORABLES[opcion]
+                        actualizar_form_data({campo: texto_mejorado})
+                        historial[campo] = actualizar_historial(plan, propios, texto_mejorado)
+                        if plan["parrafos_enviados"] < plan["parrafos"]:
+                            st.success(f"✅ {opcion} mejorado ({plan['parrafos_enviados']} de {plan['parrafos']} párrafos enviados; el resto no cambió)")
                         else:
-                            st.session_state.form_data['observaciones'] = texto_mejorado
-                            st.success("✅ Observaciones mejorado")
+                            st.success(f"✅ {opcion} mejorado")
+                
+                guardar_evaluacion()
     
     # Generación del informe
     st.markdown("### Generar Informe PDF")
     
-    if st.button("Generar Informe PDF"):
-        with st.spinner("Generando informe..."):
-            try:
-                pdf_bytes = generar_pdf(st.session_state.form_data)
-                st.session_state.pdf_bytes = pdf_bytes
-                st.success("✅ Informe generado correctamente!")
-                st.markdown(get_pdf_download_link(pdf_bytes, "Informe_Psicologico.pdf"), unsafe_allow_html=True)
-            except Exception as e:
-                st.error(f"Error al generar el PDF: {str(e)}")
-    
-    if st.session_state.pdf_bytes is not None:
-        st.markdown(get_pdf_download_link(st.session_state.pdf_bytes, "Informe_Psicologico.pdf"), unsafe_allow_html=True)
+    # Con un informe en preparación, la sección se vuelve a ejecutar sola para consultar su estado
+    intervalo = INTERVALO_CONSULTA_INFORME if st.session_state.trabajo_pdf is not None else None
+    st.fragment(seccion_informe, run_every=intervalo)()
     
     if st.button("Atrás", key="atras_9"):
         prev_step()
     
     if st.button("Nueva Evaluación"):
         st.session_state.step = 1
-        st.session_state.form_data = {}
+        reemplazar_form_data({})
         st.session_state.anthropic_response = None
         st.session_state.anthropic_error = None
-        st.session_state.pdf_bytes = None
-        st.experimental_rerun()
\ No newline at end of file
+        cancelar_informe()
+        st.session_state.informe_pdf = None
+        st.session_state.metricas_descarga = None
+        st.session_state.historial_mejoras = {}
+        st.rerun()
+
+# Anotar el paso en el diario si cambió y guardar en el almacén de sesiones lo que cambió en esta recarga
+registrar_en_diario()
+persistir_sesion()
+
+# Registrar la duración de esta recarga y, en la primera y cada MEMORIA_SESION_CADA, la memoria
+# de la sesión (las que terminan con st.rerun no llegan hasta aquí)
+if (st.session_state.recargas["total"] - 1) % MEMORIA_SESION_CADA == 0:
+    REGISTRO.observar("sesion_memoria_bytes", sum(tamano for _, tamano in memoria_sesion()))
+REGISTRO.observar("app_recarga_segundos", time.perf_counter() - inicio_recarga, paso=paso_recarga)
+REGISTRO.exportar_si_corresponde()
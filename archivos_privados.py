@@ -0,0 +1,36 @@
+import os
+import stat
+import threading
+
+# Los archivos de la aplicación tienen datos de pacientes: directorios 0700 y archivos 0600
+# del usuario que ejecuta la aplicación
+
+# Función para crear (o comprobar) un directorio privado del usuario que ejecuta la aplicación
+def directorio_privado(ruta):
+    os.makedirs(ruta, mode=0o700, exist_ok=True)
+    estado = os.lstat(ruta)
+    if not stat.S_ISDIR(estado.st_mode) or estado.st_uid != os.getuid():
+        raise PermissionError(f"{ruta!r} debe ser un directorio (no un enlace) del usuario que ejecuta la aplicación")
+    if stat.S_IMODE(estado.st_mode) & 0o077:
+        os.chmod(ruta, 0o700)
+
+# Función para preparar un archivo privado (por ejemplo, una base SQLite) antes de abrirlo
+def archivo_privado(ruta):
+    """Crea el directorio con directorio_privado y el archivo vacío con permisos 0600, o
+    restringe los de uno existente. SQLite crea sus archivos -wal y -shm con los mismos
+    permisos que la base."""
+    directorio_privado(os.path.dirname(os.path.abspath(ruta)))
+    descriptor = os.open(ruta, os.O_WRONLY | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    try:
+        if stat.S_IMODE(os.fstat(descriptor).st_mode) & 0o077:
+            os.fchmod(descriptor, 0o600)
+    finally:
+        os.close(descriptor)
+
+# Función para escribir un archivo privado de forma atómica: temporal 0600 y renombrado
+def escribir_privado(ruta, datos):
+    temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    descriptor = os.open(temporal, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(descriptor, "wb") as archivo:
+        archivo.write(datos)
+    os.replace(temporal, ruta)
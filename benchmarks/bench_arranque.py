@@ -0,0 +1,132 @@
+"""Benchmark del arranque de la aplicación: tiempo de importación y memoria residente.
+
+Cada medición corre en un proceso nuevo, que ejecuta una vez app.py (paso 1, como
+la primera visita a un proceso recién creado) con streamlit.testing. Se comparan
+dos variantes:
+
+- actual: la aplicación tal como está, con pandas y fpdf cargados solo al usarse.
+- importacion_anticipada: importando antes pandas e informe_pdf (fpdf), como hacía
+  app.py al inicio; sirve de referencia de "antes".
+
+Uso:
+    python benchmarks/bench_arranque.py
+    python benchmarks/bench_arranque.py --guardar arranque_base.json
+    python benchmarks/bench_arranque.py --comparar arranque_base.json --umbral 10
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Módulos pesados cuya carga interesa informar
+MODULOS_PESADOS = ("pandas", "numpy", "pyarrow", "fpdf")
+
+# Programa que corre en el proceso hijo; imprime sus mediciones como JSON
+PROGRAMA = """
+import json, resource, sys, time
+inicio = time.perf_counter()
+for modulo in {previos!r}:
+    __import__(modulo)
+import streamlit
+from streamlit.testing.v1 import AppTest
+importacion = time.perf_counter() - inicio
+at = AppTest.from_file({app!r}, default_timeout=60)
+at.run()
+total = time.perf_counter() - inicio
+print(json.dumps({{
+    "importacion_segundos": importacion,
+    "arranque_segundos": total,
+    "rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "modulos": [modulo for modulo in {pesados!r} if modulo in sys.modules],
+    "error": [str(e.value) for e in at.exception],
+}}))
+"""
+
+VARIANTES = {
+    "actual": (),
+    "importacion_anticipada": ("pandas", "informe_pdf"),
+}
+
+# Función para medir una vez una variante en un proceso nuevo
+def medir_proceso(previos):
+    codigo = PROGRAMA.format(previos=previos, app=os.path.join(RAIZ, "app.py"), pesados=MODULOS_PESADOS)
+    salida = subprocess.run([sys.executable, "-c", codigo], cwd=RAIZ, capture_output=True, text=True, check=True)
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+# Función para medir una variante varias veces y resumir con la mediana
+def medir_variante(previos, repeticiones):
+    mediciones = [medir_proceso(previos) for _ in range(repeticiones)]
+    errores = [error for m in mediciones for error in m["error"]]
+    if errores:
+        raise RuntimeError(f"La aplicación falló al arrancar: {errores[0]}")
+    return {
+        "importacion_segundos": statistics.median(m["importacion_segundos"] for m in mediciones),
+        "arranque_segundos": statistics.median(m["arranque_segundos"] for m in mediciones),
+        "rss_kb": statistics.median(m["rss_kb"] for m in mediciones),
+        "modulos": mediciones[-1]["modulos"],
+    }
+
+def imprimir(resultados):
+    print(f"{'variante':24} {'importación':>12} {'arranque':>10} {'RSS máx.':>10}  módulos pesados cargados")
+    for nombre, r in resultados.items():
+        print(f"{nombre:24} {r['importacion_segundos'] * 1000:9.0f} ms {r['arranque_segundos'] * 1000:7.0f} ms "
+              f"{r['rss_kb'] / 1024:7.1f} MB  {', '.join(r['modulos']) or '-'}")
+
+# Función para comparar contra una línea base; devuelve la lista de regresiones
+def comparar(resultados, base, umbral):
+    regresiones = []
+    print(f"\n{'variante':24} {'base':>10} {'actual':>10} {'cambio':>9}")
+    for nombre, r in resultados.items():
+        anterior = base.get(nombre)
+        if anterior is None:
+            continue
+        for medida, unidad, escala in (("arranque_segundos", "ms", 1000), ("rss_kb", "MB", 1 / 1024)):
+            cambio = (r[medida] / anterior[medida] - 1) * 100
+            marca = ""
+            if cambio > umbral:
+                marca = "  REGRESIÓN"
+                regresiones.append(f"{nombre}:{medida}")
+            print(f"{nombre:24} {anterior[medida] * escala:7.1f} {unidad} {r[medida] * escala:7.1f} {unidad} {cambio:+8.1f}%{marca}")
+    return regresiones
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del tiempo de arranque y la memoria de la aplicación.")
+    parser.add_argument("--repeticiones", type=int, default=5, help="Procesos por variante; se informa la mediana (por defecto: 5)")
+    parser.add_argument("--guardar", help="Guardar los resultados como línea base en este archivo JSON")
+    parser.add_argument("--comparar", help="Comparar contra una línea base guardada previamente")
+    parser.add_argument("--umbral", type=float, default=10.0, help="Aumento porcentual considerado regresión (por defecto: 10)")
+    args = parser.parse_args(argv)
+
+    resultados = {}
+    for nombre, previos in VARIANTES.items():
+        print(f"Variante {nombre}...", file=sys.stderr)
+        resultados[nombre] = medir_variante(previos, max(args.repeticiones, 1))
+    imprimir(resultados)
+
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as archivo:
+            json.dump({
+                "python": platform.python_version(),
+                "plataforma": platform.platform(),
+                "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "resultados": resultados
+            }, archivo, ensure_ascii=False, indent=2)
+        print(f"\nLínea base guardada en {args.guardar}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as archivo:
+            base = json.load(archivo)
+        regresiones = comparar(resultados, base["resultados"], args.umbral)
+        if regresiones:
+            print(f"\n{len(regresiones)} regresiones sobre el {args.umbral:.0f}%: {', '.join(regresiones)}", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
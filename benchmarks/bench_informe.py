@@ -0,0 +1,219 @@
+"""Benchmarks de la generación de informes y del post-procesamiento de textos.
+
+Mide, para cada escala de datos sintéticos (ver datos_sinteticos.ESCALAS), los
+informes por segundo, el pico de memoria y el tamaño del PDF (con y sin el modo
+compacto, verificando que ambos dibujan lo mismo), además de
+microbenchmarks de formatear_rut, add_long_field, limpiar_datos y de la limpieza de
+respuestas de la API (api_anthropic.limpiar_respuesta).
+
+Uso:
+    python benchmarks/bench_informe.py --guardar linea_base.json
+    python benchmarks/bench_informe.py --comparar linea_base.json --umbral 10
+"""
+import argparse
+import decimal
+import hashlib
+import json
+import os
+import platform
+import random
+import re
+import sys
+import time
+import tracemalloc
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datos_sinteticos import ESCALAS, RUNS, generar_lote, texto_libre  # noqa: E402
+from api_anthropic import limpiar_respuesta  # noqa: E402
+from informe_pdf import PDF, generar_pdf, limpiar_datos  # noqa: E402
+
+# Función para medir operaciones por segundo (mejor de varias repeticiones)
+def medir(funcion, argumentos, repeticiones):
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        for argumento in argumentos:
+            funcion(argumento)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return len(argumentos) / mejor if mejor else float("inf")
+
+# Función para medir el pico de memoria de una pasada (aparte, porque tracemalloc ralentiza)
+def memoria_pico(funcion, argumentos):
+    tracemalloc.start()
+    try:
+        for argumento in argumentos:
+            funcion(argumento)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+# Operadores que solo cambian el estado con que se dibuja (ver informe_pdf.compactar_contenido)
+_FUENTE = re.compile(r"(?:BT )?(/F\d+ [\d.]+ Tf)(?: ET)?")
+_ESTADO = re.compile(r"[\d. ]+ (w|J|g|rg|G|RG)")
+_CLAVES_ESTADO = {"w": "w", "J": "J", "g": "relleno", "rg": "relleno", "G": "trazo", "RG": "trazo"}
+# Objeto de texto con uno o más renglones; desde el segundo, con desplazamientos relativos
+_TEXTO = re.compile(r"(q [\d. ]+ (?:g|rg) )?BT ((?:-?[\d.]+ -?[\d.]+ Td \((?:[^\\()]|\\.)*\) Tj ?)+)ET( Q)?")
+_RENGLON = re.compile(r"(-?[\d.]+) (-?[\d.]+) Td (\((?:[^\\()]|\\.)*\) Tj)")
+
+# Función para separar un objeto de texto en renglones con su posición absoluta, como los escribe fpdf
+def renglones(linea):
+    texto = _TEXTO.fullmatch(linea)
+    if texto is None:
+        return [linea]
+    color, contenido, cierre = texto.groups()
+    resultado, x, y = [], decimal.Decimal(0), decimal.Decimal(0)
+    for dx, dy, mostrar in _RENGLON.findall(contenido):
+        x, y = x + decimal.Decimal(dx), y + decimal.Decimal(dy)
+        resultado.append(f"{color or ''}BT {x:.2f} {y:.2f} Td {mostrar} ET{cierre or ''}")
+    return resultado
+
+# Función para obtener lo que dibuja cada página de un PDF: cada operación con el estado vigente
+def operaciones_dibujadas(pdf_bytes):
+    paginas = []
+    for flujo in re.findall(rb"<</Filter /FlateDecode /Length \d+>>\nstream\n(.*?)\nendstream", pdf_bytes, re.DOTALL):
+        fuente, estado, operaciones = None, {}, []
+        for linea in zlib.decompress(flujo).decode("latin1").split("\n"):
+            if _FUENTE.fullmatch(linea):
+                fuente = _FUENTE.fullmatch(linea).group(1)
+            elif _ESTADO.fullmatch(linea):
+                estado[_CLAVES_ESTADO[_ESTADO.fullmatch(linea).group(1)]] = linea
+            else:
+                operaciones.extend((fuente if "BT " in renglon else None, tuple(sorted(estado.items())), renglon)
+                                   for renglon in renglones(linea))
+        paginas.append(operaciones)
+    return paginas
+
+def bench_generar_pdf(escala, cantidad, repeticiones):
+    registros = generar_lote(cantidad, escala)
+    # Sin caché de secciones, para medir el costo completo de maquetar cada informe
+    renderizar = lambda datos: generar_pdf(datos, cache_secciones=None)  # noqa: E731
+    salidas = [renderizar(datos) for datos in registros]
+    # El modo compacto solo puede quitar operadores redundantes: se compara con la salida sin compactar
+    sin_compactar = [generar_pdf(datos, cache_secciones=None, compacto=False) for datos in registros]
+    for pdf_bytes, original in zip(salidas, sin_compactar):
+        if operaciones_dibujadas(pdf_bytes) != operaciones_dibujadas(original):
+            raise RuntimeError(f"El modo compacto cambió lo dibujado en un informe de escala {escala}")
+    # Con salida determinista, la huella solo cambia si cambia algún PDF
+    huella = hashlib.sha256()
+    for pdf_bytes in salidas:
+        huella.update(hashlib.sha256(pdf_bytes).digest())
+    return {
+        "ops_por_segundo": medir(renderizar, registros, repeticiones),
+        "memoria_pico_kb": memoria_pico(renderizar, registros) / 1024,
+        "bytes_salida": sum(len(pdf_bytes) for pdf_bytes in salidas) / len(salidas),
+        "bytes_sin_compactar": sum(len(pdf_bytes) for pdf_bytes in sin_compactar) / len(sin_compactar),
+        "huella_salida": huella.hexdigest(),
+    }
+
+def bench_formatear_rut(repeticiones):
+    pdf = PDF()
+    runs = list(RUNS) * 500
+    return {"ops_por_segundo": medir(pdf.formatear_rut, runs, repeticiones)}
+
+def bench_add_long_field(escala, cantidad, repeticiones):
+    rng = random.Random(f"add_long_field-{escala}")
+    textos = [texto_libre(rng, ESCALAS[escala]) for _ in range(cantidad)]
+
+    def dibujar(texto):
+        pdf = PDF()
+        pdf.add_page()
+        pdf.add_long_field("Factores de origen:", texto)
+
+    return {
+        "ops_por_segundo": medir(dibujar, textos, repeticiones),
+        "memoria_pico_kb": memoria_pico(dibujar, textos) / 1024,
+    }
+
+def bench_limpiar_datos(escala, cantidad, repeticiones):
+    registros = generar_lote(cantidad, escala, semilla=10_000)
+    return {"ops_por_segundo": medir(limpiar_datos, registros, repeticiones)}
+
+def bench_limpiar_respuesta(escala, cantidad, repeticiones):
+    rng = random.Random(f"limpiar_respuesta-{escala}")
+    # Respuestas con y sin introducción del modelo
+    respuestas = [("Aquí está el texto corregido y mejorado:\n\n" if i % 2 else "") + texto_libre(rng, ESCALAS[escala])
+                  for i in range(cantidad)]
+    return {"ops_por_segundo": medir(limpiar_respuesta, respuestas, repeticiones)}
+
+# Función para ejecutar todos los benchmarks y devolver sus resultados por nombre
+def ejecutar(escalas, cantidad, repeticiones):
+    resultados = {"formatear_rut": bench_formatear_rut(repeticiones)}
+    for escala in escalas:
+        # Los textos de varias páginas son lentos: se usan menos registros
+        n = max(cantidad // 10, 2) if escala == "multipagina" else cantidad
+        print(f"Escala {escala} ({n} registros)...", file=sys.stderr)
+        resultados[f"generar_pdf[{escala}]"] = bench_generar_pdf(escala, n, repeticiones)
+        resultados[f"add_long_field[{escala}]"] = bench_add_long_field(escala, n, repeticiones)
+        resultados[f"limpiar_datos[{escala}]"] = bench_limpiar_datos(escala, n, repeticiones)
+        resultados[f"limpiar_respuesta[{escala}]"] = bench_limpiar_respuesta(escala, n, repeticiones)
+    return resultados
+
+def imprimir(resultados):
+    print(f"{'benchmark':32} {'ops/s':>12} {'memoria pico':>14} {'tamaño PDF':>12} {'sin compactar':>14}")
+    for nombre, r in resultados.items():
+        memoria = f"{r['memoria_pico_kb']:.0f} KB" if "memoria_pico_kb" in r else "-"
+        tamano = f"{r['bytes_salida'] / 1024:.1f} KB" if "bytes_salida" in r else "-"
+        original = "-"
+        if "bytes_sin_compactar" in r:
+            reduccion = (1 - r["bytes_salida"] / r["bytes_sin_compactar"]) * 100
+            original = f"{r['bytes_sin_compactar'] / 1024:.1f} KB (-{reduccion:.0f}%)"
+        print(f"{nombre:32} {r['ops_por_segundo']:12.1f} {memoria:>14} {tamano:>12} {original:>14}")
+
+# Función para comparar contra una línea base; devuelve la lista de regresiones
+def comparar(resultados, base, umbral):
+    regresiones = []
+    print(f"\n{'benchmark':32} {'base ops/s':>12} {'actual ops/s':>12} {'cambio':>9}")
+    for nombre, r in resultados.items():
+        anterior = base.get(nombre)
+        if anterior is None:
+            print(f"{nombre:32} {'-':>12} {r['ops_por_segundo']:12.1f} {'nuevo':>9}")
+            continue
+        cambio = (r["ops_por_segundo"] / anterior["ops_por_segundo"] - 1) * 100
+        marca = ""
+        if cambio < -umbral:
+            marca = "  REGRESIÓN"
+            regresiones.append(nombre)
+        print(f"{nombre:32} {anterior['ops_por_segundo']:12.1f} {r['ops_por_segundo']:12.1f} {cambio:+8.1f}%{marca}")
+        # El tamaño del PDF es determinista: cualquier diferencia indica un cambio en la salida
+        if "bytes_salida" in r and "bytes_salida" in anterior and r["bytes_salida"] != anterior["bytes_salida"]:
+            print(f"{'':32} tamaño PDF: {anterior['bytes_salida']:.0f} -> {r['bytes_salida']:.0f} bytes")
+        elif "huella_salida" in r and "huella_salida" in anterior and r["huella_salida"] != anterior["huella_salida"]:
+            print(f"{'':32} mismo tamaño, pero los PDF generados cambiaron")
+    return regresiones
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de generación de informes con datos sintéticos.")
+    parser.add_argument("--escalas", nargs="+", choices=list(ESCALAS), default=list(ESCALAS), help="Escalas de texto libre a medir")
+    parser.add_argument("--registros", type=int, default=40, help="Registros sintéticos por escala (por defecto: 40)")
+    parser.add_argument("--repeticiones", type=int, default=3, help="Repeticiones por benchmark; se informa la mejor (por defecto: 3)")
+    parser.add_argument("--guardar", help="Guardar los resultados como línea base en este archivo JSON")
+    parser.add_argument("--comparar", help="Comparar contra una línea base guardada previamente")
+    parser.add_argument("--umbral", type=float, default=10.0, help="Caída porcentual de ops/s considerada regresión (por defecto: 10)")
+    args = parser.parse_args(argv)
+
+    resultados = ejecutar(args.escalas, max(args.registros, 1), max(args.repeticiones, 1))
+    imprimir(resultados)
+
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as archivo:
+            json.dump({
+                "python": platform.python_version(),
+                "plataforma": platform.platform(),
+                "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "resultados": resultados
+            }, archivo, ensure_ascii=False, indent=2)
+        print(f"\nLínea base guardada en {args.guardar}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as archivo:
+            base = json.load(archivo)
+        regresiones = comparar(resultados, base["resultados"], args.umbral)
+        if regresiones:
+            print(f"\n{len(regresiones)} regresiones sobre el {args.umbral:.0f}%: {', '.join(regresiones)}", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
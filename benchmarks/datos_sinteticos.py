@@ -0,0 +1,103 @@
+"""Generador determinista de evaluaciones sintéticas para los benchmarks.
+
+Los valores se construyen a partir del esquema del formulario, de modo que cada
+registro tiene las mismas claves que st.session_state.form_data. Con la misma
+semilla y escala siempre se obtiene el mismo registro.
+"""
+import datetime
+import random
+
+from esquema_formulario import CAMPOS
+
+# Cantidad de oraciones por campo de texto libre en cada escala
+ESCALAS = {
+    "corto": 1,
+    "medio": 6,
+    "largo": 30,
+    "multipagina": 200,
+}
+
+NOMBRES = ("María José", "Íñigo", "Begoña", "Óscar Andrés", "Ñusta", "Raúl", "Inés", "José Tomás", "Catalina", "Agustín")
+APELLIDOS = ("Pérez", "Núñez", "Muñoz", "González", "Ibáñez", "Peña", "Fernández", "Cañas", "Rodríguez", "Zúñiga")
+CALLES = ("Av. Providencia", "Pasaje Los Aromos", "Calle Ñuble", "Av. Libertador Bernardo O'Higgins", "Camino Álamos")
+
+ORACIONES = (
+    "La paciente refiere aumento de peso progresivo desde la adolescencia, asociado a episodios de ansiedad.",
+    "Describe hábitos alimentarios desordenados, con ingestas nocturnas y picoteo entre comidas.",
+    "Niega consumo problemático de alcohol; refiere uso ocasional en reuniones familiares.",
+    "Presenta antecedentes de episodio depresivo moderado en 2018, tratado con sertralina durante un año.",
+    "Cuenta con red de apoyo familiar: esposo, dos hijos y una hermana que vive en la misma comuna.",
+    "Reconoce la relación entre su estado emocional y la alimentación (\"como cuando estoy angustiada\").",
+    "Se observa motivación intrínseca para el cambio y comprensión adecuada del procedimiento quirúrgico.",
+    "Madre con diagnóstico de diabetes mellitus tipo 2; padre hipertenso, fallecido a los 67 años.",
+    "Parto de término, sin complicaciones; desarrollo psicomotor dentro de rangos esperados.",
+    "Se sugiere acompañamiento psicológico post operatorio y control en 3 meses.",
+    "Índice de masa corporal estimado en 38,4 kg/m²; intentos previos de dieta con nutricionista.",
+    "Refiere insomnio de conciliación ocasional, sin ideación suicida ni síntomas psicóticos.",
+)
+
+# Textos con casos borde: frases que agrega la API, saltos de línea, palabras sin espacios
+# y signos propios del español (el informe usa fuentes latin-1)
+CASOS_BORDE = (
+    "Aquí está el texto corregido y mejorado: ",
+    "A continuación, presento una versión revisada\n",
+    "Informe Psicológico\n",
+    "\n\n",
+    "Antecedentes: " + "hipercolesterolemia" * 12 + ". ",
+    "   ",
+    "¿Ñandú? ¡Pingüino! Acción, corazón, «comillas» y 1º/2ª. ",
+)
+
+# Variantes de R.U.N. que debe tolerar formatear_rut
+RUNS = ("12345678-9", "12.345.678-K", "1-9", "7654321k", " 9876543-2 ", "", "K", "123456789012")
+
+# Función para construir un texto libre de `oraciones` oraciones
+def texto_libre(rng, oraciones, con_casos_borde=True):
+    partes = []
+    for i in range(oraciones):
+        if con_casos_borde and rng.random() < 0.15:
+            partes.append(rng.choice(CASOS_BORDE))
+        partes.append(rng.choice(ORACIONES))
+        # Párrafos de entre tres y ocho oraciones
+        partes.append("\n\n" if i % rng.randint(3, 8) == 0 else " ")
+    return "".join(partes).strip()
+
+def _valor(rng, clave, campo, oraciones):
+    tipo = campo["tipo"]
+    if tipo in ("opciones", "radio"):
+        return rng.choice(campo["opciones"])
+    if tipo == "entero":
+        return rng.randint(0, 5)
+    if tipo == "decimal":
+        return round(rng.uniform(1.45, 1.95), 2) if clave == "altura" else round(rng.uniform(55, 160), 1)
+    if tipo == "fecha":
+        fecha = datetime.date(1950, 1, 1) + datetime.timedelta(days=rng.randint(0, 27000))
+        return fecha.strftime(campo["formato"])
+    if tipo == "calculado":
+        return rng.randint(18, 70)
+    if tipo == "area":
+        # Algunos campos quedan vacíos para ejercitar los textos por defecto del informe
+        return "" if rng.random() < 0.1 else texto_libre(rng, oraciones)
+    if clave in ("run", "rut_psicologa"):
+        return rng.choice(RUNS)
+    if clave == "nombre_completo":
+        return f"{rng.choice(NOMBRES)} {rng.choice(APELLIDOS)} {rng.choice(APELLIDOS)}"
+    if clave == "psicologa":
+        return f"Ps. {rng.choice(NOMBRES)} {rng.choice(APELLIDOS)}"
+    if clave == "domicilio":
+        return f"{rng.choice(CALLES)} {rng.randint(1, 9999)}, depto. {rng.randint(1, 120)}"
+    if clave == "email":
+        return f"paciente{rng.randint(1, 99999)}@ejemplo.cl"
+    if clave == "telefono":
+        return f"+56 9 {rng.randint(1000, 9999)} {rng.randint(1000, 9999)}"
+    return texto_libre(rng, 1, con_casos_borde=False)[:80]
+
+# Función para generar un form_data sintético completo
+def generar_form_data(semilla, escala="medio"):
+    rng = random.Random(f"{semilla}-{escala}")
+    oraciones = ESCALAS[escala]
+    return {clave: _valor(rng, clave, campo, oraciones) for clave, campo in CAMPOS.items()}
+
+# Función para generar `cantidad` registros a partir de una semilla base
+def generar_lote(cantidad, escala="medio", semilla=0):
+    return [generar_form_data(semilla + i, escala) for i in range(cantidad)]
@@ -0,0 +1,134 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from archivos_privados import archivo_privado
+
+# Configuración por defecto de la caché de mejoras de texto
+CACHE_IA_MAX_ENTRADAS = int(os.environ.get("CACHE_IA_MAX_ENTRADAS", "512"))
+CACHE_IA_TTL_SEGUNDOS = float(os.environ.get("CACHE_IA_TTL_SEGUNDOS", str(7 * 24 * 3600)))
+CACHE_IA_SQLITE = os.environ.get("CACHE_IA_SQLITE") or None
+
+# Función para calcular la clave de caché de un texto
+def clave_cache(texto, modelo, plantilla):
+    """Hash SHA-256 de (modelo, plantilla del prompt, texto de entrada)."""
+    h = hashlib.sha256()
+    for parte in (modelo, plantilla, texto):
+        datos = parte.encode("utf-8")
+        # Prefijo de longitud para que ("ab", "c") y ("a", "bc") no colisionen
+        h.update(len(datos).to_bytes(8, "big"))
+        h.update(datos)
+    return h.hexdigest()
+
+class CacheMejoras:
+    """Caché de textos mejorados: nivel LRU en memoria y nivel SQLite opcional que sobrevive reinicios."""
+
+    def __init__(self, max_entradas=CACHE_IA_MAX_ENTRADAS, ttl_segundos=CACHE_IA_TTL_SEGUNDOS, ruta_sqlite=CACHE_IA_SQLITE):
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+        self._memoria = OrderedDict()  # clave -> (texto, creado)
+        self._lock = threading.Lock()
+        self._en_curso = {}  # clave -> {"evento", "resultado"} de la solicitud en vuelo
+        self.aciertos = 0
+        self.aciertos_disco = 0
+        self.fallos = 0
+        self._db = None
+        if ruta_sqlite:
+            archivo_privado(ruta_sqlite)
+            self._db = sqlite3.connect(ruta_sqlite, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS mejoras (clave TEXT PRIMARY KEY, texto TEXT NOT NULL, creado REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM mejoras WHERE creado < ?", (time.time() - self.ttl_segundos,))
+            self._db.commit()
+
+    def _vigente(self, creado):
+        return time.time() - creado < self.ttl_segundos
+
+    def _leer(self, clave):
+        # Debe llamarse con el lock tomado
+        entrada = self._memoria.get(clave)
+        if entrada is not None:
+            if self._vigente(entrada[1]):
+                self._memoria.move_to_end(clave)
+                self.aciertos += 1
+                return entrada[0]
+            del self._memoria[clave]
+
+        if self._db is not None:
+            fila = self._db.execute("SELECT texto, creado FROM mejoras WHERE clave = ?", (clave,)).fetchone()
+            if fila is not None and self._vigente(fila[1]):
+                self._guardar_en_memoria(clave, fila[0], fila[1])
+                self.aciertos += 1
+                self.aciertos_disco += 1
+                return fila[0]
+        return None
+
+    def _guardar_en_memoria(self, clave, texto, creado):
+        self._memoria[clave] = (texto, creado)
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.max_entradas:
+            self._memoria.popitem(last=False)
+
+    def obtener(self, clave):
+        with self._lock:
+            texto = self._leer(clave)
+            if texto is None:
+                self.fallos += 1
+            return texto
+
+    def guardar(self, clave, texto):
+        creado = time.time()
+        with self._lock:
+            self._guardar_en_memoria(clave, texto, creado)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO mejoras (clave, texto, creado) VALUES (?, ?, ?)",
+                    (clave, texto, creado)
+                )
+                self._db.commit()
+
+    def obtener_o_calcular(self, clave, calcular):
+        """Devuelve (texto, error) desde la caché o llamando a calcular().
+
+        Si otra sesión ya está calculando la misma clave, espera su resultado (también
+        si falló, para no repetir la solicitud cuando la API está fallando) en lugar de
+        llamar a calcular(). Solo se guardan los resultados sin error."""
+        while True:
+            with self._lock:
+                texto = self._leer(clave)
+                if texto is not None:
+                    return texto, None
+                en_curso = self._en_curso.get(clave)
+                if en_curso is None:
+                    self.fallos += 1
+                    en_curso = self._en_curso[clave] = {"evento": threading.Event(), "resultado": None}
+                    break
+            # Otra solicitud idéntica está en vuelo: se usa su resultado. Si terminó con una
+            # excepción no hay resultado, y una de las que esperaban pasa a calcularlo
+            en_curso["evento"].wait()
+            if en_curso["resultado"] is not None:
+                return en_curso["resultado"]
+
+        try:
+            en_curso["resultado"] = calcular()
+            if en_curso["resultado"][1] is None:
+                self.guardar(clave, en_curso["resultado"][0])
+            return en_curso["resultado"]
+        finally:
+            with self._lock:
+                del self._en_curso[clave]
+            en_curso["evento"].set()
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "aciertos": self.aciertos,
+                "aciertos_disco": self.aciertos_disco,
+                "fallos": self.fallos,
+                "entradas": len(self._memoria)
+            }
@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+from collections import deque
+
+# Configuración por defecto del circuito de la API
+CIRCUITO_VENTANA = int(os.environ.get("ANTHROPIC_CIRCUITO_VENTANA", "20"))
+CIRCUITO_MINIMO = int(os.environ.get("ANTHROPIC_CIRCUITO_MINIMO", "5"))
+CIRCUITO_UMBRAL = float(os.environ.get("ANTHROPIC_CIRCUITO_UMBRAL", "0.5"))
+CIRCUITO_PAUSA_SEGUNDOS = float(os.environ.get("ANTHROPIC_CIRCUITO_PAUSA_SEGUNDOS", "30"))
+
+CERRADO = "cerrado"
+ABIERTO = "abierto"
+SEMIABIERTO = "semiabierto"
+
+class CircuitoAPI:
+    """Interruptor de circuito para las llamadas a la API.
+
+    Con el circuito cerrado las solicitudes pasan normalmente. Si en las últimas
+    `ventana` llamadas la proporción de fallos del servicio (429, 5xx, timeouts que
+    persisten tras los reintentos) alcanza `umbral`, el circuito se abre y las solicitudes fallan de inmediato durante
+    `pausa_segundos`. Luego se deja pasar una sola solicitud de prueba (semiabierto):
+    si resulta, el circuito se cierra; si falla, vuelve a abrirse."""
+
+    def __init__(self, ventana=CIRCUITO_VENTANA, minimo=CIRCUITO_MINIMO, umbral=CIRCUITO_UMBRAL, pausa_segundos=CIRCUITO_PAUSA_SEGUNDOS):
+        self.minimo = minimo
+        self.umbral = umbral
+        self.pausa_segundos = pausa_segundos
+        self._resultados = deque(maxlen=ventana)  # True = fallo del servicio
+        self._estado = CERRADO
+        self._abierto_hasta = 0.0
+        self._lock = threading.Lock()
+        self.aperturas = 0
+
+    def permitir(self):
+        """Indica si se puede hacer una solicitud ahora."""
+        with self._lock:
+            if self._estado == CERRADO:
+                return True
+            if self._estado == ABIERTO and time.monotonic() >= self._abierto_hasta:
+                # Esta solicitud es la prueba; las demás siguen fallando rápido hasta que termine
+                self._estado = SEMIABIERTO
+                return True
+            return False
+
+    def registrar_exito(self):
+        with self._lock:
+            if self._estado == SEMIABIERTO:
+                self._estado = CERRADO
+                self._resultados.clear()
+            self._resultados.append(False)
+
+    def registrar_fallo(self):
+        with self._lock:
+            self._resultados.append(True)
+            if self._estado == SEMIABIERTO:
+                self._abrir()
+            elif self._estado == CERRADO and len(self._resultados) >= self.minimo:
+                if sum(self._resultados) / len(self._resultados) >= self.umbral:
+                    self._abrir()
+
+    def _abrir(self):
+        self._estado = ABIERTO
+        self._abierto_hasta = time.monotonic() + self.pausa_segundos
+        self.aperturas += 1
+
+    def segundos_para_reintentar(self):
+        with self._lock:
+            return max(self._abierto_hasta - time.monotonic(), 0.0) if self._estado == ABIERTO else 0.0
+
+    def estado(self):
+        with self._lock:
+            return {
+                "estado": self._estado,
+                "fallos": sum(self._resultados),
+                "solicitudes": len(self._resultados),
+                "reintentar_en": max(self._abierto_hasta - time.monotonic(), 0.0) if self._estado == ABIERTO else 0.0,
+                "aperturas": self.aperturas
+            }
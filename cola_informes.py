@@ -0,0 +1,265 @@
+import contextlib
+import hashlib
+import importlib.metadata
+import importlib.util
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from almacen_blobs import AlmacenBlobs
+from opciones_informe import OPCIONES_INFORME
+
+# Configuración por defecto de la cola de informes
+INFORMES_PROCESOS = int(os.environ.get("INFORMES_PROCESOS", str(max((os.cpu_count() or 2) // 2, 1))))
+INFORMES_COLA_MAX = int(os.environ.get("INFORMES_COLA_MAX", "8"))
+INFORMES_TIMEOUT_SEGUNDOS = float(os.environ.get("INFORMES_TIMEOUT_SEGUNDOS", "30"))
+INFORMES_ESPERA_MAXIMA_SEGUNDOS = float(os.environ.get("INFORMES_ESPERA_MAXIMA_SEGUNDOS", "60"))
+# Segundos que se guarda un informe terminado que ninguna sesión vino a buscar
+INFORMES_RESULTADO_TTL_SEGUNDOS = float(os.environ.get("INFORMES_RESULTADO_TTL_SEGUNDOS", "600"))
+
+EN_COLA = "en_cola"
+GENERANDO = "generando"
+LISTO = "listo"
+ERROR = "error"
+VENCIDO = "vencido"
+DESCONOCIDO = "desconocido"
+
+# Función para calcular la huella del código que dibuja el informe
+def _huella_codigo():
+    """Incluye el código fuente de informe_pdf y esquema_formulario (sin importarlos, para
+    no cargar fpdf) y la versión de fpdf: si cambia el diseño, no se reutilizan PDF anteriores."""
+    h = hashlib.sha256()
+    for modulo in ("informe_pdf", "esquema_formulario"):
+        with open(importlib.util.find_spec(modulo).origin, "rb") as archivo:
+            h.update(archivo.read())
+    try:
+        h.update(importlib.metadata.version("fpdf").encode("ascii"))
+    except importlib.metadata.PackageNotFoundError:
+        pass
+    return h.hexdigest()
+
+HUELLA_CODIGO = _huella_codigo()
+
+# Función para calcular la huella de entrada de un informe: mismos datos, código y opciones, mismo PDF
+def huella_entrada(datos, opciones=OPCIONES_INFORME):
+    """Las opciones se pasan explícitamente a generar_pdf y forman parte de la huella, así
+    que un informe no se reutiliza con otras opciones."""
+    contenido = json.dumps(datos, sort_keys=True, ensure_ascii=False, default=str)
+    ajustes = json.dumps(opciones, sort_keys=True)
+    return hashlib.sha256(f"{HUELLA_CODIGO}\n{ajustes}\n{contenido}".encode("utf-8")).hexdigest()
+
+# Módulo principal sin __file__ ni __spec__, para que los procesos nuevos no importen ninguno
+_PRINCIPAL_VACIO = types.ModuleType("__main__")
+_lock_principal = threading.Lock()
+
+@contextlib.contextmanager
+def _sin_modulo_principal():
+    """Mientras corre el script, Streamlit deja app.py como sys.modules["__main__"] y spawn
+    lo volvería a ejecutar entero (como __mp_main__) en cada proceso que crea. Se oculta
+    solo mientras se crean los procesos de un pool nuevo (ColaInformes._pool)."""
+    with _lock_principal:
+        principal = sys.modules.get("__main__")
+        sys.modules["__main__"] = _PRINCIPAL_VACIO
+        try:
+            yield
+        finally:
+            sys.modules["__main__"] = principal
+
+# Almacenes de informes de cada proceso del pool, para no recorrer el directorio en cada trabajo
+_ALMACENES_PROCESO = {}
+# Cola por la que cada proceso del pool avisa cuándo empieza un trabajo
+_INICIOS_PROCESO = None
+
+def _iniciar_proceso(inicios):
+    global _INICIOS_PROCESO
+    _INICIOS_PROCESO = inicios
+
+def _calentar():
+    # Primer trabajo de cada proceso: deja fpdf importado para el primer informe
+    import informe_pdf  # noqa: F401
+
+def _vencer(signum, frame):
+    raise TimeoutError("La generación del informe superó el tiempo máximo")
+
+def _generar(identificador, limite, datos, timeout_segundos, directorio_blobs, opciones):
+    # Se ejecuta en un proceso del pool; fpdf se importa solo allí. Un trabajo que ya pasó a
+    # un proceso no se puede cancelar: si empieza después de `limite` (time.time()), se descarta
+    if time.time() > limite:
+        raise TimeoutError("El informe esperó demasiado en la cola; intente nuevamente.")
+    _INICIOS_PROCESO.put((identificador, time.time()))
+    from informe_pdf import generar_pdf
+    # El proceso atiende un trabajo a la vez en su hilo principal, así que una alarma
+    # basta para cortar un informe que se demora demasiado sin perder el proceso
+    alarma = timeout_segundos and hasattr(signal, "setitimer")
+    if alarma:
+        signal.signal(signal.SIGALRM, _vencer)
+        signal.setitimer(signal.ITIMER_REAL, timeout_segundos)
+    inicio = time.perf_counter()
+    try:
+        pdf_bytes = generar_pdf(datos, **opciones)
+    finally:
+        if alarma:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    segundos = time.perf_counter() - inicio
+    if directorio_blobs:
+        # El PDF queda en disco y al proceso de la aplicación solo vuelve su clave
+        if directorio_blobs not in _ALMACENES_PROCESO:
+            _ALMACENES_PROCESO[directorio_blobs] = AlmacenBlobs(directorio_blobs)
+        almacen = _ALMACENES_PROCESO[directorio_blobs]
+        clave = almacen.guardar(pdf_bytes)
+        almacen.asociar(huella_entrada(datos, opciones), clave)
+        return {"clave_blob": clave, "bytes_pdf": len(pdf_bytes)}, segundos
+    return {"pdf_bytes": pdf_bytes}, segundos
+
+class ColaInformes:
+    """Cola acotada de informes PDF que se generan en un pool de procesos.
+
+    enviar() devuelve de inmediato un identificador; consultar() informa el estado del
+    trabajo y, cuando terminó, entrega los bytes del PDF (una sola vez). Como máximo
+    `max_pendientes` trabajos esperan o se generan a la vez; los que siguen en cola
+    después de `espera_maxima_segundos` se cancelan, y los que llevan más de
+    `timeout_segundos` generándose se interrumpen dentro del proceso. Con
+    `directorio_blobs`, el PDF se guarda en ese AlmacenBlobs desde el proceso que lo
+    genera y el resultado trae su clave en vez de los bytes. Los informes se dibujan con
+    `opciones` (argumentos de generar_pdf)."""
+
+    def __init__(self, procesos=INFORMES_PROCESOS, max_pendientes=INFORMES_COLA_MAX, timeout_segundos=INFORMES_TIMEOUT_SEGUNDOS,
+                 espera_maxima_segundos=INFORMES_ESPERA_MAXIMA_SEGUNDOS, resultado_ttl_segundos=INFORMES_RESULTADO_TTL_SEGUNDOS,
+                 directorio_blobs=None, opciones=OPCIONES_INFORME):
+        self.procesos = procesos
+        self.max_pendientes = max_pendientes
+        self.timeout_segundos = timeout_segundos
+        self.espera_maxima_segundos = espera_maxima_segundos
+        self.resultado_ttl_segundos = resultado_ttl_segundos
+        self.directorio_blobs = directorio_blobs
+        self.opciones = dict(opciones)
+        self._executor = None
+        self._inicios = None
+        self._trabajos = {}  # identificador -> {"futuro", "pool", "enviado", "inicio", "terminado"}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.rechazados = 0
+
+    def _pool(self):
+        """Debe llamarse con el lock tomado. Se usa spawn: el proceso de Streamlit tiene
+        muchos hilos y no es seguro copiarlo con fork. El pool se crea con todos sus procesos
+        de una vez (un trabajo de calentamiento por proceso, enviados antes de que ninguno
+        pueda terminar), así que los envíos siguientes nunca crean procesos."""
+        if self._executor is None:
+            contexto = multiprocessing.get_context("spawn")
+            self._inicios = contexto.Queue()
+            with _sin_modulo_principal():
+                self._executor = ProcessPoolExecutor(max_workers=self.procesos, mp_context=contexto,
+                                                     initializer=_iniciar_proceso, initargs=(self._inicios,))
+                for _ in range(self.procesos):
+                    self._executor.submit(_calentar)
+        return self._executor
+
+    def iniciar(self):
+        """Crea el pool por adelantado, para que el primer informe no espere a los procesos."""
+        with self._lock:
+            self._pool()
+
+    def _recibir_inicios(self):
+        # Debe llamarse con el lock tomado: anota cuándo empezó cada trabajo en su proceso
+        while self._inicios is not None:
+            try:
+                identificador, inicio = self._inicios.get_nowait()
+            except queue.Empty:
+                break
+            if identificador in self._trabajos:
+                self._trabajos[identificador]["inicio"] = inicio
+
+    def _pendientes(self):
+        return sum(1 for trabajo in self._trabajos.values() if not trabajo["futuro"].done())
+
+    def _purgar(self):
+        # Debe llamarse con el lock tomado: descarta resultados que nadie vino a buscar
+        ahora = time.monotonic()
+        for identificador, trabajo in list(self._trabajos.items()):
+            if trabajo["futuro"].done():
+                trabajo["terminado"] = trabajo["terminado"] or ahora
+                if ahora - trabajo["terminado"] > self.resultado_ttl_segundos:
+                    del self._trabajos[identificador]
+
+    def enviar(self, datos):
+        """Devuelve (identificador, None), o (None, mensaje) si la cola está llena."""
+        with self._lock:
+            self._purgar()
+            if self._pendientes() >= self.max_pendientes:
+                self.rechazados += 1
+                return None, "Hay demasiados informes en preparación; intente nuevamente en unos segundos."
+            identificador = next(self._ids)
+            argumentos = (identificador, time.time() + self.espera_maxima_segundos, dict(datos),
+                          self.timeout_segundos, self.directorio_blobs, self.opciones)
+            try:
+                futuro = self._pool().submit(_generar, *argumentos)
+            except BrokenProcessPool:
+                # Un proceso murió (por ejemplo, sin memoria): se crea un pool nuevo
+                self._executor = None
+                futuro = self._pool().submit(_generar, *argumentos)
+            self._trabajos[identificador] = {"futuro": futuro, "pool": self._executor, "enviado": time.monotonic(),
+                                             "inicio": None, "terminado": None}
+            return identificador, None
+
+    def consultar(self, identificador):
+        """Devuelve {"estado", "segundos"} y, según el estado, "posicion" (en cola),
+        "segundos_generacion" y "pdf_bytes" o "clave_blob" y "bytes_pdf" (listo), o "error"
+        (error, vencido)."""
+        with self._lock:
+            trabajo = self._trabajos.get(identificador)
+            if trabajo is None:
+                return {"estado": DESCONOCIDO, "segundos": 0.0}
+            futuro = trabajo["futuro"]
+            segundos = time.monotonic() - trabajo["enviado"]
+            if not futuro.done():
+                # futuro.running() también es cierto para los trabajos que esperan en la cola
+                # interna del pool; solo cuenta el inicio que avisa el propio proceso
+                self._recibir_inicios()
+                if trabajo["inicio"] is not None:
+                    return {"estado": GENERANDO, "segundos": segundos}
+                if segundos > self.espera_maxima_segundos:
+                    # Si ya pasó a un proceso, cancel() no puede detenerlo, pero _generar lo descarta
+                    futuro.cancel()
+                    del self._trabajos[identificador]
+                    return {"estado": VENCIDO, "segundos": segundos,
+                            "error": "El informe esperó demasiado en la cola; intente nuevamente."}
+                anteriores = sum(1 for otro_id, otro in self._trabajos.items()
+                                 if otro_id < identificador and not otro["futuro"].done() and otro["inicio"] is None)
+                return {"estado": EN_COLA, "segundos": segundos, "posicion": anteriores + 1}
+            del self._trabajos[identificador]
+
+        try:
+            resultado, segundos_generacion = futuro.result()
+        except TimeoutError as e:
+            return {"estado": VENCIDO, "segundos": segundos, "error": str(e)}
+        except BrokenProcessPool:
+            with self._lock:
+                # Las próximas solicitudes usan un pool nuevo (si no se creó ya otro)
+                if self._executor is trabajo["pool"]:
+                    self._executor = None
+            return {"estado": ERROR, "segundos": segundos, "error": "El proceso que generaba el informe terminó inesperadamente."}
+        except Exception as e:
+            return {"estado": ERROR, "segundos": segundos, "error": str(e)}
+        return dict(resultado, estado=LISTO, segundos=segundos, segundos_generacion=segundos_generacion)
+
+    def cancelar(self, identificador):
+        """Cancela un trabajo que todavía no empezó; uno en curso termina y se descarta."""
+        with self._lock:
+            trabajo = self._trabajos.pop(identificador, None)
+        if trabajo is not None:
+            trabajo["futuro"].cancel()
+
+    def estadisticas(self):
+        with self._lock:
+            return {"pendientes": self._pendientes(), "capacidad": self.max_pendientes,
+                    "procesos": self.procesos, "rechazados": self.rechazados}
@@ -0,0 +1,206 @@
+import atexit
+import json
+import os
+import re
+import threading
+import time
+
+from archivos_privados import directorio_privado
+
+# Directorio del diario de autoguardado (vacío = desactivado; datos de pacientes: 0700, archivos 0600)
+DIARIO_DIR = os.environ.get("DIARIO_DIR", "diario")
+# Espera desde el primer cambio pendiente hasta escribirlo, para agrupar los que lleguen entretanto
+DIARIO_ESPERA_SEGUNDOS = float(os.environ.get("DIARIO_ESPERA_SEGUNDOS", "0.5"))
+# Líneas a partir de las cuales el diario de una sesión se compacta en una sola
+DIARIO_MAX_LINEAS = int(os.environ.get("DIARIO_MAX_LINEAS", "200"))
+DIARIO_TTL_SEGUNDOS = float(os.environ.get("DIARIO_TTL_SEGUNDOS", str(7 * 24 * 3600)))
+DIARIO_FSYNC = os.environ.get("DIARIO_FSYNC", "1") != "0"
+
+# Los tokens llegan en la URL: solo se aceptan los que no pueden salir del directorio
+_TOKEN_VALIDO = re.compile(r"[A-Za-z0-9_-]{8,64}")
+
+class DiarioAutoguardado:
+    """Diario de escritura anticipada (append-only) de los cambios de cada sesión.
+
+    Cada cambio es una línea JSON con solo los campos que cambiaron ("c"), los valores
+    del paso en curso aún sin confirmar ("b", el borrador), el paso ("p") o, con "r", el
+    formulario completo que reemplaza al anterior. registrar()
+    solo encola la línea; un hilo escribe lo pendiente de todas las sesiones
+    DIARIO_ESPERA_SEGUNDOS después del primer cambio, con una escritura y un fsync
+    por archivo. Cuando el diario de una sesión supera `max_lineas` se reescribe
+    como una sola línea "r" con el estado acumulado."""
+
+    def __init__(self, directorio=DIARIO_DIR, espera_segundos=DIARIO_ESPERA_SEGUNDOS, max_lineas=DIARIO_MAX_LINEAS,
+                 ttl_segundos=DIARIO_TTL_SEGUNDOS, fsync=DIARIO_FSYNC):
+        self.directorio = directorio
+        self.espera_segundos = espera_segundos
+        self.max_lineas = max_lineas
+        self.ttl_segundos = ttl_segundos
+        self.fsync = fsync
+        self._pendientes = {}  # token -> líneas por escribir
+        self._lineas = {}  # token -> líneas en el archivo, para decidir cuándo compactar
+        self._lock = threading.Lock()
+        self._lock_escritura = threading.Lock()
+        self._hay_pendientes = threading.Event()
+        self._hilo = None
+        self.escrituras = 0
+        self.compactaciones = 0
+        directorio_privado(directorio)
+        self._purgar_vencidos()
+        atexit.register(self.vaciar)
+
+    def _ruta(self, token):
+        if not _TOKEN_VALIDO.fullmatch(token or ""):
+            raise ValueError(f"Token de sesión inválido: {token!r}")
+        return os.path.join(self.directorio, f"{token}.jsonl")
+
+    def _purgar_vencidos(self):
+        limite = time.time() - self.ttl_segundos
+        for nombre in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, nombre)
+            try:
+                if nombre.endswith(".jsonl") and os.path.getmtime(ruta) < limite:
+                    os.remove(ruta)
+            except OSError:
+                pass
+
+    def registrar(self, token, cambios=None, paso=None, reemplazar=False, borrador=None):
+        """Encola los campos que cambiaron (o el formulario completo, con reemplazar=True), los
+        valores del borrador y el paso."""
+        self._ruta(token)
+        entrada = {"ts": round(time.time(), 3)}
+        if reemplazar:
+            entrada["r"] = True
+        if cambios or reemplazar:
+            entrada["c"] = cambios or {}
+        if borrador:
+            entrada["b"] = borrador
+        if paso is not None:
+            entrada["p"] = paso
+        with self._lock:
+            self._pendientes.setdefault(token, []).append(entrada)
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._ciclo, name="diario-autoguardado", daemon=True)
+                self._hilo.start()
+        self._hay_pendientes.set()
+
+    def _ciclo(self):
+        while True:
+            self._hay_pendientes.wait()
+            # Espera para agrupar en una sola escritura los cambios que sigan llegando
+            time.sleep(self.espera_segundos)
+            self._hay_pendientes.clear()
+            try:
+                self.vaciar()
+            except Exception:
+                # Los cambios no escritos se reintentan en la próxima vuelta
+                self._hay_pendientes.set()
+
+    def vaciar(self, token=None):
+        """Escribe ya lo pendiente (de todas las sesiones, o solo de `token`)."""
+        with self._lock_escritura:
+            with self._lock:
+                if token is None:
+                    pendientes, self._pendientes = self._pendientes, {}
+                else:
+                    pendientes = {token: self._pendientes.pop(token)} if token in self._pendientes else {}
+            error = None
+            for otro_token, entradas in pendientes.items():
+                try:
+                    self._anexar(otro_token, entradas)
+                except OSError as e:
+                    error = e
+                    with self._lock:
+                        self._pendientes[otro_token] = entradas + self._pendientes.get(otro_token, [])
+            if error is not None:
+                raise error
+
+    def _anexar(self, token, entradas):
+        # Debe llamarse con _lock_escritura tomado
+        ruta = self._ruta(token)
+        if token not in self._lineas:
+            self._lineas[token] = self._contar_lineas(ruta)
+        descriptor = os.open(ruta, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        with open(descriptor, "a", encoding="utf-8") as archivo:
+            archivo.write("".join(json.dumps(entrada, ensure_ascii=False, default=str) + "\n" for entrada in entradas))
+            archivo.flush()
+            if self.fsync:
+                os.fsync(archivo.fileno())
+        self.escrituras += 1
+        self._lineas[token] += len(entradas)
+        if self._lineas[token] > self.max_lineas:
+            self._compactar(token, ruta)
+
+    @staticmethod
+    def _contar_lineas(ruta):
+        try:
+            with open(ruta, "rb") as archivo:
+                return sum(bloque.count(b"\n") for bloque in iter(lambda: archivo.read(1 << 16), b""))
+        except FileNotFoundError:
+            return 0
+
+    def _compactar(self, token, ruta):
+        # Debe llamarse con _lock_escritura tomado: nadie más escribe el archivo mientras tanto
+        estado = self._leer(ruta)
+        entrada = {"ts": round(time.time(), 3), "c": estado["form_data"]}
+        if estado["completo"]:
+            entrada["r"] = True
+        if estado["borrador"]:
+            entrada["b"] = estado["borrador"]
+        if estado["step"] is not None:
+            entrada["p"] = estado["step"]
+        temporal = ruta + ".tmp"
+        descriptor = os.open(temporal, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(descriptor, "w", encoding="utf-8") as archivo:
+            archivo.write(json.dumps(entrada, ensure_ascii=False, default=str) + "\n")
+            archivo.flush()
+            if self.fsync:
+                os.fsync(archivo.fileno())
+        os.replace(temporal, ruta)
+        self._lineas[token] = 1
+        self.compactaciones += 1
+
+    @staticmethod
+    def _leer(ruta):
+        form_data, borrador, paso, completo = {}, {}, None, False
+        with open(ruta, encoding="utf-8") as archivo:
+            for linea in archivo:
+                try:
+                    entrada = json.loads(linea)
+                except ValueError:
+                    # Última línea a medio escribir si el proceso se cayó durante la escritura
+                    continue
+                if entrada.get("r"):
+                    form_data, borrador, completo = {}, {}, True
+                cambios = entrada.get("c", {})
+                form_data.update(cambios)
+                # Un campo confirmado deja atrás su borrador
+                for clave in cambios:
+                    borrador.pop(clave, None)
+                borrador.update(entrada.get("b", {}))
+                paso = entrada.get("p", paso)
+        return {"form_data": form_data, "borrador": borrador, "step": paso, "completo": completo}
+
+    def reproducir(self, token):
+        """Devuelve {"form_data", "borrador", "step", "completo"} acumulando el diario de la
+        sesión, o None si no tiene. Con completo=False, form_data son solo cambios sobre un
+        estado anterior al diario. El borrador son los valores sin confirmar del paso en curso."""
+        ruta = self._ruta(token)
+        self.vaciar(token)
+        with self._lock_escritura:
+            if not os.path.exists(ruta):
+                return None
+            return self._leer(ruta)
+
+    def eliminar(self, token):
+        ruta = self._ruta(token)
+        with self._lock_escritura:
+            with self._lock:
+                self._pendientes.pop(token, None)
+            self._lineas.pop(token, None)
+            if os.path.exists(ruta):
+                os.remove(ruta)
+
+# Función para crear el diario configurado (None si DIARIO_DIR está vacío)
+def crear_diario(directorio=DIARIO_DIR):
+    return DiarioAutoguardado(directorio) if directorio else None
@@ -0,0 +1,248 @@
+import datetime
+
+# Opciones reutilizadas por varios campos
+_NO_SI = ("No", "Sí")
+_NO_SI_OCASIONAL = ("No", "Sí", "Ocasionalmente")
+_DESEMPENO = ("Excelente", "Bueno", "Regular", "Deficiente")
+
+# Pasos del asistente: número, título de la sección y texto del botón de navegación
+PASOS = (
+    (1, "I. DATOS DEL PACIENTE", "Datos del Paciente"),
+    (2, "II. ANTECEDENTES FAMILIARES", "Antecedentes Familiares"),
+    (3, "III. ANTECEDENTES MÓRBIDOS", "Antecedentes Mórbidos"),
+    (4, "IV. ESTADO DE SALUD MENTAL", "Salud Mental"),
+    (5, "V. HISTORIA ESCOLAR", "Historia Escolar"),
+    (6, "VI. ABUSO O DEPENDENCIAS DE SUSTANCIAS", "Abuso de Sustancias"),
+    (7, "VII. TRASTORNOS DE LA CONDUCTA ALIMENTARIOS", "Trastornos Alimentarios"),
+    (8, "VIII. CONSCIENCIA DEL PROBLEMA Y NIVEL DE MOTIVACIÓN PARA EL CAMBIO", "Motivación para el Cambio"),
+    (9, "REVISIÓN Y GENERACIÓN DE INFORME", "Revisión y Generación"),
+)
+
+# Definición de todos los campos del formulario.
+#   tipo: texto, area, opciones (selectbox), radio, entero, decimal, fecha o calculado
+#   etiqueta: texto del widget; resumen: etiqueta en la revisión del paso 9;
+#   pdf / formato_pdf: etiqueta y formato en el informe ("rut" o una plantilla como "{} kg")
+#   mostrar_si: (campo, valores) para campos que solo aparecen según otra respuesta
+#   mejorable: nombre de la sección en "Mejorar la Redacción"; defecto_informe: texto si queda vacío
+_DEFINICIONES = (
+    # Paso 1
+    {"clave": "nombre_completo", "paso": 1, "tipo": "texto", "etiqueta": "Nombre Completo", "defecto": "",
+     "resumen": "Nombre Completo", "pdf": "Nombre:"},
+    {"clave": "run", "paso": 1, "tipo": "texto", "etiqueta": "R.U.N.", "defecto": "",
+     "resumen": "R.U.N.", "pdf": "RUN:", "formato_pdf": "rut"},
+    {"clave": "fecha_nacimiento", "paso": 1, "tipo": "fecha", "etiqueta": "Fecha de Nacimiento",
+     "defecto": datetime.date(1982, 5, 25), "formato": "%d %B %Y",
+     "resumen": "Fecha de Nacimiento", "pdf": "F. Nac.:"},
+    {"clave": "edad", "paso": 1, "tipo": "calculado", "etiqueta": "Edad (años)", "defecto": "",
+     "resumen": "Edad", "pdf": "Edad:", "formato_pdf": "{} Años"},
+    {"clave": "domicilio", "paso": 1, "tipo": "texto", "etiqueta": "Domicilio", "defecto": "",
+     "resumen": "Domicilio", "pdf": "Domicilio:"},
+    {"clave": "email", "paso": 1, "tipo": "texto", "etiqueta": "Email", "defecto": "",
+     "resumen": "Email", "pdf": "Email:"},
+    {"clave": "telefono", "paso": 1, "tipo": "texto", "etiqueta": "Teléfono", "defecto": "",
+     "resumen": "Teléfono", "pdf": "Teléfono:"},
+    {"clave": "fecha_evaluacion", "paso": 1, "tipo": "fecha", "etiqueta": "Fecha de Evaluación",
+     "defecto": None, "formato": "%d-%m-%Y"},  # Sin valor guardado se usa la fecha de hoy
+    {"clave": "prevision", "paso": 1, "tipo": "opciones", "etiqueta": "Previsión",
+     "opciones": ("Fonasa", "Isapre", "Particular", "Otra"), "defecto": "Fonasa", "pdf": "Previsión:"},
+    {"clave": "escolaridad", "paso": 1, "tipo": "opciones", "etiqueta": "Escolaridad",
+     "opciones": ("Básica Incompleta", "Básica Completa", "Media Incompleta", "Media Completa",
+                  "Técnica Incompleta", "Técnica Completa", "Universitaria Incompleta", "Universitaria Completa"),
+     "defecto": "Media Completa", "resumen": "Escolaridad", "pdf": "Escolaridad:"},
+    {"clave": "ocupacion", "paso": 1, "tipo": "texto", "etiqueta": "Profesión/Ocupación", "defecto": "",
+     "resumen": "Profesión/Ocupación", "pdf": "Profesión:"},
+    {"clave": "sexo", "paso": 1, "tipo": "opciones", "etiqueta": "Sexo",
+     "opciones": ("Femenino", "Masculino", "No Binario", "Prefiero no decir"), "defecto": "Femenino", "pdf": "Sexo:"},
+    {"clave": "psicologa", "paso": 1, "tipo": "texto", "etiqueta": "Psicólogo/a", "defecto": "", "pdf": "Psicóloga:"},
+    {"clave": "rut_psicologa", "paso": 1, "tipo": "texto", "etiqueta": "RUT Psicólogo/a", "defecto": ""},
+    {"clave": "datos_procedimiento", "paso": 1, "tipo": "texto", "etiqueta": "Procedimiento y Doctor", "defecto": "",
+     "pdf": "Procedimiento:"},
+    {"clave": "fecha_procedimiento", "paso": 1, "tipo": "texto", "etiqueta": "Fecha/Estado", "defecto": "En evaluación",
+     "pdf": "Fecha:"},
+
+    # Paso 2
+    {"clave": "familia_nuclear", "paso": 2, "tipo": "area", "etiqueta": "Familia Nuclear (composición)", "alto": 100,
+     "defecto": "", "resumen": "Familia Nuclear", "pdf": "Familia Nuclear:"},
+    {"clave": "situacion_conyugal_padres", "paso": 2, "tipo": "opciones", "etiqueta": "Situación Conyugal de los Padres",
+     "opciones": ("Casados", "Separados", "Divorciados", "Viudo/a", "Convivencia", "No Aplica"), "defecto": "Casados",
+     "resumen": "Situación Conyugal Padres", "pdf": "Estado Civil Padres:"},
+    {"clave": "estado_civil", "paso": 2, "tipo": "opciones", "etiqueta": "Estado Civil del Paciente",
+     "opciones": ("Soltero/a", "Casado/a", "Divorciado/a", "Viudo/a", "Convivencia"), "defecto": "Soltero/a",
+     "resumen": "Estado Civil", "pdf": "Estado Civil:"},
+    {"clave": "hijos", "paso": 2, "tipo": "entero", "etiqueta": "Número de Hijos", "minimo": 0, "defecto": 0,
+     "resumen": "Hijos", "pdf": "Hijos:"},
+    {"clave": "redes_apoyo", "paso": 2, "tipo": "texto", "etiqueta": "Redes de Apoyo", "defecto": "",
+     "resumen": "Redes de Apoyo", "pdf": "Redes de Apoyo:"},
+    {"clave": "enfermedades_familia", "paso": 2, "tipo": "area", "alto": 100,
+     "etiqueta": "¿Existe alguna enfermedad de importancia en la familia? ¿Trastornos mentales y/o adicciones?",
+     "defecto": "Sin antecedentes relevantes.", "resumen": "Enfermedades Familia",
+     "pdf": "Enfermedades de importancia/Trastornos mentales/Adicciones familiares:"},
+
+    # Paso 3
+    {"clave": "antecedentes_natales", "paso": 3, "tipo": "area", "etiqueta": "Antecedentes pre, peri y post natales",
+     "alto": 150, "defecto": "", "resumen": "Antecedentes pre, peri y post natales",
+     "pdf": "Antecedentes pre, peri y post natales:",
+     "mejorable": "Antecedentes Natales", "defecto_informe": "Sin antecedentes relevantes."},
+    {"clave": "enfermedades_infancia", "paso": 3, "tipo": "area", "etiqueta": "Enfermedades importantes en la infancia y adolescencia",
+     "alto": 100, "defecto": "Sin antecedentes relevantes.", "resumen": "Enfermedades en infancia y adolescencia",
+     "pdf": "Enfermedades importantes en infancia y adolescencia:"},
+    {"clave": "enfermedades_actuales", "paso": 3, "tipo": "area", "etiqueta": "Enfermedades actuales",
+     "alto": 100, "defecto": "Sin antecedentes relevantes.", "resumen": "Enfermedades actuales",
+     "pdf": "Enfermedades actuales:"},
+    {"clave": "operaciones", "paso": 3, "tipo": "area", "etiqueta": "Operaciones", "alto": 100, "defecto": "",
+     "resumen": "Operaciones", "pdf": "Operaciones:"},
+
+    # Paso 4
+    {"clave": "antecedentes_salud_mental", "paso": 4, "tipo": "area", "etiqueta": "Antecedentes de Salud Mental",
+     "alto": 150, "defecto": "-", "resumen": "Antecedentes Salud Mental", "pdf": "Antecedentes de Salud Mental:"},
+    {"clave": "estado_salud_mental", "paso": 4, "tipo": "opciones", "etiqueta": "Estado de salud mental",
+     "opciones": ("Estable", "Inestable", "En tratamiento", "Otro"), "defecto": "Estable",
+     "resumen": "Estado Salud Mental", "pdf": "Estado de salud mental:"},
+
+    # Paso 5
+    {"clave": "repitencias", "paso": 5, "tipo": "radio", "etiqueta": "Repitencias", "opciones": _NO_SI, "defecto": "No",
+     "resumen": "Repitencias", "pdf": "Repitencias:"},
+    {"clave": "rendimiento_academico", "paso": 5, "tipo": "opciones", "etiqueta": "Rendimiento Académico",
+     "opciones": _DESEMPENO, "defecto": "Excelente", "resumen": "Rendimiento Académico", "pdf": "Rendimiento Académico:"},
+    {"clave": "comportamiento_escolar", "paso": 5, "tipo": "opciones", "etiqueta": "Comportamiento Escolar",
+     "opciones": _DESEMPENO, "defecto": "Bueno", "resumen": "Comportamiento Escolar", "pdf": "Comportamiento Escolar:"},
+    {"clave": "repitencias_detalles", "paso": 5, "tipo": "area", "etiqueta": "Detalle las repitencias (cursos, motivos)",
+     "alto": 100, "defecto": "", "mostrar_si": ("repitencias", ("Sí",))},
+
+    # Paso 6
+    {"clave": "consumo_alcohol", "paso": 6, "tipo": "radio", "etiqueta": "Alcohol", "opciones": _NO_SI_OCASIONAL,
+     "defecto": "Ocasionalmente", "resumen": "Alcohol", "pdf": "Alcohol"},
+    {"clave": "detalles_alcohol", "paso": 6, "tipo": "texto", "etiqueta": "Detalles del consumo de alcohol",
+     "defecto": "Piña colada o Pisco sour", "mostrar_si": ("consumo_alcohol", ("Sí", "Ocasionalmente"))},
+    {"clave": "consumo_tabaco", "paso": 6, "tipo": "radio", "etiqueta": "Tabaco", "opciones": _NO_SI_OCASIONAL,
+     "defecto": "No", "resumen": "Tabaco", "pdf": "Tabaco"},
+    {"clave": "detalles_tabaco", "paso": 6, "tipo": "texto", "etiqueta": "Detalles del consumo de tabaco",
+     "defecto": "", "mostrar_si": ("consumo_tabaco", ("Sí", "Ocasionalmente"))},
+    {"clave": "consumo_marihuana", "paso": 6, "tipo": "radio", "etiqueta": "Marihuana", "opciones": _NO_SI_OCASIONAL,
+     "defecto": "No", "resumen": "Marihuana", "pdf": "Marihuana"},
+    {"clave": "detalles_marihuana", "paso": 6, "tipo": "texto", "etiqueta": "Detalles del consumo de marihuana",
+     "defecto": "", "mostrar_si": ("consumo_marihuana", ("Sí", "Ocasionalmente"))},
+    {"clave": "consumo_otras_drogas", "paso": 6, "tipo": "radio", "etiqueta": "Otras drogas", "opciones": _NO_SI,
+     "defecto": "No", "resumen": "Otras drogas", "pdf": "Otras drogas"},
+    {"clave": "detalles_otras_drogas", "paso": 6, "tipo": "texto", "etiqueta": "Especifique otras drogas",
+     "defecto": "", "mostrar_si": ("consumo_otras_drogas", ("Sí",))},
+
+    # Paso 7
+    {"clave": "peso_maximo", "paso": 7, "tipo": "decimal", "etiqueta": "Peso máximo (kg)", "minimo": 0.0, "defecto": 94,
+     "resumen": "Peso máximo", "pdf": "Peso máximo:", "formato_pdf": "{} kg"},
+    {"clave": "peso_minimo", "paso": 7, "tipo": "decimal", "etiqueta": "Peso mínimo adulto (kg)", "minimo": 0.0, "defecto": 68,
+     "resumen": "Peso mínimo", "pdf": "Peso mínimo:", "formato_pdf": "{} kg"},
+    {"clave": "peso_ideal", "paso": 7, "tipo": "decimal", "etiqueta": "Peso ideal (kg)", "minimo": 0.0, "defecto": 65,
+     "resumen": "Peso ideal", "pdf": "Peso ideal:", "formato_pdf": "{} kg"},
+    {"clave": "altura", "paso": 7, "tipo": "decimal", "etiqueta": "Altura (m)", "minimo": 0.0, "incremento": 0.01,
+     "defecto": 1.60, "resumen": "Altura", "pdf": "Altura:", "formato_pdf": "{} m"},
+    {"clave": "arfid", "paso": 7, "tipo": "radio", "etiqueta": "ARFID", "opciones": _NO_SI, "defecto": "No",
+     "widget_con_clave": True, "resumen": "ARFID", "pdf": "ARFID"},
+    {"clave": "comedor_emocional", "paso": 7, "tipo": "radio", "etiqueta": "Comedor Emocional", "opciones": _NO_SI,
+     "defecto": "No", "widget_con_clave": True, "resumen": "Comedor Emocional", "pdf": "Comedor Emocional"},
+    {"clave": "anorexia", "paso": 7, "tipo": "radio", "etiqueta": "Anorexia Nerviosa", "opciones": _NO_SI, "defecto": "No",
+     "widget_con_clave": True, "resumen": "Anorexia", "pdf": "Anorexia Nerviosa"},
+    {"clave": "comedor_nocturno", "paso": 7, "tipo": "radio", "etiqueta": "Comedor Nocturno", "opciones": _NO_SI,
+     "defecto": "No", "widget_con_clave": True, "resumen": "Comedor Nocturno", "pdf": "Comedor Nocturno"},
+    {"clave": "bulimia", "paso": 7, "tipo": "radio", "etiqueta": "Bulimia Nerviosa", "opciones": _NO_SI, "defecto": "No",
+     "widget_con_clave": True, "resumen": "Bulimia", "pdf": "Bulimia Nerviosa"},
+    {"clave": "picoteador", "paso": 7, "tipo": "radio", "etiqueta": "Picoteador", "opciones": _NO_SI, "defecto": "No",
+     "widget_con_clave": True, "resumen": "Picoteador", "pdf": "Picoteador"},
+    {"clave": "t_atracon", "paso": 7, "tipo": "radio", "etiqueta": "Trastorno por Atracón", "opciones": _NO_SI,
+     "defecto": "No", "widget_con_clave": True, "resumen": "Trastorno Atracón", "pdf": "Trastorno por Atracón"},
+    {"clave": "food_craving", "paso": 7, "tipo": "radio", "etiqueta": "Food Craving", "opciones": _NO_SI, "defecto": "No",
+     "widget_con_clave": True, "resumen": "Food Craving", "pdf": "Food Craving"},
+
+    # Paso 8
+    {"clave": "factores_origen", "paso": 8, "tipo": "area",
+     "etiqueta": "Análisis de factores que dieron origen y perpetúan el problema", "alto": 200, "defecto": "",
+     "resumen": "Factores de origen", "pdf": "Análisis de factores que dieron origen y perpetúan el problema:",
+     "mejorable": "Factores de Origen",
+     "defecto_informe": "Se identifican factores relacionados con hábitos alimenticios inadecuados."},
+    {"clave": "razones_cambiar", "paso": 8, "tipo": "area", "etiqueta": "Razones para cambiar", "alto": 150, "defecto": "",
+     "resumen": "Razones para cambiar", "pdf": "Razones para cambiar:",
+     "mejorable": "Razones para Cambiar", "defecto_informe": "Mejorar calidad de vida y estado de salud general."},
+    {"clave": "paciente_apto", "paso": 8, "tipo": "radio", "etiqueta": "Paciente apto para procedimiento",
+     "opciones": ("SI", "NO", "SI, CON SEGUIMIENTO"), "defecto": "SI, CON SEGUIMIENTO",
+     "resumen": "Paciente apto", "pdf": "Paciente apto para procedimiento:"},
+    {"clave": "observaciones", "paso": 8, "tipo": "area", "etiqueta": "Observaciones", "alto": 150, "defecto": "",
+     "resumen": "Observaciones", "mejorable": "Observaciones",
+     "defecto_informe": "Sin observaciones relevantes que destacar."},
+)
+
+# Grupos de la revisión del paso 9: título, encabezados de la tabla y campos en orden
+_GRUPOS_RESUMEN = (
+    ("I. DATOS DEL PACIENTE", ("Campo", "Valor"),
+     ("nombre_completo", "run", "fecha_nacimiento", "edad", "domicilio", "email", "telefono", "escolaridad", "ocupacion")),
+    ("II. ANTECEDENTES FAMILIARES", ("Campo", "Valor"),
+     ("familia_nuclear", "situacion_conyugal_padres", "estado_civil", "hijos", "redes_apoyo", "enfermedades_familia")),
+    ("III. ANTECEDENTES MÓRBIDOS", ("Campo", "Valor"),
+     ("antecedentes_natales", "enfermedades_infancia", "enfermedades_actuales", "operaciones")),
+    ("IV-V. SALUD MENTAL E HISTORIA ESCOLAR", ("Campo", "Valor"),
+     ("antecedentes_salud_mental", "estado_salud_mental", "repitencias", "rendimiento_academico", "comportamiento_escolar")),
+    ("VI. ABUSO O DEPENDENCIAS DE SUSTANCIAS", ("Sustancia", "Consumo"),
+     ("consumo_alcohol", "consumo_tabaco", "consumo_marihuana", "consumo_otras_drogas")),
+    ("VII. TRASTORNOS DE LA CONDUCTA ALIMENTARIOS", ("Campo", "Valor"),
+     ("peso_maximo", "peso_minimo", "peso_ideal", "altura", "arfid", "comedor_emocional", "anorexia",
+      "comedor_nocturno", "bulimia", "picoteador", "t_atracon", "food_craving")),
+    ("VIII-IX. CONSCIENCIA DEL PROBLEMA Y OBSERVACIONES", ("Campo", "Valor"),
+     ("factores_origen", "razones_cambiar", "paciente_apto", "observaciones")),
+)
+
+_TIPOS = {"texto", "area", "opciones", "radio", "entero", "decimal", "fecha", "calculado"}
+
+def _compilar_campo(definicion):
+    clave = definicion["clave"]
+    if definicion["tipo"] not in _TIPOS:
+        raise ValueError(f"Tipo desconocido para el campo {clave!r}: {definicion['tipo']!r}")
+    campo = dict(definicion)
+    if campo["tipo"] in ("opciones", "radio"):
+        opciones = tuple(campo["opciones"])
+        # Mapa opción -> índice, para no buscar linealmente en cada recarga
+        campo["indices"] = {opcion: i for i, opcion in enumerate(opciones)}
+        if campo["defecto"] not in campo["indices"]:
+            raise ValueError(f"El valor por defecto de {clave!r} no está entre sus opciones")
+        campo["indice_defecto"] = campo["indices"][campo["defecto"]]
+    return campo
+
+# Función para validar y compilar el esquema del formulario
+def compilar_esquema(definiciones, grupos_resumen):
+    campos = {}
+    for definicion in definiciones:
+        if definicion["clave"] in campos:
+            raise ValueError(f"Campo repetido en el esquema: {definicion['clave']!r}")
+        campos[definicion["clave"]] = _compilar_campo(definicion)
+
+    for campo in campos.values():
+        if "mostrar_si" in campo:
+            controlador, valores = campo["mostrar_si"]
+            if controlador not in campos or any(valor not in campos[controlador]["indices"] for valor in valores):
+                raise ValueError(f"Condición 'mostrar_si' no válida en {campo['clave']!r}")
+
+    resumen = []
+    for titulo, encabezados, claves in grupos_resumen:
+        faltantes = [clave for clave in claves if "resumen" not in campos.get(clave, {})]
+        if faltantes:
+            raise ValueError(f"Campos sin etiqueta de resumen en {titulo!r}: {faltantes}")
+        resumen.append({
+            "titulo": titulo,
+            "encabezados": tuple(encabezados),
+            "filas": tuple((campos[clave]["resumen"], clave) for clave in claves)
+        })
+
+    pasos = {numero: tuple(clave for clave, campo in campos.items() if campo["paso"] == numero) for numero, _, _ in PASOS}
+    return campos, pasos, tuple(resumen)
+
+# Esquema compilado una sola vez al importar el módulo
+CAMPOS, CAMPOS_POR_PASO, RESUMEN = compilar_esquema(_DEFINICIONES, _GRUPOS_RESUMEN)
+
+# Secciones cuya redacción se puede mejorar con IA y su campo en form_data
+SECCIONES_MEJORABLES = {campo["mejorable"]: clave for clave, campo in CAMPOS.items() if "mejorable" in campo}
+
+# Textos que usa el informe cuando un campo de texto libre queda vacío
+TEXTOS_POR_DEFECTO = {clave: campo["defecto_informe"] for clave, campo in CAMPOS.items() if "defecto_informe" in campo}
+
+# Función para obtener el índice de una opción guardada (o el de la opción por defecto)
+def indice_opcion(clave, valor):
+    campo = CAMPOS[clave]
+    return campo["indices"].get(valor, campo["indice_defecto"])
@@ -0,0 +1,140 @@
+"""Generación de informes PDF en lote, sin pasar por la interfaz de Streamlit.
+
+Lee evaluaciones desde un archivo JSONL o CSV (un registro por línea, con las mismas
+claves que st.session_state.form_data) y genera un PDF por registro usando un pool
+de procesos.
+
+Uso:
+    python generar_lote.py evaluaciones.jsonl --salida informes/
+    python generar_lote.py evaluaciones.csv --salida informes/ --procesos 4 --reanudar
+"""
+import argparse
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+
+from informe_pdf import generar_pdf
+
+# Archivo, dentro del directorio de salida, donde se registran los registros fallidos
+ARCHIVO_ERRORES = "errores.jsonl"
+
+# Función para leer los registros de entrada de forma incremental
+def leer_registros(ruta):
+    """Genera (numero_de_registro, registro, error) sin cargar el archivo completo en memoria."""
+    if ruta.lower().endswith(".csv"):
+        with open(ruta, newline="", encoding="utf-8-sig") as archivo:
+            for numero, fila in enumerate(csv.DictReader(archivo), start=1):
+                yield numero, fila, None
+    else:
+        with open(ruta, encoding="utf-8") as archivo:
+            numero = 0
+            for linea in archivo:
+                if not linea.strip():
+                    continue
+                numero += 1
+                try:
+                    registro = json.loads(linea)
+                    if not isinstance(registro, dict):
+                        raise ValueError("el registro no es un objeto JSON")
+                    yield numero, registro, None
+                except ValueError as e:
+                    yield numero, None, f"Registro inválido: {e}"
+
+# Función para construir un nombre de archivo estable para cada registro
+def nombre_archivo(registro):
+    """Usa RUN y fecha de evaluación cuando existen, más una huella del contenido: el
+    nombre no depende del orden de la entrada (reanudar funciona aunque se reordene), dos
+    evaluaciones distintas del mismo RUN y fecha (o sin fecha) no se sobrescriben, y
+    reanudar solo omite un registro idéntico ya generado."""
+    run = re.sub(r"[^0-9kK]", "", str(registro.get("run") or "")).upper()
+    fecha = re.sub(r"[^0-9]", "", str(registro.get("fecha_evaluacion") or ""))
+    contenido = json.dumps(registro, sort_keys=True, ensure_ascii=False, default=str)
+    huella = hashlib.sha256(contenido.encode("utf-8")).hexdigest()[:10]
+    if run:
+        return f"Informe_{run}_{fecha or 'sin_fecha'}_{huella}.pdf"
+    return f"Informe_sin_run_{huella}.pdf"
+
+def _renderizar(tarea):
+    # Se ejecuta en un proceso del pool: genera el PDF y lo escribe de forma atómica
+    numero, registro, ruta = tarea
+    try:
+        pdf_bytes = generar_pdf(registro)
+        # Temporal propio de cada proceso: dos registros idénticos comparten `ruta`
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        with open(temporal, "wb") as archivo:
+            archivo.write(pdf_bytes)
+        os.replace(temporal, ruta)
+        return numero, ruta, len(pdf_bytes), None
+    except Exception as e:
+        return numero, ruta, 0, f"{type(e).__name__}: {e}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera informes PDF en lote desde un archivo JSONL o CSV.")
+    parser.add_argument("entrada", help="Archivo .jsonl o .csv con una evaluación por registro")
+    parser.add_argument("--salida", default="informes", help="Directorio donde se escriben los PDF (por defecto: informes)")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count() or 1, help="Procesos en paralelo (por defecto: núcleos disponibles)")
+    parser.add_argument("--reanudar", action="store_true", help="Omitir registros cuyo PDF ya existe en el directorio de salida")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.salida, exist_ok=True)
+    ruta_errores = os.path.join(args.salida, ARCHIVO_ERRORES)
+    generados = omitidos = fallidos = total_bytes = 0
+    inicio = time.perf_counter()
+    # tareas() la consume el hilo del pool que reparte el trabajo, en paralelo con el ciclo
+    # principal: los contadores y el archivo de errores se modifican con este lock tomado
+    lock = threading.Lock()
+
+    with open(ruta_errores, "a", encoding="utf-8") as errores:
+        def registrar_error(numero, ruta, error):
+            nonlocal fallidos
+            with lock:
+                fallidos += 1
+                errores.write(json.dumps({"registro": numero, "archivo": ruta, "error": error}, ensure_ascii=False) + "\n")
+                errores.flush()
+                print(f"[registro {numero}] ERROR: {error}", file=sys.stderr)
+
+        def tareas():
+            nonlocal omitidos
+            # Un registro idéntico a otro anterior de la entrada produce el mismo PDF
+            rutas = set()
+            for numero, registro, error in leer_registros(args.entrada):
+                if error:
+                    registrar_error(numero, None, error)
+                    continue
+                ruta = os.path.join(args.salida, nombre_archivo(registro))
+                if ruta in rutas or (args.reanudar and os.path.exists(ruta)):
+                    with lock:
+                        omitidos += 1
+                    continue
+                rutas.add(ruta)
+                yield numero, registro, ruta
+
+        with multiprocessing.Pool(processes=max(args.procesos, 1)) as pool:
+            for numero, ruta, tamano, error in pool.imap_unordered(_renderizar, tareas(), chunksize=4):
+                if error:
+                    registrar_error(numero, ruta, error)
+                    continue
+                generados += 1
+                total_bytes += tamano
+                if generados % 50 == 0:
+                    transcurrido = time.perf_counter() - inicio
+                    print(f"{generados} informes generados ({generados / transcurrido:.1f} informes/s)")
+
+    transcurrido = time.perf_counter() - inicio
+    print(
+        f"Listo: {generados} generados, {omitidos} omitidos, {fallidos} con error "
+        f"en {transcurrido:.2f} s ({generados / transcurrido if transcurrido else 0:.1f} informes/s, "
+        f"{total_bytes / 1024:.0f} KB escritos)"
+    )
+    if fallidos:
+        print(f"Detalle de errores en {ruta_errores}", file=sys.stderr)
+    return 1 if fallidos else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
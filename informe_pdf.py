@@ -0,0 +1,645 @@
+import datetime
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from fpdf import FPDF
+from fpdf.fpdf import FPDF_VERSION
+
+from esquema_formulario import CAMPOS, TEXTOS_POR_DEFECTO
+from opciones_informe import INFORME_COMPACTO, INFORME_DETERMINISTA
+
+# Fragmentos de sección renderizados que se conservan para reutilizar
+CACHE_SECCIONES_MAX = int(os.environ.get("INFORME_CACHE_SECCIONES_MAX", "256"))
+
+# Fecha de creación cuando la evaluación no tiene una fecha válida
+FECHA_CREACION_FIJA = "20000101000000"
+
+# Clase PDF con los métodos de maquetación del informe
+class PDF(FPDF):
+    # Fecha de creación (AAAAMMDDhhmmss) para los metadatos; None = la hora actual
+    fecha_creacion = None
+    # Quitar los operadores redundantes de las páginas al cerrar el documento
+    compacto = False
+
+    def _enddoc(self):
+        # Aquí todas las páginas, con sus pies, están completas y aún no se escribieron
+        if self.compacto:
+            compactar_paginas(self)
+        super()._enddoc()
+
+    def _putinfo(self):
+        if self.fecha_creacion is None:
+            return super()._putinfo()
+        # Igual que FPDF._putinfo, salvo la fecha: es el único dato variable del documento
+        self._out('/Producer '+self._textstring('PyFPDF '+FPDF_VERSION+' http://pyfpdf.googlecode.com/'))
+        for atributo, nombre in (('title', 'Title'), ('subject', 'Subject'), ('author', 'Author'),
+                                 ('keywords', 'Keywords'), ('creator', 'Creator')):
+            if hasattr(self, atributo):
+                self._out(f'/{nombre} '+self._textstring(getattr(self, atributo)))
+        self._out('/CreationDate '+self._textstring('D:'+self.fecha_creacion))
+
+    def header(self):
+        # Verificar si estamos en la primera página
+        if self.page_no() == 1:
+            self.set_font('Arial', 'B', 15)
+            self.cell(0, 10, 'INFORME PSICOLÓGICO PARA PROCEDIMIENTO BARIÁTRICO', 0, 1, 'C')
+            self.ln(2)  # Reducido espacio para aprovechar mejor el área
+
+    def footer(self):
+        self.set_y(-15)
+        self.set_font('Arial', 'I', 8)
+        self.cell(0, 10, f'Página {self.page_no()}', 0, 0, 'C')
+
+    def add_section_title(self, title):
+        self.set_font('Arial', 'B', 12)
+        self.ln(5)
+        self.cell(0, 10, title, 0, 1)
+        self.ln(2)
+
+    def check_page_break(self, height=30):
+        """Verifica si hay suficiente espacio en la página actual, si no, añade una nueva página."""
+        if self.get_y() > self.h - height:
+            self.add_page()
+
+    # Método para campos emparejados con espaciado explícito
+    def add_field_pair(self, label1, value1, label2, value2, col1_x=10, val1_x=55, col2_x=110, val2_x=145):
+        """Crea un par de campos con posicionamiento flexible."""
+        y_pos = self.get_y()
+
+        # Primera etiqueta
+        self.set_font('Arial', 'B', 10)
+        self.set_xy(col1_x, y_pos)
+        self.cell(val1_x - col1_x, 6, label1, 0, 0)
+
+        # Primer valor
+        self.set_font('Arial', '', 10)
+        self.set_xy(val1_x, y_pos)
+        self.cell(col2_x - val1_x, 6, " " + str(value1), 0, 0)
+
+        # Segunda etiqueta
+        self.set_font('Arial', 'B', 10)
+        self.set_xy(col2_x, y_pos)
+        self.cell(val2_x - col2_x, 6, label2, 0, 0)
+
+        # Segundo valor
+        self.set_font('Arial', '', 10)
+        self.set_xy(val2_x, y_pos)
+        self.cell(0, 6, " " + str(value2), 0, 1)
+
+        return self.get_y()
+
+    # Campo individual con etiqueta y valor en la misma línea
+    def add_field(self, label, value, label_width=45, value_style='', value_size=10):
+        self.set_font('Arial', 'B', 10)
+        self.cell(label_width, 6, label, 0, 0)
+        self.set_font('Arial', value_style, value_size)
+        self.cell(0, 6, value, 0, 1)
+
+    # Para textos largos con etiqueta
+    def add_long_field(self, label, value):
+        # Etiqueta en línea separada
+        self.set_font('Arial', 'B', 10)
+        self.cell(0, 6, label, 0, 1)
+
+        # Valor
+        self.set_font('Arial', '', 10)
+        self.multi_cell(0, 6, value, 0, 'L')
+        self.ln(2)
+
+    # Crear tabla mejorada
+    def add_table(self, headers, data, widths=None):
+        if widths is None:
+            page_width = self.w - 20
+            widths = [page_width / len(headers)] * len(headers)
+
+        # Encabezados
+        self.set_font('Arial', 'B', 10)
+        self.set_fill_color(240, 240, 240)
+
+        for i, header in enumerate(headers):
+            self.cell(widths[i], 8, header, 1, 0, 'C', 1)
+        self.ln()
+
+        # Datos
+        self.set_font('Arial', '', 10)
+        for row in data:
+            for i, cell in enumerate(row):
+                self.cell(widths[i], 8, str(cell), 1, 0, 'C')
+            self.ln()
+
+        self.ln(4)
+
+    # Firma y datos de la psicóloga
+    def add_signature(self, name, rut):
+        self.ln(20)
+
+        # Línea para firma
+        x_center = self.w / 2
+        self.line(x_center - 35, self.get_y(), x_center + 35, self.get_y())
+        self.ln(5)
+
+        self.set_font('Arial', 'B', 10)
+        self.cell(0, 6, name, 0, 1, 'C')
+
+        self.set_font('Arial', '', 10)
+        if rut:
+            self.cell(0, 6, f"Rut: {self.formatear_rut(rut)}", 0, 1, 'C')
+        else:
+            self.cell(0, 6, "Rut:", 0, 1, 'C')
+
+        self.cell(0, 6, "Psicóloga", 0, 1, 'C')
+
+    def formatear_rut(self, rut):
+        if not rut or not isinstance(rut, str) or len(rut.strip()) < 2:
+            return ""
+
+        rut = rut.replace(".", "").replace("-", "").strip()
+        if len(rut) < 2:
+            return rut
+
+        dv = rut[-1]
+        num = rut[:-1]
+
+        formato = ""
+        while len(num) > 3:
+            formato = "." + num[-3:] + formato
+            num = num[:-3]
+        formato = num + formato
+
+        return formato + "-" + dv
+
+# Diseño declarativo del informe: secciones en orden y sus elementos.
+# Los elementos nombran campos del esquema del formulario; la etiqueta y el formato
+# de cada valor en el PDF se toman de esquema_formulario.CAMPOS.
+# "antes" indica qué hacer antes del título: "espacio" (salto si falta espacio),
+# "pagina" (página nueva) o un número de milímetros de separación.
+DISENO_INFORME = (
+    {
+        "id": "datos_paciente",
+        "titulo": "I. DATOS DEL PACIENTE",
+        "elementos": (
+            {"tipo": "par", "campos": ("nombre_completo", "run")},
+            {"tipo": "par", "campos": ("fecha_nacimiento", "edad")},
+            {"tipo": "par", "campos": ("email", "telefono")},
+            {"tipo": "campo", "campo": "domicilio"},
+            {"tipo": "par", "campos": ("prevision", "escolaridad")},
+            {"tipo": "par", "campos": ("ocupacion", "sexo")},
+            {"tipo": "campo", "campo": "psicologa"},
+            {"tipo": "par", "campos": ("datos_procedimiento", "fecha_procedimiento")},
+        ),
+    },
+    {
+        "id": "antecedentes_familiares",
+        "titulo": "II. ANTECEDENTES FAMILIARES",
+        "elementos": (
+            {"tipo": "campo", "campo": "familia_nuclear"},
+            {"tipo": "par", "campos": ("situacion_conyugal_padres", "estado_civil")},
+            {"tipo": "par", "campos": ("hijos", "redes_apoyo")},
+            {"tipo": "largo", "campo": "enfermedades_familia"},
+        ),
+    },
+    {
+        "id": "antecedentes_morbidos",
+        "titulo": "III. ANTECEDENTES MÓRBIDOS",
+        "antes": "espacio",
+        "elementos": (
+            {"tipo": "largo", "campo": "antecedentes_natales"},
+            {"tipo": "largo", "campo": "enfermedades_infancia"},
+            {"tipo": "largo", "campo": "enfermedades_actuales"},
+            {"tipo": "largo", "campo": "operaciones"},
+        ),
+    },
+    {
+        "id": "salud_mental",
+        "titulo": "IV. ESTADO DE SALUD MENTAL",
+        "antes": "espacio",
+        "elementos": (
+            {"tipo": "largo", "campo": "antecedentes_salud_mental"},
+            {"tipo": "campo", "campo": "estado_salud_mental"},
+        ),
+    },
+    {
+        "id": "historia_escolar",
+        "titulo": "V. HISTORIA ESCOLAR",
+        "antes": "espacio",
+        "elementos": (
+            {"tipo": "par", "campos": ("repitencias", "rendimiento_academico"), "posiciones": {"col2_x": 90, "val2_x": 135}},
+            {"tipo": "campo", "campo": "comportamiento_escolar"},
+        ),
+    },
+    {
+        "id": "sustancias",
+        "titulo": "VI. ABUSO O DEPENDENCIAS DE SUSTANCIAS",
+        "antes": "espacio",
+        "elementos": (
+            # Cada campo de una fila ocupa dos celdas: etiqueta y valor
+            {"tipo": "tabla", "encabezados": ("Sustancia", "Consumo"), "anchos": (75, 105),
+             "filas": (("consumo_alcohol",), ("consumo_tabaco",), ("consumo_marihuana",), ("consumo_otras_drogas",))},
+        ),
+    },
+    {
+        "id": "trastornos_alimentarios",
+        "titulo": "VII. TRASTORNOS DE LA CONDUCTA ALIMENTARIOS",
+        "antes": "espacio",
+        "elementos": (
+            {"tipo": "par", "campos": ("peso_maximo", "peso_minimo")},
+            {"tipo": "par", "campos": ("peso_ideal", "altura")},
+            {"tipo": "espacio", "alto": 4},
+            {"tipo": "tabla", "encabezados": ("Trastorno", "Estado", "Trastorno", "Estado"), "anchos": (55, 25, 55, 45),
+             "filas": (
+                 ("arfid", "comedor_emocional"),
+                 ("anorexia", "comedor_nocturno"),
+                 ("bulimia", "picoteador"),
+                 ("t_atracon", "food_craving"),
+             )},
+        ),
+    },
+    {
+        "id": "motivacion",
+        "titulo": "VIII. CONSCIENCIA DEL PROBLEMA Y NIVEL DE MOTIVACIÓN PARA EL CAMBIO",
+        "antes": "pagina",  # Nueva página para esta sección importante
+        "elementos": (
+            {"tipo": "largo", "campo": "factores_origen"},
+            {"tipo": "largo", "campo": "razones_cambiar"},
+            # Paciente apto destacado con un tamaño mayor
+            {"tipo": "campo", "campo": "paciente_apto", "ancho_etiqueta": 60, "estilo": "B", "tamano": 12},
+        ),
+    },
+    {
+        "id": "observaciones",
+        "titulo": "IX. OBSERVACIONES",
+        "antes": 5,
+        "elementos": (
+            {"tipo": "texto", "campo": "observaciones", "fuente": ("Arial", "B", 12)},
+            {"tipo": "firma", "nombre": "psicologa", "rut": "rut_psicologa"},
+        ),
+    },
+)
+
+_TIPOS_ELEMENTO = {
+    "par": ("campos",),
+    "campo": ("campo",),
+    "largo": ("campo",),
+    "texto": ("campo",),
+    "tabla": ("encabezados", "filas", "anchos"),
+    "espacio": ("alto",),
+    "firma": ("nombre", "rut"),
+}
+
+def _campo_esquema(clave):
+    if clave not in CAMPOS:
+        raise ValueError(f"El diseño del informe usa un campo que no está en el esquema: {clave!r}")
+    return CAMPOS[clave]
+
+def _compilar_valor(clave):
+    # Devuelve (etiqueta, funcion que obtiene el texto a partir de los datos)
+    campo = _campo_esquema(clave)
+    if "pdf" not in campo:
+        raise ValueError(f"El campo {clave!r} no tiene etiqueta para el informe en el esquema")
+    formato = campo.get("formato_pdf")
+    if formato == "rut":
+        return campo["pdf"], lambda pdf, datos: pdf.formatear_rut(datos[clave])
+    if formato:
+        return campo["pdf"], lambda pdf, datos: formato.format(datos[clave])
+    return campo["pdf"], lambda pdf, datos: datos[clave]
+
+def _compilar_elemento(elemento):
+    # Devuelve (funcion que dibuja el elemento, campos que utiliza)
+    tipo = elemento.get("tipo")
+    if tipo not in _TIPOS_ELEMENTO:
+        raise ValueError(f"Tipo de elemento desconocido en el diseño del informe: {tipo!r}")
+    faltantes = [clave for clave in _TIPOS_ELEMENTO[tipo] if clave not in elemento]
+    if faltantes:
+        raise ValueError(f"Al elemento {tipo!r} le faltan las claves {faltantes}")
+
+    if tipo == "par":
+        if len(elemento["campos"]) != 2:
+            raise ValueError(f"Un par debe tener dos campos: {elemento['campos']!r}")
+        campo1, campo2 = elemento["campos"]
+        etiqueta1, valor1 = _compilar_valor(campo1)
+        etiqueta2, valor2 = _compilar_valor(campo2)
+        posiciones = elemento.get("posiciones", {})
+
+        def dibujar(pdf, datos):
+            pdf.add_field_pair(etiqueta1, valor1(pdf, datos), etiqueta2, valor2(pdf, datos), **posiciones)
+        return dibujar, (campo1, campo2)
+
+    if tipo == "campo":
+        campo = elemento["campo"]
+        etiqueta, valor = _compilar_valor(campo)
+        opciones = {
+            "label_width": elemento.get("ancho_etiqueta", 45),
+            "value_style": elemento.get("estilo", ''),
+            "value_size": elemento.get("tamano", 10)
+        }
+
+        def dibujar(pdf, datos):
+            pdf.add_field(etiqueta, valor(pdf, datos), **opciones)
+        return dibujar, (campo,)
+
+    if tipo == "largo":
+        campo = elemento["campo"]
+        etiqueta, valor = _compilar_valor(campo)
+
+        def dibujar(pdf, datos):
+            pdf.add_long_field(etiqueta, valor(pdf, datos))
+        return dibujar, (campo,)
+
+    if tipo == "texto":
+        campo = elemento["campo"]
+        _campo_esquema(campo)
+        fuente = elemento.get("fuente", ("Arial", "", 10))
+
+        def dibujar(pdf, datos):
+            pdf.set_font(*fuente)
+            pdf.multi_cell(0, 6, datos[campo], 0, 'L')
+        return dibujar, (campo,)
+
+    if tipo == "tabla":
+        encabezados = tuple(elemento["encabezados"])
+        anchos = tuple(elemento["anchos"])
+        if len(anchos) != len(encabezados):
+            raise ValueError(f"La tabla {encabezados} tiene {len(encabezados)} columnas y {len(anchos)} anchos")
+        filas = []
+        campos = []
+        for fila in elemento["filas"]:
+            if 2 * len(fila) != len(encabezados):
+                raise ValueError(f"La fila {fila!r} no coincide con los encabezados {encabezados}")
+            filas.append(tuple(_compilar_valor(campo) for campo in fila))
+            campos.extend(fila)
+        filas = tuple(filas)
+
+        def dibujar(pdf, datos):
+            data = [[celda for etiqueta, valor in fila for celda in (etiqueta, valor(pdf, datos))] for fila in filas]
+            pdf.add_table(list(encabezados), data, list(anchos))
+        return dibujar, tuple(campos)
+
+    if tipo == "espacio":
+        alto = elemento["alto"]
+        return (lambda pdf, datos: pdf.ln(alto)), ()
+
+    # tipo == "firma"
+    campo_nombre, campo_rut = elemento["nombre"], elemento["rut"]
+    _campo_esquema(campo_nombre)
+    _campo_esquema(campo_rut)
+
+    def dibujar(pdf, datos):
+        pdf.add_signature(datos[campo_nombre], datos[campo_rut])
+    return dibujar, (campo_nombre, campo_rut)
+
+def _compilar_seccion(seccion):
+    antes = seccion.get("antes")
+    if antes not in (None, "espacio", "pagina") and not isinstance(antes, (int, float)):
+        raise ValueError(f"Valor de 'antes' no válido en la sección {seccion.get('titulo')!r}: {antes!r}")
+    operaciones = []
+    campos = []
+    for elemento in seccion["elementos"]:
+        dibujar, campos_elemento = _compilar_elemento(elemento)
+        operaciones.append(dibujar)
+        campos.extend(campos_elemento)
+    return {
+        "id": seccion["id"],
+        "titulo": seccion["titulo"],
+        "antes": antes,
+        "operaciones": tuple(operaciones),
+        "campos": tuple(dict.fromkeys(campos))
+    }
+
+# Función para validar y compilar el diseño del informe
+def compilar_diseno(diseno):
+    secciones = tuple(_compilar_seccion(seccion) for seccion in diseno)
+    ids = [seccion["id"] for seccion in secciones]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"Hay secciones repetidas en el diseño del informe: {ids}")
+    return secciones
+
+# Diseño compilado una sola vez al importar el módulo
+SECCIONES_INFORME = compilar_diseno(DISENO_INFORME)
+
+# Campos que usa el informe, derivados del diseño
+CAMPOS_INFORME = tuple(dict.fromkeys(campo for seccion in SECCIONES_INFORME for campo in seccion["campos"]))
+
+# Función para preparar los datos del formulario para el informe
+def limpiar_datos(datos):
+    datos_limpios = {}
+
+    # Asegurar que todos los campos existan con valores predeterminados
+    for campo in CAMPOS_INFORME:
+        valor = datos.get(campo)
+        if valor is None:
+            datos_limpios[campo] = ""
+        elif isinstance(valor, (int, float)):
+            # Convertir números a strings para seguridad
+            datos_limpios[campo] = str(valor)
+        else:
+            datos_limpios[campo] = valor
+
+    # Textos libres vacíos. Las frases que agrega la API se quitan al recibir la respuesta
+    # (api_anthropic.limpiar_respuesta), no en cada informe
+    for campo, texto_por_defecto in TEXTOS_POR_DEFECTO.items():
+        if not datos_limpios[campo].strip():
+            datos_limpios[campo] = texto_por_defecto
+
+    return datos_limpios
+
+def _dibujar_seccion(pdf, seccion, datos_limpios):
+    antes = seccion["antes"]
+    if antes == "espacio":
+        pdf.check_page_break()
+    elif antes == "pagina":
+        pdf.add_page()
+    elif antes:
+        pdf.ln(antes)
+
+    pdf.add_section_title(seccion["titulo"])
+    for dibujar in seccion["operaciones"]:
+        dibujar(pdf, datos_limpios)
+
+def _estado_pdf(pdf):
+    # Copia superficial del estado del documento, sin el contenido de las páginas
+    return {clave: (dict(valor) if isinstance(valor, dict) else valor)
+            for clave, valor in pdf.__dict__.items() if clave != 'pages'}
+
+def _clave_estado(estado):
+    # Todo lo que influye en cómo se dibuja una sección: posición, página, fuente y colores activos
+    escalares = tuple(sorted((clave, valor) for clave, valor in estado.items()
+                             if valor is None or isinstance(valor, (str, int, float))))
+    return escalares + (tuple(estado['fonts']),)
+
+class CacheSecciones:
+    """Caché LRU de fragmentos de sección ya dibujados.
+
+    Una sección se dibuja igual si recibe los mismos datos y empieza en el mismo estado
+    del documento (página, posición, fuente, colores). En ese caso basta con agregar el
+    contenido guardado a las páginas y restaurar el estado final, sin volver a maquetar."""
+
+    def __init__(self, max_entradas=CACHE_SECCIONES_MAX):
+        self.max_entradas = max_entradas
+        self._fragmentos = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def dibujar(self, pdf, seccion, datos_limpios):
+        entradas = json.dumps([datos_limpios[campo] for campo in seccion["campos"]], ensure_ascii=False)
+        estado_inicial = _estado_pdf(pdf)
+        clave = (seccion["id"], hashlib.sha256(entradas.encode("utf-8")).hexdigest(), _clave_estado(estado_inicial))
+
+        with self._lock:
+            fragmento = self._fragmentos.get(clave)
+            if fragmento is not None:
+                self._fragmentos.move_to_end(clave)
+                self.aciertos += 1
+            else:
+                self.fallos += 1
+
+        if fragmento is not None:
+            self._aplicar(pdf, fragmento)
+            return
+
+        pagina_inicial = pdf.page
+        largo_inicial = len(pdf.pages[pagina_inicial])
+        _dibujar_seccion(pdf, seccion, datos_limpios)
+
+        estado_final = _estado_pdf(pdf)
+        fragmento = {
+            "pagina": pagina_inicial,
+            "agregado": pdf.pages[pagina_inicial][largo_inicial:],
+            "paginas_nuevas": tuple(pdf.pages[n] for n in range(pagina_inicial + 1, pdf.page + 1)),
+            "cambios": {clave_estado: valor for clave_estado, valor in estado_final.items()
+                        if clave_estado not in estado_inicial or estado_inicial[clave_estado] != valor}
+        }
+        with self._lock:
+            self._fragmentos[clave] = fragmento
+            while len(self._fragmentos) > self.max_entradas:
+                self._fragmentos.popitem(last=False)
+
+    def _aplicar(self, pdf, fragmento):
+        pagina = fragmento["pagina"]
+        pdf.pages[pagina] += fragmento["agregado"]
+        for desplazamiento, contenido in enumerate(fragmento["paginas_nuevas"], start=1):
+            pdf.pages[pagina + desplazamiento] = contenido
+        for clave, valor in fragmento["cambios"].items():
+            setattr(pdf, clave, dict(valor) if isinstance(valor, dict) else valor)
+
+    def estadisticas(self):
+        with self._lock:
+            return {"aciertos": self.aciertos, "fallos": self.fallos, "fragmentos": len(self._fragmentos)}
+
+# Caché de secciones compartida por todo el proceso
+CACHE_SECCIONES = CacheSecciones()
+
+# Cambio de fuente aislado que emite fpdf en cada set_font: "BT /F1 10.00 Tf ET"
+_CAMBIO_FUENTE = re.compile(r"BT (/F\d+ [\d.]+ Tf) ET")
+# Líneas de estado gráfico: ancho y extremo de línea, colores de relleno y de trazo
+_ESTADO_GRAFICO = re.compile(r"[\d. ]+ (w|J|g|rg|G|RG)")
+_CLAVE_ESTADO_GRAFICO = {"w": "w", "J": "J", "g": "relleno", "rg": "relleno", "G": "trazo", "RG": "trazo"}
+# Línea de texto de una celda sin borde, opcionalmente con su color: "q 0 g BT 31.18 719.83 Td (texto) Tj ET Q"
+_LINEA_TEXTO = re.compile(r"(q [\d. ]+ (?:g|rg) )?BT (-?\d+\.\d\d) (-?\d+\.\d\d) Td (\((?:[^\\()]|\\.)*\) Tj) ET( Q)?")
+
+# fpdf escribe las coordenadas con dos decimales: se opera en centésimas enteras, sin error de redondeo
+def _centesimas(texto):
+    return int(texto.replace(".", ""))
+
+def _numero(centesimas):
+    enteros, resto = divmod(abs(centesimas), 100)
+    texto = f"{enteros}.{resto:02d}".rstrip("0").rstrip(".") if resto else str(enteros)
+    return "-" + texto if centesimas < 0 else texto
+
+# Función para quitar del contenido de una página los operadores que no cambian lo dibujado
+def compactar_contenido(contenido):
+    """La fuente se declara solo antes de la próxima línea con texto y si difiere de la
+    activa, en vez de en cada set_font (add_field_pair y add_long_field alternan negrita y
+    normal en cada campo); las líneas de estado gráfico que repiten el valor vigente se
+    omiten, y las líneas de texto seguidas con el mismo color (los renglones de un
+    multi_cell) se unen en un solo objeto de texto con desplazamientos relativos, que se
+    comprimen mucho mejor que las coordenadas absolutas."""
+    lineas = []
+    fuente_pendiente = fuente_activa = None
+    estado = {}
+    texto_abierto = None  # (color, cierre, x, y) de la línea de texto que se puede continuar
+    for linea in contenido.split("\n"):
+        cambio = linea.startswith("BT /F") and _CAMBIO_FUENTE.fullmatch(linea)
+        if cambio:
+            fuente_pendiente = cambio.group(1)
+            continue
+        texto = linea.endswith(("Tj ET", "Tj ET Q")) and _LINEA_TEXTO.fullmatch(linea)
+        estado_grafico = not texto and _ESTADO_GRAFICO.fullmatch(linea)
+        if estado_grafico:
+            clave = _CLAVE_ESTADO_GRAFICO[estado_grafico.group(1)]
+            if estado.get(clave) == linea:
+                continue
+            estado[clave] = linea
+        elif linea.startswith("q ") and not linea.endswith(" Q"):
+            # Un q sin su Q en la misma línea: el estado vigente ya no se conoce con certeza
+            estado.clear()
+
+        if texto:
+            color, x, y, mostrar, cierre = texto.groups()
+            x, y = _centesimas(x), _centesimas(y)
+            if (texto_abierto is not None and texto_abierto[:2] == (color, cierre)
+                    and fuente_pendiente in (None, fuente_activa)):
+                # Td es relativo al inicio del renglón anterior: la diferencia exacta conserva la posición
+                lineas[-1] += f" {_numero(x - texto_abierto[2])} {_numero(y - texto_abierto[3])} Td {mostrar}"
+                texto_abierto = (color, cierre, x, y)
+                continue
+        if texto_abierto is not None:
+            lineas[-1] += " ET" + (texto_abierto[1] or "")
+            texto_abierto = None
+
+        if "BT " in linea and fuente_pendiente not in (None, fuente_activa):
+            # Tf fuera de un objeto de texto es válido y se mantiene hasta el próximo Tf
+            lineas.append(fuente_pendiente)
+            fuente_activa = fuente_pendiente
+        if texto:
+            # El objeto de texto queda abierto por si el renglón siguiente lo continúa
+            lineas.append(f"{color or ''}BT {texto.group(2)} {texto.group(3)} Td {mostrar}")
+            texto_abierto = (color, cierre, x, y)
+        else:
+            lineas.append(linea)
+    if texto_abierto is not None:
+        lineas[-1] += " ET" + (texto_abierto[1] or "")
+    return "\n".join(lineas)
+
+# Función para compactar todas las páginas del documento antes de escribirlo
+def compactar_paginas(pdf):
+    for numero, contenido in pdf.pages.items():
+        pdf.pages[numero] = compactar_contenido(contenido)
+    # Las fuentes que ninguna página usa no se declaran en los recursos del documento
+    usadas = set(re.findall(r"^/F(\d+) ", "\n".join(pdf.pages.values()), re.MULTILINE))
+    pdf.fonts = {clave: fuente for clave, fuente in pdf.fonts.items() if str(fuente["i"]) in usadas}
+    pdf.set_compression(True)
+
+# Función para obtener la fecha de creación determinista del informe: la de la evaluación
+def fecha_creacion(datos):
+    try:
+        return datetime.datetime.strptime(str(datos.get('fecha_evaluacion') or ''), '%d-%m-%Y').strftime('%Y%m%d%H%M%S')
+    except ValueError:
+        return FECHA_CREACION_FIJA
+
+# Función para generar el informe en PDF mejorado con mejor uso del espacio horizontal
+def generar_pdf(datos, cache_secciones=CACHE_SECCIONES, determinista=INFORME_DETERMINISTA, compacto=INFORME_COMPACTO):
+    """Genera el informe. Con cache_secciones solo se vuelven a maquetar las secciones
+    cuyos datos o posición de inicio cambiaron desde un informe anterior. En modo
+    determinista la fecha de creación es la de la evaluación, así que los mismos datos
+    producen siempre los mismos bytes. En modo compacto se quitan los operadores
+    redundantes de cada página antes de comprimirla; el informe se ve igual."""
+    datos_limpios = limpiar_datos(datos)
+
+    pdf = PDF()
+    if determinista:
+        pdf.fecha_creacion = fecha_creacion(datos)
+    pdf.compacto = compacto
+    pdf.add_page()
+    for seccion in SECCIONES_INFORME:
+        if cache_secciones is None:
+            _dibujar_seccion(pdf, seccion, datos_limpios)
+        else:
+            cache_secciones.dibujar(pdf, seccion, datos_limpios)
+
+    # Generar el PDF
+    return pdf.output(dest='S').encode('latin1')
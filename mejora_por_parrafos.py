@@ -0,0 +1,77 @@
+import re
+
+# Separador de párrafos al volver a unir un texto
+SEPARADOR = "\n\n"
+
+# Función para dividir un texto en párrafos (separados por líneas en blanco)
+def parrafos(texto):
+    return [parrafo.strip() for parrafo in re.split(r"\n\s*\n", texto or "") if parrafo.strip()]
+
+# Función para decidir qué párrafos de un campo hay que volver a enviar a la API
+def planificar(texto, historial=None):
+    """Compara el texto con el historial de la última mejora del campo.
+
+    Los párrafos que la API ya devolvió (o cuya entrada ya se mejoró) se conservan; los
+    párrafos nuevos o editados se agrupan en tramos consecutivos, que son lo único que se
+    envía. Sin historial se envía el texto completo, como siempre.
+
+    Devuelve {"segmentos": [(texto_fijo, None) | (None, indice_envio)], "envios": [texto],
+    "parrafos": total, "parrafos_enviados": n}."""
+    if not historial or not texto or not texto.strip():
+        return {"segmentos": [(None, 0)], "envios": [texto], "parrafos": len(parrafos(texto)), "parrafos_enviados": len(parrafos(texto))}
+
+    conocidos = historial["pares"]
+    segmentos, envios, tramo = [], [], []
+    enviados = 0
+
+    def cerrar_tramo():
+        nonlocal enviados
+        if tramo:
+            segmentos.append((None, len(envios)))
+            envios.append(SEPARADOR.join(tramo))
+            enviados += len(tramo)
+            tramo.clear()
+
+    lista = parrafos(texto)
+    for parrafo in lista:
+        if parrafo in conocidos:
+            cerrar_tramo()
+            segmentos.append((conocidos[parrafo], None))
+        else:
+            tramo.append(parrafo)
+    cerrar_tramo()
+    return {"segmentos": segmentos, "envios": envios, "parrafos": len(lista), "parrafos_enviados": enviados}
+
+# Función para unir los párrafos conservados con los textos de los tramos enviados
+def unir(plan, textos_envios):
+    if plan["segmentos"] == [(None, 0)]:
+        return textos_envios[0]
+    return SEPARADOR.join(
+        fijo if indice is None else textos_envios[indice].strip()
+        for fijo, indice in plan["segmentos"]
+        if indice is None or textos_envios[indice].strip()
+    )
+
+# Función para armar el resultado del campo a partir de los (texto, error) de cada envío
+def ensamblar(plan, texto_original, resultados):
+    """Si algún tramo falló se devuelve el texto original completo con el error."""
+    for _, error in resultados:
+        if error:
+            return texto_original, error
+    return unir(plan, [texto for texto, _ in resultados]), None
+
+# Función para construir el historial del campo tras una mejora exitosa
+def actualizar_historial(plan, resultados, texto_final):
+    """El historial mapea párrafo de entrada -> párrafo mejorado. Los párrafos del texto final
+    se mapean a sí mismos, para no volver a enviarlos si no se editan."""
+    pares = {}
+    for (fijo, indice) in plan["segmentos"]:
+        if indice is None:
+            continue
+        entrada, salida = parrafos(plan["envios"][indice]), parrafos(resultados[indice][0])
+        # Solo cuando la API conservó la cantidad de párrafos se sabe cuál corresponde a cuál
+        if len(entrada) == len(salida):
+            pares.update(zip(entrada, salida))
+    for parrafo in parrafos(texto_final):
+        pares[parrafo] = parrafo
+    return {"pares": pares}
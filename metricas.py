@@ -0,0 +1,149 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Observaciones recientes que se conservan por serie para calcular percentiles
+METRICAS_VENTANA = int(os.environ.get("METRICAS_VENTANA", "1024"))
+
+# Directorio donde exportar las métricas (vacío = no exportar), formato y frecuencia
+METRICAS_DIR = os.environ.get("METRICAS_DIR") or None
+METRICAS_FORMATO = os.environ.get("METRICAS_FORMATO", "prometheus")  # prometheus o jsonl
+METRICAS_INTERVALO = float(os.environ.get("METRICAS_INTERVALO", "15"))
+
+CUANTILES = (0.5, 0.95, 0.99)
+
+# Descripciones de las métricas conocidas, usadas en la exportación Prometheus
+DESCRIPCIONES = {
+    "app_recarga_segundos": "Duración de cada ejecución del script de Streamlit, por paso del asistente.",
+    "informe_pdf_segundos": "Duración de cada llamada a generar_pdf.",
+    "informe_pdf_bytes": "Tamaño del PDF generado.",
+    "informe_pdf_espera_segundos": "Tiempo desde que se pide un informe hasta que está listo (cola y generación).",
+    "sesion_memoria_bytes": "Memoria aproximada de st.session_state de cada sesión, al final de cada recarga.",
+    "sesion_escritura_segundos": "Duración de cada escritura de cambios en el almacén de sesiones.",
+    "api_anthropic_segundos": "Latencia de cada llamada a la API de Anthropic, por estado de la respuesta.",
+    "api_anthropic_espera_reintento_segundos": "Espera antes de cada reintento (backoff o retry-after).",
+    "api_anthropic_partes_por_texto": "Partes en que se dividió cada texto largo para mejorarlo en paralelo.",
+    "api_anthropic_primer_fragmento_segundos": "Tiempo hasta el primer fragmento de texto en modo streaming.",
+}
+
+class Histograma:
+    """Ventana móvil de observaciones con totales acumulados."""
+
+    def __init__(self, ventana=METRICAS_VENTANA):
+        self._valores = deque(maxlen=ventana)
+        self.cantidad = 0
+        self.suma = 0.0
+
+    def observar(self, valor):
+        self._valores.append(valor)
+        self.cantidad += 1
+        self.suma += valor
+
+    def percentiles(self, cuantiles=CUANTILES):
+        # Percentil por rango más cercano sobre la ventana reciente
+        ordenados = sorted(self._valores)
+        if not ordenados:
+            return {q: None for q in cuantiles}
+        return {q: ordenados[max(math.ceil(q * len(ordenados)) - 1, 0)] for q in cuantiles}
+
+class RegistroMetricas:
+    """Registro de histogramas por (nombre, etiquetas), compartido por todo el proceso."""
+
+    def __init__(self, ventana=METRICAS_VENTANA):
+        self.ventana = ventana
+        self._series = {}
+        self._lock = threading.Lock()
+        self._ultima_exportacion = 0.0
+
+    def observar(self, nombre, valor, **etiquetas):
+        clave = (nombre, tuple(sorted((k, str(v)) for k, v in etiquetas.items())))
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = Histograma(self.ventana)
+            serie.observar(valor)
+
+    @contextmanager
+    def medir(self, nombre, **etiquetas):
+        """Registra en `nombre` los segundos que tarda el bloque."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(nombre, time.perf_counter() - inicio, **etiquetas)
+
+    def resumen(self):
+        with self._lock:
+            series = list(self._series.items())
+        filas = []
+        for (nombre, etiquetas), serie in sorted(series):
+            percentiles = serie.percentiles()
+            filas.append({
+                "metrica": nombre,
+                "etiquetas": dict(etiquetas),
+                "n": serie.cantidad,
+                "suma": serie.suma,
+                "p50": percentiles[0.5],
+                "p95": percentiles[0.95],
+                "p99": percentiles[0.99],
+            })
+        return filas
+
+    def exportar_prometheus(self):
+        """Texto en formato de exposición de Prometheus (tipo summary)."""
+        lineas = []
+        nombre_anterior = None
+        for fila in self.resumen():
+            nombre = fila["metrica"]
+            if nombre != nombre_anterior:
+                if nombre in DESCRIPCIONES:
+                    lineas.append(f"# HELP {nombre} {DESCRIPCIONES[nombre]}")
+                lineas.append(f"# TYPE {nombre} summary")
+                nombre_anterior = nombre
+            base = [f'{k}="{_escapar(v)}"' for k, v in fila["etiquetas"].items()]
+            for q in CUANTILES:
+                valor = fila[f"p{int(q * 100)}"]
+                etiquetas = ",".join(base + [f'quantile="{q}"'])
+                lineas.append(f"{nombre}{{{etiquetas}}} {valor if valor is not None else 'NaN'}")
+            etiquetas = "{" + ",".join(base) + "}" if base else ""
+            lineas.append(f"{nombre}_sum{etiquetas} {fila['suma']}")
+            lineas.append(f"{nombre}_count{etiquetas} {fila['n']}")
+        return "\n".join(lineas) + "\n"
+
+    def exportar_jsonl(self):
+        """Una línea JSON por serie, con marca de tiempo."""
+        ahora = time.time()
+        return "".join(json.dumps(dict(fila, ts=ahora), ensure_ascii=False) + "\n" for fila in self.resumen())
+
+    def exportar_si_corresponde(self, directorio=METRICAS_DIR, formato=METRICAS_FORMATO, intervalo=METRICAS_INTERVALO):
+        """Escribe las métricas en `directorio` como máximo una vez por intervalo.
+
+        En formato prometheus se reemplaza metricas.prom (apto para el textfile collector
+        de node_exporter); en formato jsonl se agrega una instantánea a metricas.jsonl."""
+        if not directorio:
+            return False
+        ahora = time.monotonic()
+        with self._lock:
+            if ahora - self._ultima_exportacion < intervalo:
+                return False
+            self._ultima_exportacion = ahora
+        os.makedirs(directorio, exist_ok=True)
+        if formato == "jsonl":
+            with open(os.path.join(directorio, "metricas.jsonl"), "a", encoding="utf-8") as archivo:
+                archivo.write(self.exportar_jsonl())
+        else:
+            ruta = os.path.join(directorio, "metricas.prom")
+            with open(ruta + ".tmp", "w", encoding="utf-8") as archivo:
+                archivo.write(self.exportar_prometheus())
+            os.replace(ruta + ".tmp", ruta)
+        return True
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# Registro compartido por todos los módulos del proceso
+REGISTRO = RegistroMetricas()
@@ -0,0 +1,14 @@
+import os
+
+# Opciones con que se dibujan los informes. Se leen aquí, sin cargar fpdf, para que
+# informe_pdf y la cola de informes (que las incluye en la huella de cada informe) usen
+# los mismos valores
+
+# Con datos iguales se obtienen exactamente los mismos bytes (INFORME_DETERMINISTA=0 para usar la hora actual)
+INFORME_DETERMINISTA = os.environ.get("INFORME_DETERMINISTA", "1") != "0"
+
+# Salida compacta: sin cambios de fuente ni de estado gráfico redundantes (INFORME_COMPACTO=0 para desactivarla)
+INFORME_COMPACTO = os.environ.get("INFORME_COMPACTO", "1") != "0"
+
+# Argumentos de generar_pdf con las opciones configuradas
+OPCIONES_INFORME = {"determinista": INFORME_DETERMINISTA, "compacto": INFORME_COMPACTO}
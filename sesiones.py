@@ -0,0 +1,106 @@
+import importlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from archivos_privados import archivo_privado
+
+# Almacén del estado de las sesiones: "sqlite" (por defecto), "ninguno" o "modulo:Clase"
+SESIONES_BACKEND = os.environ.get("SESIONES_BACKEND", "sqlite")
+# Base del estado de las sesiones (datos de pacientes: archivo 0600 en un directorio 0700)
+SESIONES_DB = os.environ.get("SESIONES_DB", os.path.join("datos", "sesiones.db"))
+SESIONES_TTL_SEGUNDOS = float(os.environ.get("SESIONES_TTL_SEGUNDOS", str(7 * 24 * 3600)))
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS sesiones (
+    token TEXT PRIMARY KEY,
+    actualizado REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sesion_valores (
+    token TEXT NOT NULL,
+    clave TEXT NOT NULL,
+    valor TEXT NOT NULL,
+    PRIMARY KEY (token, clave)
+) WITHOUT ROWID;
+"""
+
+_SQL_TOCAR = """
+INSERT INTO sesiones (token, actualizado) VALUES (?, ?)
+ON CONFLICT (token) DO UPDATE SET actualizado = excluded.actualizado
+"""
+_SQL_ESCRIBIR = """
+INSERT INTO sesion_valores (token, clave, valor) VALUES (?, ?, ?)
+ON CONFLICT (token, clave) DO UPDATE SET valor = excluded.valor
+"""
+_SQL_VIGENTE = "SELECT 1 FROM sesiones WHERE token = ? AND actualizado >= ?"
+_SQL_CARGAR = "SELECT clave, valor FROM sesion_valores WHERE token = ?"
+
+class SesionesSQLite:
+    """Estado de las sesiones en SQLite, como pares clave-valor por token de sesión.
+
+    Cada clave es una fila, de modo que una recarga escribe solo las claves que
+    cambiaron. Sirve para varias réplicas en el mismo servidor (o con la base en un
+    volumen compartido). Otro almacén, por ejemplo uno en red, debe ofrecer los mismos
+    métodos: cargar(token), escribir(token, cambios, reemplazar) y eliminar(token)."""
+
+    def __init__(self, ruta=SESIONES_DB, ttl_segundos=SESIONES_TTL_SEGUNDOS):
+        self.ruta = ruta
+        self.ttl_segundos = ttl_segundos
+        self._local = threading.local()
+        archivo_privado(ruta)
+        conexion = self._conexion()
+        conexion.executescript(_ESQUEMA)
+        # Descartar las sesiones abandonadas
+        limite = time.time() - self.ttl_segundos
+        with conexion:
+            conexion.execute("DELETE FROM sesion_valores WHERE token IN (SELECT token FROM sesiones WHERE actualizado < ?)", (limite,))
+            conexion.execute("DELETE FROM sesiones WHERE actualizado < ?", (limite,))
+
+    def _conexion(self):
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=5, cached_statements=32)
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            self._local.conexion = conexion
+        return conexion
+
+    def cargar(self, token):
+        """Devuelve {clave: valor} de la sesión, o None si no existe o venció."""
+        conexion = self._conexion()
+        if conexion.execute(_SQL_VIGENTE, (token, time.time() - self.ttl_segundos)).fetchone() is None:
+            return None
+        return {clave: json.loads(valor) for clave, valor in conexion.execute(_SQL_CARGAR, (token,))}
+
+    def escribir(self, token, cambios, reemplazar=False):
+        """Guarda las claves de `cambios`. Con reemplazar=True se borran antes las demás claves."""
+        conexion = self._conexion()
+        with conexion:
+            if reemplazar:
+                conexion.execute("DELETE FROM sesion_valores WHERE token = ?", (token,))
+            conexion.executemany(_SQL_ESCRIBIR, [
+                (token, clave, json.dumps(valor, ensure_ascii=False, default=str)) for clave, valor in cambios.items()
+            ])
+            conexion.execute(_SQL_TOCAR, (token, time.time()))
+
+    def eliminar(self, token):
+        conexion = self._conexion()
+        with conexion:
+            conexion.execute("DELETE FROM sesion_valores WHERE token = ?", (token,))
+            conexion.execute("DELETE FROM sesiones WHERE token = ?", (token,))
+
+# Función para crear el almacén de sesiones configurado
+def crear_almacen_sesiones(backend=SESIONES_BACKEND):
+    """Con "ninguno" el estado vive solo en st.session_state. Con "modulo:Clase" se usa
+    un almacén propio (por ejemplo, en un servidor compartido por todas las réplicas),
+    que se crea sin argumentos y ofrece los métodos de SesionesSQLite."""
+    if backend == "ninguno":
+        return None
+    if backend == "sqlite":
+        return SesionesSQLite()
+    modulo, _, clase = backend.partition(":")
+    if not clase:
+        raise ValueError(f"SESIONES_BACKEND debe ser 'sqlite', 'ninguno' o 'modulo:Clase', no {backend!r}")
+    return getattr(importlib.import_module(modulo), clase)()
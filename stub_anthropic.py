@@ -0,0 +1,209 @@
+"""Servidor local que imita la API de mensajes de Anthropic, para probar la aplicación sin red.
+
+Responde tanto en modo normal (JSON completo) como en modo streaming (server-sent
+events, con la misma secuencia de eventos que la API real). El "texto mejorado" es
+el texto recibido con los espacios normalizados, precedido de una frase introductoria
+como las que suele agregar el modelo. Respeta max_tokens (contando una palabra por
+token) con stop_reason "max_tokens", un mensaje final del asistente como prefijo
+desde el cual continuar, y tool_choice: con una herramienta forzada responde con un
+bloque tool_use (en streaming, eventos input_json_delta) sin frase introductoria.
+
+También puede inyectar fallos (429, 529, 5xx) para probar los reintentos y el circuito:
+las primeras N solicitudes, o una proporción aleatoria (reproducible con --semilla).
+
+Uso:
+    python stub_anthropic.py --puerto 8765 --retardo 0.05
+    python stub_anthropic.py --fallos 0.3 --codigo-fallo 529 --retry-after 1
+    ANTHROPIC_API_URL=http://127.0.0.1:8765/v1/messages streamlit run app.py
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Errores que devuelve la API real para cada código simulado
+TIPOS_ERROR = {429: "rate_limit_error", 500: "api_error", 503: "api_error", 529: "overloaded_error"}
+
+# Frase introductoria que el servidor antepone al texto, como hace a menudo el modelo real
+PREAMBULO = "Aquí está el texto corregido y mejorado:\n\n"
+
+# Función para construir la respuesta simulada a partir del prompt recibido
+def mejorar(prompt, con_preambulo=True):
+    # El texto del paciente va después de la instrucción, separado por una línea en blanco
+    texto = prompt.split("\n\n", 1)[-1]
+    parrafos = [re.sub(r"[ \t]+", " ", parrafo).strip() for parrafo in re.split(r"\n\s*\n", texto)]
+    return (PREAMBULO if con_preambulo else "") + "\n\n".join(parrafo for parrafo in parrafos if parrafo)
+
+class ManejadorAnthropic(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Segundos de espera entre fragmentos en modo streaming
+    retardo = 0.03
+    # Inyección de fallos: primeras N solicitudes, proporción aleatoria, código,
+    # cabecera retry-after (None = sin cabecera) y segundos de espera antes de responder el fallo
+    fallar_primeras = 0
+    probabilidad_fallo = 0.0
+    codigo_fallo = 529
+    retry_after = None
+    demora_fallo = 0.0
+    azar = random.Random(0)
+    solicitudes = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        cuerpo = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"{}")
+        if not self.headers.get("x-api-key"):
+            self._json(401, {"type": "error", "error": {"type": "authentication_error", "message": "x-api-key header is required"}})
+            return
+        if self._debe_fallar():
+            time.sleep(self.demora_fallo)
+            tipo = TIPOS_ERROR.get(self.codigo_fallo, "api_error")
+            cabeceras = {} if self.retry_after is None else {"retry-after": str(self.retry_after)}
+            self._json(self.codigo_fallo, {"type": "error", "error": {"type": tipo, "message": f"Fallo simulado ({tipo})"}}, cabeceras)
+            return
+
+        mensajes = cuerpo["messages"]
+        prompt = next(mensaje["content"] for mensaje in mensajes if mensaje["role"] == "user")
+        continuacion = mensajes[-1]["role"] == "assistant"
+        # Campo de la herramienta forzada, si se pidió respuesta estructurada
+        campo = None
+        if cuerpo.get("tool_choice", {}).get("type") == "tool" and not continuacion:
+            herramienta = next(h for h in cuerpo["tools"] if h["name"] == cuerpo["tool_choice"]["name"])
+            campo = herramienta["input_schema"]["required"][0]
+        texto = mejorar(prompt, con_preambulo=campo is None)
+        # Con un prefijo del asistente se continúa desde ahí
+        if continuacion:
+            prefijo = mensajes[-1]["content"]
+            if not texto.startswith(prefijo):
+                texto = mejorar(prompt, con_preambulo=False)
+            if texto.startswith(prefijo):
+                texto = texto[len(prefijo):]
+        fragmentos = re.findall(r"\S+\s*|\s+", texto)
+        motivo = "end_turn"
+        if len(fragmentos) > cuerpo.get("max_tokens", 1024):
+            fragmentos = fragmentos[:cuerpo["max_tokens"]]
+            motivo = "max_tokens"
+        modelo = cuerpo.get("model", "stub")
+        if campo is not None:
+            bloque = {"type": "tool_use", "id": "toolu_stub", "name": cuerpo["tool_choice"]["name"],
+                      "input": {campo: "".join(fragmentos)} if motivo == "end_turn" else {}}
+        else:
+            bloque = {"type": "text", "text": "".join(fragmentos)}
+        if cuerpo.get("stream"):
+            self._stream(fragmentos, motivo, modelo, bloque, campo)
+        else:
+            self._json(200, {
+                "id": "msg_stub", "type": "message", "role": "assistant", "model": modelo,
+                "content": [bloque],
+                "stop_reason": motivo, "stop_sequence": None,
+                "usage": {"input_tokens": len(prompt.split()), "output_tokens": len(fragmentos)}
+            })
+
+    def _debe_fallar(self):
+        cls = type(self)
+        with cls.lock:
+            cls.solicitudes += 1
+            return cls.solicitudes <= cls.fallar_primeras or cls.azar.random() < cls.probabilidad_fallo
+
+    def _json(self, estado, datos, cabeceras=None):
+        salida = json.dumps(datos, ensure_ascii=False).encode("utf-8")
+        self.send_response(estado)
+        self.send_header("content-type", "application/json")
+        for nombre, valor in (cabeceras or {}).items():
+            self.send_header(nombre, valor)
+        self.send_header("content-length", str(len(salida)))
+        self.end_headers()
+        self.wfile.write(salida)
+
+    def _stream(self, fragmentos, motivo, modelo, bloque, campo):
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.send_header("cache-control", "no-cache")
+        self.send_header("transfer-encoding", "chunked")
+        self.end_headers()
+
+        self._evento("message_start", {"type": "message_start", "message": {
+            "id": "msg_stub", "type": "message", "role": "assistant", "model": modelo, "content": [],
+            "stop_reason": None, "stop_sequence": None, "usage": {"input_tokens": 0, "output_tokens": 0}}})
+        self._evento("content_block_start", {"type": "content_block_start", "index": 0,
+                                             "content_block": dict(bloque, input={}) if campo else dict(bloque, text="")})
+        self._evento("ping", {"type": "ping"})
+        if campo:
+            # El JSON llega en trozos de largo fijo, que pueden cortar secuencias de escape
+            entrada = json.dumps({campo: "".join(fragmentos)}, ensure_ascii=False)
+            if motivo == "max_tokens":
+                entrada = entrada[:-2]
+            for inicio in range(0, len(entrada), 7):
+                time.sleep(self.retardo)
+                self._evento("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                     "delta": {"type": "input_json_delta", "partial_json": entrada[inicio:inicio + 7]}})
+        else:
+            for fragmento in fragmentos:
+                time.sleep(self.retardo)
+                self._evento("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": fragmento}})
+        self._evento("content_block_stop", {"type": "content_block_stop", "index": 0})
+        self._evento("message_delta", {"type": "message_delta", "delta": {"stop_reason": motivo, "stop_sequence": None},
+                                       "usage": {"output_tokens": len(fragmentos)}})
+        self._evento("message_stop", {"type": "message_stop"})
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _evento(self, nombre, datos):
+        trozo = f"event: {nombre}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(trozo):x}\r\n".encode("ascii") + trozo + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, formato, *args):
+        pass
+
+class ServidorStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Los clientes cierran sin aviso las conexiones keep-alive que ya no usan
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+# Función para iniciar el servidor en un hilo; devuelve (servidor, url del endpoint de mensajes)
+def iniciar_servidor(puerto=0, retardo=ManejadorAnthropic.retardo, fallar_primeras=0, probabilidad_fallo=0.0,
+                     codigo_fallo=529, retry_after=None, demora_fallo=0.0, semilla=0):
+    """servidor.RequestHandlerClass.solicitudes cuenta las solicitudes recibidas."""
+    manejador = type("Manejador", (ManejadorAnthropic,), {
+        "retardo": retardo,
+        "fallar_primeras": fallar_primeras,
+        "probabilidad_fallo": probabilidad_fallo,
+        "codigo_fallo": codigo_fallo,
+        "retry_after": retry_after,
+        "demora_fallo": demora_fallo,
+        "azar": random.Random(semilla),
+        "solicitudes": 0,
+        "lock": threading.Lock()
+    })
+    servidor = ServidorStub(("127.0.0.1", puerto), manejador)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_port}/v1/messages"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor local que imita la API de mensajes de Anthropic.")
+    parser.add_argument("--puerto", type=int, default=8765, help="Puerto de escucha (por defecto: 8765)")
+    parser.add_argument("--retardo", type=float, default=ManejadorAnthropic.retardo, help="Segundos entre fragmentos en modo streaming")
+    parser.add_argument("--fallar-primeras", type=int, default=0, help="Responder con error las primeras N solicitudes")
+    parser.add_argument("--fallos", type=float, default=0.0, help="Proporción de solicitudes que fallan al azar (0 a 1)")
+    parser.add_argument("--codigo-fallo", type=int, default=529, help="Código HTTP de los fallos simulados (por defecto: 529)")
+    parser.add_argument("--retry-after", type=float, help="Valor de la cabecera retry-after en los fallos")
+    parser.add_argument("--demora-fallo", type=float, default=0.0, help="Segundos de espera antes de responder un fallo")
+    parser.add_argument("--semilla", type=int, default=0, help="Semilla de los fallos aleatorios")
+    args = parser.parse_args(argv)
+
+    servidor, url = iniciar_servidor(args.puerto, args.retardo, args.fallar_primeras, args.fallos,
+                                     args.codigo_fallo, args.retry_after, args.demora_fallo, args.semilla)
+    print(f"Servidor de prueba escuchando. Use ANTHROPIC_API_URL={url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        servidor.shutdown()
+
+if __name__ == "__main__":
+    main()
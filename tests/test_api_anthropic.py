@@ -0,0 +1,83 @@
+"""Pruebas de la limpieza de respuestas de la API (api_anthropic.limpiar_respuesta).
+
+Uso:
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_anthropic  # noqa: E402
+from api_anthropic import limpiar_respuesta  # noqa: E402
+
+TEXTO = "La paciente refiere ansiedad ante la cirugía.\n\nCuenta con red de apoyo familiar."
+
+class LimpiarRespuestaTest(unittest.TestCase):
+    def test_quita_introduccion(self):
+        for introduccion in (
+            "Aquí está el texto corregido y mejorado:\n\n",
+            "A continuación, presento una versión revisada del texto:\n",
+            "Esta es la versión corregida:\n\n",
+            "He aquí la redacción mejorada:\n",
+            "Informe Psicológico\n\n",
+            "Texto corregido:\n",
+            "Aquí está el texto corregido:\nInforme Psicológico\n",
+        ):
+            with self.subTest(introduccion=introduccion):
+                self.assertEqual(limpiar_respuesta(introduccion + TEXTO), TEXTO)
+
+    def test_quita_comentario_final(self):
+        for comentario in (
+            "He corregido la ortografía y mejorado la coherencia del texto.",
+            "En esta versión se han corregido errores de puntuación.",
+            "Los cambios realizados al texto mejoran la claridad.",
+            "La redacción es ahora más clara y profesional.",
+        ):
+            with self.subTest(comentario=comentario):
+                self.assertEqual(limpiar_respuesta(TEXTO + "\n\n" + comentario), TEXTO)
+
+    def test_conserva_texto_clinico(self):
+        for texto in (
+            "La paciente refiere ansiedad.\n\nLos cambios realizados en su alimentación durante el último año han sido sostenidos.",
+            "La paciente refiere ansiedad.\n\nEn esta versión de su historia, la paciente reconoce episodios de atracones.",
+            "Esta es la versión de la paciente: refiere que come por ansiedad.",
+            "Aquí vive con su esposo: refiere buena relación.\nSin antecedentes.",
+            "Informe Psicológico previo sin hallazgos relevantes.",
+            "La paciente refiere ansiedad.\n\nHe realizado la evaluación en dos sesiones.",
+            "Refiere que el texto de la indicación médica le resultó confuso.",
+        ):
+            with self.subTest(texto=texto):
+                self.assertEqual(limpiar_respuesta(texto), texto)
+
+    def test_solo_en_los_bordes(self):
+        texto = TEXTO + "\n\nHe corregido la redacción del texto.\n\nSin ideación suicida."
+        self.assertEqual(limpiar_respuesta(texto), texto)
+
+    def test_vacio(self):
+        self.assertEqual(limpiar_respuesta(""), "")
+        self.assertIsNone(limpiar_respuesta(None))
+
+class MejorarCompletoTest(unittest.TestCase):
+    def test_respuesta_estructurada_sin_limpiar(self):
+        texto = "Aquí está el texto corregido:\n" + TEXTO
+        resultado = api_anthropic._mejorar_completo("original", lambda prefijo, timeout: (texto, "end_turn", True))
+        self.assertEqual(resultado, (texto, None))
+
+    def test_respuesta_en_texto_libre_se_limpia(self):
+        texto = "Aquí está el texto corregido:\n" + TEXTO
+        resultado = api_anthropic._mejorar_completo("original", lambda prefijo, timeout: (texto, "end_turn", False))
+        self.assertEqual(resultado, (TEXTO, None))
+
+    def test_continuacion_en_texto_libre_se_limpia(self):
+        respuestas = iter([(TEXTO, "max_tokens", True), (" Sin ideación suicida.\n\nHe mejorado la redacción del texto.", "end_turn", False)])
+        resultado = api_anthropic._mejorar_completo("original", lambda prefijo, timeout: next(respuestas))
+        self.assertEqual(resultado, (TEXTO + " Sin ideación suicida.", None))
+
+    def test_json_cortado_se_pide_de_nuevo_como_texto_libre(self):
+        cortado = {"content": [{"type": "tool_use", "input": {api_anthropic.CAMPO_TEXTO: TEXTO[:20]}}], "stop_reason": "max_tokens"}
+        self.assertEqual(api_anthropic._texto_de_respuesta(cortado), ("", True))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+"""Pruebas de las llamadas a la API contra el servidor local (stub_anthropic): reintentos,
+presupuesto de tiempo, circuito y armado de las respuestas en streaming.
+
+Uso:
+    python -m unittest discover tests
+"""
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_anthropic  # noqa: E402
+import stub_anthropic  # noqa: E402
+from circuito_api import ABIERTO, CERRADO, SEMIABIERTO, CircuitoAPI  # noqa: E402
+
+TEXTO = 'La paciente refiere "ansiedad" ante la cirugía 😟.\n\nCuenta con red de apoyo familiar \\ amigos.'
+
+class PruebaConStub(unittest.TestCase):
+    """Cada prueba levanta su propio servidor y usa un circuito nuevo."""
+
+    def iniciar(self, **opciones):
+        servidor, url = stub_anthropic.iniciar_servidor(retardo=0.0, **opciones)
+        self.addCleanup(servidor.server_close)
+        self.addCleanup(servidor.shutdown)
+        parche = mock.patch.multiple(api_anthropic, API_URL=url, CIRCUITO=CircuitoAPI())
+        parche.start()
+        self.addCleanup(parche.stop)
+        return servidor.RequestHandlerClass
+
+    def llamar(self):
+        return api_anthropic._con_reintentos(
+            lambda timeout_lectura: api_anthropic._solicitar_mejora(TEXTO, "clave", timeout_lectura=timeout_lectura))
+
+class ReintentosTest(PruebaConStub):
+    def test_respeta_retry_after(self):
+        manejador = self.iniciar(fallar_primeras=2, retry_after=0.3)
+        with mock.patch.object(api_anthropic, "BACKOFF_BASE", 0.0):
+            inicio = time.monotonic()
+            resultado, error = self.llamar()
+            transcurrido = time.monotonic() - inicio
+        self.assertIsNone(error)
+        self.assertEqual(manejador.solicitudes, 3)
+        self.assertGreaterEqual(transcurrido, 0.6)
+
+    def test_se_detiene_al_agotar_el_presupuesto(self):
+        manejador = self.iniciar(fallar_primeras=100, retry_after=0.4)
+        with mock.patch.multiple(api_anthropic, PRESUPUESTO_SEGUNDOS=1.0, REINTENTOS_MAXIMOS=10):
+            inicio = time.monotonic()
+            resultado, error = self.llamar()
+            transcurrido = time.monotonic() - inicio
+        self.assertIsNone(resultado)
+        self.assertIn("529", error)
+        # 0 s, 0.4 s y 0.8 s; la siguiente espera terminaría después de 1 s
+        self.assertEqual(manejador.solicitudes, 3)
+        self.assertLess(transcurrido, 1.0)
+
+    def test_errores_del_cliente_no_se_reintentan(self):
+        manejador = self.iniciar(fallar_primeras=1, codigo_fallo=400)
+        resultado, error = self.llamar()
+        self.assertIn("400", error)
+        self.assertEqual(manejador.solicitudes, 1)
+        self.assertEqual(api_anthropic.CIRCUITO.estado()["fallos"], 0)
+
+class CircuitoTest(PruebaConStub):
+    def test_abre_prueba_y_cierra(self):
+        # Cada llamada fallida hace dos solicitudes (un reintento); la 5.ª y 6.ª fallan en la prueba
+        manejador = self.iniciar(fallar_primeras=6)
+        circuito = CircuitoAPI(ventana=4, minimo=2, umbral=0.5, pausa_segundos=0.2)
+        with mock.patch.multiple(api_anthropic, CIRCUITO=circuito, REINTENTOS_MAXIMOS=1, BACKOFF_BASE=0.0):
+            # Un solo fallo por llamada, aunque haya reintentado
+            self.assertIsNotNone(self.llamar()[1])
+            self.assertEqual((manejador.solicitudes, circuito.estado()["fallos"]), (2, 1))
+            self.assertEqual(circuito.estado()["estado"], CERRADO)
+            self.llamar()
+            self.assertEqual(circuito.estado()["estado"], ABIERTO)
+
+            # Abierto: falla sin llamar a la API
+            resultado, error = self.llamar()
+            self.assertIn("fallas reiteradas", error)
+            self.assertEqual(manejador.solicitudes, 4)
+
+            # Pasada la pausa, una llamada de prueba (con sus reintentos) que falla lo vuelve a abrir
+            time.sleep(0.25)
+            estados = []
+            def solicitar(timeout_lectura):
+                estados.append(circuito.estado()["estado"])
+                return api_anthropic._solicitar_mejora(TEXTO, "clave", timeout_lectura=timeout_lectura)
+            self.assertIsNotNone(api_anthropic._con_reintentos(solicitar)[1])
+            self.assertEqual(estados, [SEMIABIERTO, SEMIABIERTO])
+            self.assertEqual(circuito.estado()["estado"], ABIERTO)
+            self.assertEqual(circuito.aperturas, 2)
+
+            # La siguiente prueba resulta y lo cierra
+            time.sleep(0.25)
+            resultado, error = self.llamar()
+            self.assertIsNone(error)
+            self.assertEqual(circuito.estado()["estado"], CERRADO)
+            self.assertEqual(manejador.solicitudes, 7)
+
+class StreamingTest(PruebaConStub):
+    def mejorar_en_streaming(self, texto):
+        recibido = []
+        def descartar(caracteres):
+            recibido[:] = ["".join(recibido)[:-caracteres]]
+        resultado = api_anthropic.mejorar_texto_en_streaming(texto, "clave", recibido.append, al_descartar=descartar)
+        return resultado, "".join(recibido)
+
+    def test_arma_el_texto_del_json_en_trozos(self):
+        # El JSON llega en trozos de 7 caracteres que cortan escapes y pares sustitutos
+        self.iniciar()
+        (texto, error), recibido = self.mejorar_en_streaming(TEXTO)
+        self.assertIsNone(error)
+        self.assertEqual(texto, TEXTO)
+        self.assertEqual(recibido, TEXTO)
+        self.assertEqual(api_anthropic.mejorar_texto_con_anthropic(TEXTO, "clave"), (texto, None))
+
+    def test_json_cortado_igual_que_sin_streaming(self):
+        self.iniciar()
+        with mock.patch.multiple(api_anthropic, MAX_TOKENS=8, MAX_CONTINUACIONES=5):
+            sin_streaming = api_anthropic.mejorar_texto_con_anthropic(TEXTO, "clave")
+            (texto, error), recibido = self.mejorar_en_streaming(TEXTO)
+        self.assertIsNone(error)
+        self.assertEqual((texto, error), sin_streaming)
+        # Lo mostrado del JSON cortado se retiró; queda la respuesta en texto libre (las
+        # continuaciones pueden repetir un espacio en el punto de corte)
+        self.assertEqual(recibido.split(), (stub_anthropic.PREAMBULO + TEXTO).split())
+
+if __name__ == "__main__":
+    unittest.main()